@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from telegram import Bot
+from telegram.error import TelegramError
+
+from fair_scheduler import chat_context
+from metrics import inc, track_request
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "10"))
+# Сколько задач одного чата может выполняться одновременно: остальные воркеры
+# достаются другим чатам, даже если один пользователь прислал сотню ссылок.
+JOB_MAX_PER_CHAT = int(os.getenv("JOB_MAX_PER_CHAT", "2"))
+
+
+@dataclass
+class Job:
+    """Фоновая задача, сохраненная в очереди."""
+    id: int
+    kind: str
+    payload: dict
+    chat_id: int
+    message_id: int | None
+    attempts: int
+
+
+JobHandler = Callable[[Bot, Job], Awaitable[None]]
+
+
+class JobStore:
+    """Постоянная очередь фоновых задач в SQLite.
+
+    Задачи, которые выполнялись в момент остановки бота, при следующем
+    запуске возвращаются в очередь. Чаты обслуживаются по кругу: следующей
+    берется самая ранняя задача того чата, у которого меньше всего задач
+    уже выполнено в текущем круге, и не больше ``max_per_chat`` задач одного
+    чата выполняются одновременно.
+    """
+
+    def __init__(self, path: str = JOB_DB_PATH, max_per_chat: int = JOB_MAX_PER_CHAT):
+        self.path = path
+        self.max_per_chat = max(1, max_per_chat)
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    message_id INTEGER,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    run_after REAL NOT NULL,
+                    error TEXT,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_pending ON jobs(status, run_after, id);
+            """)
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return cursor
+
+    def _enqueue_sync(self, kind: str, payload: dict, chat_id: int, message_id: int | None) -> int:
+        now = time.time()
+        cursor = self._execute(
+            "INSERT INTO jobs (kind, payload, chat_id, message_id, run_after, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload, ensure_ascii=False), chat_id, message_id, now, now),
+        )
+        return cursor.lastrowid
+
+    def _claim_sync(self) -> Job | None:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                """
+                UPDATE jobs SET status = 'running', attempts = attempts + 1
+                WHERE id = (
+                    WITH running AS (
+                        SELECT chat_id, COUNT(*) AS n FROM jobs WHERE status = 'running' GROUP BY chat_id
+                    ), ready AS (
+                        SELECT id, chat_id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY id) AS turn
+                        FROM jobs WHERE status = 'pending' AND run_after <= ?
+                    )
+                    SELECT ready.id FROM ready LEFT JOIN running USING (chat_id)
+                    WHERE COALESCE(running.n, 0) < ?
+                    ORDER BY ready.turn + COALESCE(running.n, 0), ready.id LIMIT 1
+                )
+                RETURNING id, kind, payload, chat_id, message_id, attempts
+                """,
+                (time.time(), self.max_per_chat),
+            ).fetchone()
+            conn.commit()
+        if not row:
+            return None
+        return Job(id=row[0], kind=row[1], payload=json.loads(row[2]), chat_id=row[3], message_id=row[4], attempts=row[5])
+
+    async def enqueue(self, kind: str, payload: dict, chat_id: int, message_id: int | None = None) -> int:
+        """Добавляет задачу в очередь и возвращает ее идентификатор."""
+        return await asyncio.to_thread(self._enqueue_sync, kind, payload, chat_id, message_id)
+
+    async def claim(self) -> Job | None:
+        """Забирает следующую готовую к выполнению задачу."""
+        return await asyncio.to_thread(self._claim_sync)
+
+    async def complete(self, job: Job) -> None:
+        """Удаляет выполненную задачу из очереди."""
+        await asyncio.to_thread(self._execute, "DELETE FROM jobs WHERE id = ?", (job.id,))
+
+    async def retry(self, job: Job, error: str, delay: float) -> None:
+        """Возвращает задачу в очередь с задержкой, сохраняя обновленный payload."""
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET status = 'pending', run_after = ?, error = ?, payload = ? WHERE id = ?",
+            (time.time() + delay, error, json.dumps(job.payload, ensure_ascii=False), job.id),
+        )
+
+    async def fail(self, job: Job, error: str) -> None:
+        """Помечает задачу как окончательно неудачную."""
+        await asyncio.to_thread(
+            self._execute, "UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", (error, job.id)
+        )
+
+    async def requeue_running(self) -> int:
+        """Возвращает в очередь задачи, прерванные остановкой бота."""
+        cursor = await asyncio.to_thread(
+            self._execute, "UPDATE jobs SET status = 'pending' WHERE status = 'running'"
+        )
+        return cursor.rowcount
+
+    async def pending_count(self) -> int:
+        """Возвращает число задач, ожидающих выполнения."""
+        def count() -> int:
+            with self._lock:
+                return self._connect().execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')"
+                ).fetchone()[0]
+        return await asyncio.to_thread(count)
+
+    def _backlog_sync(self, chat_id: int) -> tuple[int, int]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT chat_id, COUNT(*) FROM jobs WHERE status = 'pending' GROUP BY chat_id"
+            ).fetchall()
+        queued = dict(rows)
+        # Новая задача чата будет k-й в его очереди; при обходе по кругу до нее
+        # успеют начаться не больше k задач каждого другого чата.
+        turn = queued.get(chat_id, 0) + 1
+        position = turn + sum(min(count, turn) for other, count in queued.items() if other != chat_id)
+        return queued.get(chat_id, 0), position
+
+    async def backlog(self, chat_id: int) -> tuple[int, int]:
+        """Возвращает число ожидающих задач чата и примерную позицию его новой задачи в общей очереди."""
+        return await asyncio.to_thread(self._backlog_sync, chat_id)
+
+    def close(self) -> None:
+        """Закрывает соединение с базой."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+async def update_status(bot: Bot, job: Job, text: str) -> None:
+    """Обновляет статусное сообщение задачи в чате."""
+    try:
+        if job.message_id:
+            await bot.edit_message_text(chat_id=job.chat_id, message_id=job.message_id, text=text)
+        else:
+            await bot.send_message(chat_id=job.chat_id, text=text)
+    except TelegramError as e:
+        logger.warning(f"Не удалось обновить статус задачи {job.id}: {e}")
+
+
+class JobWorkerPool:
+    """Пул воркеров, выполняющих задачи из ``JobStore``.
+
+    Обработчики регистрируются по виду задачи. Исключение обработчика
+    приводит к повтору с задержкой, пока не исчерпано ``max_attempts``.
+    """
+
+    def __init__(self, store: JobStore, handlers: dict, workers: int = JOB_WORKERS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, retry_delay: float = JOB_RETRY_DELAY):
+        self.store = store
+        self.handlers: dict[str, JobHandler] = handlers
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._bot: Bot | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    async def start(self, bot: Bot) -> None:
+        """Запускает воркеры и возвращает в очередь прерванные задачи."""
+        self._bot = bot
+        self._stopping = False
+        requeued = await self.store.requeue_running()
+        if requeued:
+            logger.info(f"Возвращено в очередь прерванных задач: {requeued}")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._wakeup.set()
+
+    async def submit(self, kind: str, payload: dict, chat_id: int, message_id: int | None = None) -> int:
+        """Ставит задачу в очередь и будит свободный воркер."""
+        job_id = await self.store.enqueue(kind, payload, chat_id, message_id)
+        self._wakeup.set()
+        return job_id
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Останавливает воркеры, давая текущим задачам завершиться."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._tasks:
+            done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+        self.store.close()
+
+    async def _worker(self, number: int) -> None:
+        while not self._stopping:
+            # Сбрасываем событие до проверки очереди, чтобы не пропустить новую задачу
+            self._wakeup.clear()
+            job = await self.store.claim()
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: Job) -> None:
+        handler = self.handlers.get(job.kind)
+        if handler is None:
+            logger.error(f"Нет обработчика для задачи вида '{job.kind}'")
+            await self.store.fail(job, "unknown kind")
+            return
+
+        try:
+            with track_request(job.kind), chat_context(job.chat_id):
+                await handler(self._bot, job)
+            await self.store.complete(job)
+        except asyncio.CancelledError:
+            # Бот останавливается: задача будет выполнена после перезапуска
+            raise
+        except Exception as e:
+            inc("job_failures_total", kind=job.kind)
+            if job.attempts < self.max_attempts:
+                delay = self.retry_delay * job.attempts
+                logger.warning(f"Задача {job.id} ({job.kind}) не выполнена: {e}. Повтор через {delay:.0f} с.")
+                await self.store.retry(job, str(e), delay)
+            else:
+                logger.error(f"Задача {job.id} ({job.kind}) окончательно не выполнена: {e}")
+                await self.store.fail(job, str(e))
+                await update_status(self._bot, job, "Не удалось выполнить задачу. Проверьте логи.")
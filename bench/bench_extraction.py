@@ -0,0 +1,64 @@
+"""Сравнение движков извлечения HTML на локальном корпусе страниц.
+
+Запуск из корня репозитория:
+
+    python bench/bench_extraction.py [--corpus bench/html_corpus] [--repeat 20]
+
+Для каждого доступного движка печатает среднее время извлечения на страницу и
+размер полученного текста в сравнении с прежним способом (``legacy``).
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from html_extractor import available_extractors, extract  # noqa: E402
+
+
+def bench_engine(engine: str, pages: dict, repeat: int) -> dict:
+    timings = {}
+    sizes = {}
+    for name, html in pages.items():
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = extract(html, engine)
+            samples.append(time.perf_counter() - started)
+        timings[name] = statistics.median(samples)
+        sizes[name] = len(result["text"])
+    return {"timings": timings, "sizes": sizes}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=os.path.join(os.path.dirname(__file__), "html_corpus"))
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    pages = {path.name: path.read_text(encoding="utf-8") for path in sorted(Path(args.corpus).glob("*.html"))}
+    if not pages:
+        sys.exit(f"В {args.corpus} нет .html файлов.")
+
+    engines = available_extractors()
+    if "legacy" not in engines:
+        sys.exit("Для сравнения нужен beautifulsoup4 (движок legacy).")
+
+    results = {engine: bench_engine(engine, pages, args.repeat) for engine in engines}
+    baseline = results["legacy"]
+
+    print(f"{'page':<22} {'engine':<11} {'ms':>8} {'speedup':>8} {'chars':>8} {'vs legacy':>10}")
+    for name in pages:
+        for engine in engines:
+            timing = results[engine]["timings"][name]
+            size = results[engine]["sizes"][name]
+            speedup = baseline["timings"][name] / timing if timing else float("inf")
+            ratio = size / baseline["sizes"][name] if baseline["sizes"][name] else float("inf")
+            print(f"{name:<22} {engine:<11} {timing * 1000:>8.2f} {speedup:>7.1f}x {size:>8} {ratio:>9.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""Локальные заглушки Notion API, OpenAI API и сайтов для нагрузочных тестов.
+
+Каждая заглушка — HTTP-сервер в отдельном потоке с настраиваемыми сбоями
+(``Faults``): задержкой ответа, долей ответов 429 и долей ответов 5xx. Бот
+направляется на них переменными ``NOTION_BASE_URL``, ``OPENAI_BASE_URL`` и
+ссылками на ``StaticSite``, поэтому тест не требует сети.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+ANALYSIS_TEMPLATE = (
+    "Title: {title}\n"
+    "Tags: нагрузка, тест, заметки\n"
+    "Summary: Синтетическое саммари страницы для нагрузочного теста. "
+    "Оно достаточно длинное, чтобы ответ приходил несколькими кусками потока, "
+    "а бот успевал показать промежуточный результат пользователю."
+)
+TRANSCRIPT_TEXT = "Синтетическая расшифровка голосового сообщения для нагрузочного теста."
+
+
+@dataclass
+class Faults:
+    """Поведение заглушки: задержка ответа (секунд), доля ответов 429 и 5xx."""
+    latency: float = 0.0
+    jitter: float = 0.0
+    rate_limited: float = 0.0
+    errors: float = 0.0
+    retry_after: float = 1.0
+
+    def delay(self) -> None:
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def pick_failure(self) -> int | None:
+        """Возвращает код ответа-сбоя или ``None``, если запрос надо обработать."""
+        roll = random.random()
+        if roll < self.rate_limited:
+            return 429
+        if roll < self.rate_limited + self.errors:
+            return 503
+        return None
+
+
+class FakeService:
+    """Базовый HTTP-сервер заглушки в отдельном потоке.
+
+    Наследники реализуют ``route(method, path, body)`` и ``error_body(status)``;
+    ``route`` возвращает ``(статус, тело)`` или генератор кусков для потокового ответа.
+    """
+
+    name = "service"
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, faults: Faults | None = None):
+        self.faults = faults or Faults()
+        self.calls = defaultdict(int)
+        self.failures = defaultdict(int)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> dict:
+        return {"calls": dict(self.calls), "failures": dict(self.failures)}
+
+    def route(self, method: str, path: str, body: bytes, headers) -> tuple:
+        raise NotImplementedError
+
+    def error_body(self, status: int) -> dict:
+        return {"error": {"status": status}}
+
+    def _count(self, counter: dict, key: str) -> None:
+        with self._lock:
+            counter[key] += 1
+
+    def _make_handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):  # noqa: A002
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str = "application/json", headers: dict | None = None) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self, chunks, content_type: str) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for chunk in chunks:
+                    self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _handle(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                path = urlsplit(self.path).path
+                service.faults.delay()
+                failure = service.faults.pick_failure()
+                if failure:
+                    service._count(service.failures, str(failure))
+                    headers = {"Retry-After": f"{service.faults.retry_after:g}"} if failure == 429 else None
+                    self._send(failure, json.dumps(service.error_body(failure)).encode(), headers=headers)
+                    return
+                result = service.route(self.command, path, body, self.headers)
+                if len(result) == 3:
+                    # Потоковый ответ: (None, content-type, генератор кусков)
+                    try:
+                        self._stream(result[2], result[1])
+                    except (BrokenPipeError, ConnectionResetError):
+                        pass  # Клиент прервал поток (например, при остановке бота)
+                    return
+                status, payload = result
+                if isinstance(payload, (bytes, str)):
+                    content = payload.encode() if isinstance(payload, str) else payload
+                    self._send(status, content, "text/html; charset=utf-8")
+                else:
+                    self._send(status, json.dumps(payload, ensure_ascii=False).encode())
+
+            do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+        return Handler
+
+
+# === Notion ===
+
+def _with_plain_text(properties: dict) -> dict:
+    """Добавляет ``plain_text`` в rich_text и title, как это делает Notion в ответах."""
+    result = {}
+    for name, value in properties.items():
+        value = dict(value)
+        for kind in ("title", "rich_text"):
+            if kind in value:
+                value[kind] = [{**part, "plain_text": part.get("text", {}).get("content", "")} for part in value[kind]]
+                value["type"] = kind
+        result[name] = value
+    return result
+
+
+class FakeNotionApi(FakeService):
+    """Заглушка API Notion: схемы баз, создание и изменение страниц, запросы к базам.
+
+    Созданные страницы хранятся в памяти, поэтому ``databases.query`` возвращает
+    их (без учета фильтров) — этого достаточно для индекса ссылок и поиска
+    страниц, созданных прерванной попыткой записи.
+    """
+
+    name = "notion"
+
+    def __init__(self, *args, task_options: tuple = ("Высокая", "Средняя", "Низкая"), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.task_options = task_options
+        self.pages: dict = {}
+        self._pages_by_db = defaultdict(list)
+
+    def error_body(self, status: int) -> dict:
+        code = "rate_limited" if status == 429 else "service_unavailable"
+        return {"object": "error", "status": status, "code": code, "message": f"Bench: {code}"}
+
+    def database(self, database_id: str) -> dict:
+        return {
+            "object": "database",
+            "id": database_id,
+            "properties": {
+                "Name": {"id": "title", "name": "Name", "type": "title", "title": {}},
+                "URL": {"id": "url", "name": "URL", "type": "url", "url": {}},
+                "Tags": {"id": "tags", "name": "Tags", "type": "multi_select",
+                         "multi_select": {"options": [{"name": "нагрузка"}, {"name": "тест"}]}},
+                "Priority": {"id": "prio", "name": "Priority", "type": "select",
+                             "select": {"options": [{"name": option} for option in self.task_options]}},
+            },
+        }
+
+    def route(self, method: str, path: str, body: bytes, headers) -> tuple:
+        parts = path.strip("/").split("/")[1:]  # без версии "v1"
+        data = json.loads(body) if body else {}
+        if parts[:1] == ["databases"] and len(parts) == 2 and method == "GET":
+            self._count(self.calls, "databases.retrieve")
+            return 200, self.database(parts[1])
+        if parts[:1] == ["databases"] and parts[2:] == ["query"]:
+            self._count(self.calls, "databases.query")
+            with self._lock:
+                results = list(reversed(self._pages_by_db[parts[1]]))[:data.get("page_size", 100)]
+            return 200, {"object": "list", "results": results, "has_more": False, "next_cursor": None}
+        if parts == ["pages"] and method == "POST":
+            self._count(self.calls, "pages.create")
+            page_id = str(uuid.uuid4())
+            database_id = data.get("parent", {}).get("database_id")
+            page = {
+                "object": "page",
+                "id": page_id,
+                "created_time": datetime.now(timezone.utc).isoformat(),
+                "parent": {"database_id": database_id},
+                "properties": _with_plain_text(data.get("properties", {})),
+                "url": f"https://www.notion.so/{page_id.replace('-', '')}",
+            }
+            with self._lock:
+                self.pages[page_id] = page
+                self._pages_by_db[database_id].append(page)
+            return 200, page
+        if parts[:1] == ["pages"] and len(parts) == 2 and method == "PATCH":
+            self._count(self.calls, "pages.update")
+            with self._lock:
+                page = self.pages.setdefault(parts[1], {"object": "page", "id": parts[1], "properties": {}})
+                page["properties"].update(_with_plain_text(data.get("properties", {})))
+            return 200, page
+        if parts[:1] == ["blocks"] and parts[2:] == ["children"]:
+            self._count(self.calls, "blocks.children.append")
+            return 200, {"object": "list", "results": data.get("children", []), "has_more": False}
+        self._count(self.calls, f"{method} {path}")
+        return 404, {"object": "error", "status": 404, "code": "object_not_found", "message": path}
+
+
+# === OpenAI ===
+
+class FakeOpenAI(FakeService):
+    """Заглушка OpenAI API: chat.completions (обычные и потоковые), audio.transcriptions и models.
+
+    ``stream_interval`` — пауза между кусками потокового ответа, ``whisper_latency`` —
+    дополнительная задержка расшифровки поверх общей ``faults.latency``.
+    """
+
+    name = "openai"
+
+    def __init__(self, *args, stream_interval: float = 0.02, whisper_latency: float = 0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stream_interval = stream_interval
+        self.whisper_latency = whisper_latency
+        self.tokens = defaultdict(int)
+
+    def error_body(self, status: int) -> dict:
+        kind = "rate_limit_error" if status == 429 else "server_error"
+        return {"error": {"message": f"Bench: {kind}", "type": kind, "code": None}}
+
+    def _usage(self, prompt: str, completion: str) -> dict:
+        # Грубая оценка: ~4 символа на токен
+        usage = {"prompt_tokens": len(prompt) // 4 + 1, "completion_tokens": len(completion) // 4 + 1}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        with self._lock:
+            self.tokens["prompt"] += usage["prompt_tokens"]
+            self.tokens["completion"] += usage["completion_tokens"]
+        return usage
+
+    def stats(self) -> dict:
+        return {**super().stats(), "tokens": dict(self.tokens)}
+
+    def route(self, method: str, path: str, body: bytes, headers) -> tuple:
+        if path.endswith("/audio/transcriptions"):
+            self._count(self.calls, "audio.transcriptions")
+            if self.whisper_latency:
+                time.sleep(self.whisper_latency)
+            return 200, {"text": TRANSCRIPT_TEXT}
+        if path.endswith("/models"):
+            self._count(self.calls, "models.list")
+            return 200, {"object": "list", "data": [{"id": "gpt-bench", "object": "model", "owned_by": "bench"}]}
+        if not path.endswith("/chat/completions"):
+            self._count(self.calls, f"{method} {path}")
+            return 404, self.error_body(404)
+
+        request = json.loads(body)
+        prompt = "\n".join(str(message.get("content", "")) for message in request.get("messages", []))
+        content = ANALYSIS_TEMPLATE.format(title=f"Страница {uuid.uuid4().hex[:8]}")
+        model = request.get("model", "gpt-bench")
+        if not request.get("stream"):
+            self._count(self.calls, "chat.completions")
+            return 200, {
+                "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": self._usage(prompt, content),
+            }
+
+        self._count(self.calls, "chat.completions.stream")
+        include_usage = (request.get("stream_options") or {}).get("include_usage")
+
+        def events():
+            base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+            words = content.split(" ")
+            for index, word in enumerate(words):
+                piece = word if index == 0 else " " + word
+                delta = {"role": "assistant", "content": piece} if index == 0 else {"content": piece}
+                choice = {"index": 0, "delta": delta, "finish_reason": None}
+                yield f"data: {json.dumps({**base, 'choices': [choice]}, ensure_ascii=False)}\n\n".encode()
+                time.sleep(self.stream_interval)
+            yield f"data: {json.dumps({**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n".encode()
+            if include_usage:
+                yield f"data: {json.dumps({**base, 'choices': [], 'usage': self._usage(prompt, content)})}\n\n".encode()
+            yield b"data: [DONE]\n\n"
+
+        return None, "text/event-stream", events()
+
+
+# === Сайты ===
+
+class StaticSite(FakeService):
+    """Отдает страницы из HTML-корпуса по адресам ``/<номер>/<имя файла>``.
+
+    Номер дает уникальную ссылку и дописывается в текст страницы, поэтому ни
+    кэш ссылок, ни кэш по содержимому, ни проверка дубликатов не мешают
+    измерениям: каждая ссылка проходит весь путь до OpenAI.
+    """
+
+    name = "site"
+
+    def __init__(self, corpus: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pages = {path.name: path.read_bytes() for path in sorted(Path(corpus).glob("*.html"))}
+        if not self.pages:
+            raise ValueError(f"В {corpus} нет .html файлов.")
+
+    def url(self, index: int) -> str:
+        names = sorted(self.pages)
+        return f"{self.base_url}/{index}/{names[index % len(names)]}"
+
+    def route(self, method: str, path: str, body: bytes, headers) -> tuple:
+        self._count(self.calls, "GET")
+        prefix, _, name = path.strip("/").rpartition("/")
+        page = self.pages.get(name)
+        if page is None:
+            return 404, b"<html><body>not found</body></html>"
+        return 200, page.replace(b"</body>", f"<p>Копия страницы {prefix}.</p></body>".encode(), 1)
@@ -0,0 +1,195 @@
+"""Локальная заглушка Telegram Bot API для нагрузочных тестов.
+
+Отвечает на методы, которые вызывает бот (getMe, getUpdates, sendMessage,
+editMessageText, getFile, setWebhook и т.д.), отдает обновления через
+getUpdates в режиме polling и записывает время каждого ответа бота в чат,
+чтобы измерять задержку обработки обновлений. Подписчики (``subscribe()``)
+получают все сообщения бота, что позволяет вести многошаговые диалоги.
+"""
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+# Методы, которыми бот отвечает пользователю.
+REPLY_METHODS = {"sendMessage", "editMessageText", "editMessageReplyMarkup", "sendChatAction"}
+
+
+class FakeBotApi:
+    """Заглушка Bot API в отдельном потоке.
+
+    ``push_update()`` кладет обновление в очередь getUpdates, а
+    ``expect_reply()`` регистрирует момент отправки обновления: первый ответ
+    бота в тот же чат после этого момента дает одно измерение задержки.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081, files: dict | None = None):
+        self.host = host
+        self.port = port
+        self.files = files or {}
+        self._updates: list = []
+        self._updates_cond = threading.Condition()
+        self._pending = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self.latencies: list = []
+        self.calls = defaultdict(int)
+        self.connected = threading.Event()
+        self._listeners: list = []
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        # При port=0 система выбирает свободный порт
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def expect_reply(self, chat_id: int, sent_at: float) -> None:
+        with self._lock:
+            self._pending[chat_id].append(sent_at)
+
+    def subscribe(self, listener) -> None:
+        """Регистрирует ``listener(method, params, message)``, вызываемый на каждый ответ бота.
+
+        Вызов происходит в потоке сервера; ``message`` — отданное боту сообщение.
+        """
+        self._listeners.append(listener)
+
+    def push_update(self, update: dict) -> None:
+        with self._updates_cond:
+            self._updates.append(update)
+            self._updates_cond.notify_all()
+
+    def _record_reply(self, chat_id) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            queue = self._pending.get(chat_id)
+            if queue:
+                self.latencies.append(now - queue.popleft())
+
+    def _next_message(self, chat_id, text: str | None, message_id=None) -> dict:
+        if message_id is None:
+            with self._lock:
+                self._message_id += 1
+                message_id = self._message_id
+        return {
+            "message_id": int(message_id),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id or 0), "type": "private"},
+            "from": BOT_USER,
+            "text": text or "",
+        }
+
+    def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        timeout = min(float(params.get("timeout") or 0), 1.0)
+        deadline = time.monotonic() + timeout
+        with self._updates_cond:
+            while True:
+                ready = [u for u in self._updates if u["update_id"] >= offset]
+                # Подтвержденные обновления больше не нужны
+                self._updates = ready
+                if ready or time.monotonic() >= deadline:
+                    return ready[:100]
+                self._updates_cond.wait(deadline - time.monotonic())
+
+    def handle(self, method: str, params: dict):
+        self.calls[method] += 1
+        if method == "getMe":
+            self.connected.set()
+            return BOT_USER
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if method == "getFile":
+            file_id = params.get("file_id")
+            return {"file_id": file_id, "file_unique_id": file_id, "file_path": f"voice/{file_id}.ogg",
+                    "file_size": len(self.files.get(file_id, b""))}
+        if method in REPLY_METHODS:
+            chat_id = params.get("chat_id")
+            if method != "sendChatAction":
+                self._record_reply(int(chat_id) if chat_id is not None else None)
+            if method == "sendChatAction":
+                return True
+            # Отредактированное сообщение сохраняет свой идентификатор
+            message = self._next_message(chat_id, params.get("text"), params.get("message_id"))
+            for listener in self._listeners:
+                listener(method, params, message)
+            return message
+        return True
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):  # noqa: A002
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str = "application/json") -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Бот остановился, не дождавшись ответа на long polling
+                    pass
+
+            def _params(self) -> dict:
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                params = dict(parse_qsl(urlsplit(self.path).query))
+                content_type = self.headers.get("Content-Type", "")
+                if raw and "json" in content_type:
+                    params.update(json.loads(raw))
+                elif raw and "x-www-form-urlencoded" in content_type:
+                    params.update(parse_qsl(raw.decode()))
+                elif raw and "multipart/form-data" in content_type:
+                    params.update(_parse_multipart(raw, content_type))
+                return params
+
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                if path.startswith("/file/"):
+                    file_id = path.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+                    self._send(200, api.files.get(file_id, b""), "application/octet-stream")
+                    return
+                self.do_POST()
+
+            def do_POST(self):
+                method = urlsplit(self.path).path.rsplit("/", 1)[-1]
+                try:
+                    result = api.handle(method, self._params())
+                    body = json.dumps({"ok": True, "result": result}).encode()
+                except Exception as e:  # pragma: no cover - диагностика заглушки
+                    body = json.dumps({"ok": False, "error_code": 400, "description": str(e)}).encode()
+                self._send(200, body)
+
+        return Handler
+
+
+def _parse_multipart(raw: bytes, content_type: str) -> dict:
+    """Минимальный разбор multipart/form-data: только текстовые поля."""
+    boundary = content_type.split("boundary=", 1)[-1].strip('"').encode()
+    params = {}
+    for part in raw.split(b"--" + boundary):
+        head, _, value = part.partition(b"\r\n\r\n")
+        if b'name="' not in head or b"filename=" in head:
+            continue
+        name = head.split(b'name="', 1)[1].split(b'"', 1)[0].decode()
+        params[name] = value.rstrip(b"\r\n").decode(errors="replace")
+    return params
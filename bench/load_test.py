@@ -0,0 +1,352 @@
+"""Нагрузочный тест бота целиком на локальных заглушках, без сети.
+
+Скрипт поднимает заглушки Telegram Bot API (bench/fake_telegram.py), Notion,
+OpenAI и сайтов с HTML-корпусом (bench/fake_services.py), запускает ``bot.py``
+в отдельном процессе, направив его на заглушки, и с заданной частотой
+начинает диалоги от разных пользователей:
+
+- ``idea`` — /start, «Идея», текст;
+- ``voice`` — /start, «Идея», голосовое (синтетический OGG/Opus);
+- ``task`` — /start, «Задача», текст, выбор свойства на инлайн-клавиатуре;
+- ``link`` — /start, «Ссылка», ссылка на страницу корпуса.
+
+Задержка потока — время от последнего сообщения пользователя до итогового
+ответа бота (например, «Идея успешно сохранена в Notion!»), «принято» — до
+первого ответа. В конце печатаются пропускная способность, p50/p99 по потокам,
+пиковая память процесса бота и этапы его запуска (импорт, готовность, прогрев,
+первый ответ — из лога бота); ``--output`` сохраняет результаты в JSON, а
+``--baseline`` сравнивает их с прошлым запуском и завершается с кодом 1 при
+регрессии больше ``--tolerance``.
+
+    python bench/load_test.py --count 200 --rate 10 --output run.json
+    python bench/load_test.py --count 200 --rate 10 --baseline run.json \\
+        --notion-latency 0.3 --notion-429 0.05 --openai-latency 1.0
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import resource
+import signal
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_services import Faults, FakeNotionApi, FakeOpenAI, StaticSite  # noqa: E402
+from fake_telegram import FakeBotApi  # noqa: E402
+from replay_updates import percentile  # noqa: E402
+from voice_samples import make_voice  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+FLOWS = ("idea", "task", "link", "voice")
+DATABASES = {
+    "NOTION_DATABASE_ID_IDEA": "00000000-0000-4000-8000-000000000001",
+    "NOTION_DATABASE_ID_TASK": "00000000-0000-4000-8000-000000000002",
+    "NOTION_DATABASE_ID_LINK": "00000000-0000-4000-8000-000000000003",
+}
+CHOICES = {"idea": "Идея", "voice": "Идея", "task": "Задача", "link": "Ссылка"}
+# Итоговые ответы бота: сохранено, записано в журнал (Notion недоступен), ошибка.
+DONE_MARKERS = {"idea": "Идея успешно сохранена", "voice": "Идея успешно сохранена",
+                "task": "Задача сохранена", "link": "Ссылка успешно сохранена"}
+QUEUED_MARKER = "локально"
+FAILED_MARKERS = ("Не удалось", "Ошибка")
+# Строка лога бота с этапом холодного старта (metrics.StartupTimer).
+STARTUP_LINE = re.compile(r"Запуск: этап (\w+) через ([\d.]+) с")
+
+
+class Driver:
+    """Ведет диалоги пользователей с ботом через заглушку Bot API."""
+
+    def __init__(self, api: FakeBotApi, site: StaticSite, voice: bytes, args):
+        self.api = api
+        self.site = site
+        self.voice = voice
+        self.args = args
+        self.update_id = 0
+        self.results: list = []
+        self._inboxes: dict = {}
+        self._loop = asyncio.get_running_loop()
+        api.subscribe(self._on_reply)
+
+    def _on_reply(self, method: str, params: dict, message: dict) -> None:
+        # Вызывается в потоке заглушки
+        self._loop.call_soon_threadsafe(self._deliver, method, params, message)
+
+    def _deliver(self, method: str, params: dict, message: dict) -> None:
+        inbox = self._inboxes.get(message["chat"]["id"])
+        if inbox is not None:
+            inbox.put_nowait((method, params, message))
+
+    def _push(self, update: dict) -> None:
+        self.update_id += 1
+        self.api.push_update({**update, "update_id": self.update_id})
+
+    def send_message(self, user: dict, text: str | None = None, **fields) -> None:
+        self._push({"message": {
+            "message_id": self.update_id + 1,
+            "date": int(time.time()),
+            "chat": {"id": user["id"], "type": "private"},
+            "from": user,
+            **({"text": text} if text is not None else {}),
+            **fields,
+        }})
+
+    def press_button(self, user: dict, message: dict, data: str) -> None:
+        self._push({"callback_query": {
+            "id": str(self.update_id + 1),
+            "from": user,
+            "message": message,
+            "chat_instance": str(user["id"]),
+            "data": data,
+        }})
+
+    async def _reply(self, inbox: asyncio.Queue, deadline: float) -> tuple:
+        return await asyncio.wait_for(inbox.get(), timeout=max(deadline - time.perf_counter(), 0))
+
+    async def run_session(self, index: int, flow: str) -> None:
+        user = {"id": 200000 + index, "is_bot": False, "first_name": f"Load{index}"}
+        inbox = self._inboxes[user["id"]] = asyncio.Queue()
+        result = {"flow": flow, "status": "timeout", "ack": None, "latency": None}
+        deadline = time.perf_counter() + self.args.timeout
+        try:
+            self.send_message(user, "/start", entities=[{"type": "bot_command", "offset": 0, "length": 6}])
+            await self._reply(inbox, deadline)
+            self.send_message(user, CHOICES[flow])
+            await self._reply(inbox, deadline)
+
+            sent_at = time.perf_counter()
+            if flow == "voice":
+                file_id = f"voice{index}"
+                self.api.files[file_id] = self.voice
+                self.send_message(user, voice={
+                    "file_id": file_id, "file_unique_id": file_id, "duration": int(self.args.voice_seconds),
+                    "mime_type": "audio/ogg", "file_size": len(self.voice),
+                })
+            elif flow == "link":
+                url = self.site.url(index)
+                self.send_message(user, url, entities=[{"type": "url", "offset": 0, "length": len(url)}])
+            else:
+                self.send_message(user, f"Нагрузочный тест: {flow} #{index}")
+
+            while True:
+                method, params, message = await self._reply(inbox, deadline)
+                if result["ack"] is None:
+                    result["ack"] = time.perf_counter() - sent_at
+                text = message.get("text") or ""
+                button = _task_button(params)
+                if button:
+                    self.press_button(user, message, button)
+                    continue
+                if DONE_MARKERS[flow] in text or QUEUED_MARKER in text or text.startswith(FAILED_MARKERS):
+                    result["latency"] = time.perf_counter() - sent_at
+                    result["status"] = ("done" if DONE_MARKERS[flow] in text
+                                        else "queued" if QUEUED_MARKER in text else "failed")
+                    break
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._inboxes.pop(user["id"], None)
+            result["finished"] = time.perf_counter()
+            self.results.append(result)
+
+
+def _task_button(params: dict) -> str | None:
+    """Возвращает callback_data первого варианта свойства задачи, если бот его предлагает."""
+    markup = params.get("reply_markup")
+    if isinstance(markup, str):
+        markup = json.loads(markup)
+    for row in (markup or {}).get("inline_keyboard", []):
+        for button in row:
+            if str(button.get("callback_data", "")).startswith("taskprop_"):
+                return button["callback_data"]
+    return None
+
+
+def bot_environment(api: FakeBotApi, notion: FakeNotionApi, openai: FakeOpenAI, overrides: list) -> dict:
+    env = {
+        **os.environ,
+        **DATABASES,
+        "TELEGRAM_TOKEN": "123456:bench",
+        "TELEGRAM_BASE_URL": api.base_url,
+        "BOT_MODE": "polling",
+        "NOTION_TOKEN": "bench",
+        "NOTION_BASE_URL": notion.base_url,
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{openai.base_url}/v1",
+        "NOTION_TASK_INTERACTIVE_PROPERTIES": "Priority",
+        "PYTHONUNBUFFERED": "1",
+    }
+    for item in overrides:
+        name, _, value = item.partition("=")
+        env[name] = value
+    return env
+
+
+def peak_memory_mb() -> float:
+    """Пиковая память завершившихся дочерних процессов, МБ."""
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # В Linux ru_maxrss — в килобайтах, в macOS — в байтах
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def startup_phases(log_path: Path) -> dict:
+    """Этапы запуска, которые бот записал в лог, секунд от старта."""
+    text = log_path.read_text(encoding="utf-8", errors="replace")
+    return {phase: float(seconds) for phase, seconds in STARTUP_LINE.findall(text)}
+
+
+def summarize(results: list, elapsed: float, memory: float, startup: dict) -> dict:
+    summary = {"elapsed": elapsed, "peak_memory_mb": memory, "startup": startup, "flows": {}}
+    completed = [r for r in results if r["status"] in ("done", "queued")]
+    summary["throughput"] = len(completed) / elapsed if elapsed else 0.0
+    for flow in FLOWS:
+        runs = [r for r in results if r["flow"] == flow]
+        if not runs:
+            continue
+        latencies = [r["latency"] for r in runs if r["latency"] is not None and r["status"] != "failed"]
+        acks = [r["ack"] for r in runs if r["ack"] is not None]
+        summary["flows"][flow] = {
+            "count": len(runs),
+            **{status: sum(1 for r in runs if r["status"] == status) for status in ("done", "queued", "failed", "timeout")},
+            "ack_p50": percentile(acks, 0.5),
+            "p50": percentile(latencies, 0.5),
+            "p99": percentile(latencies, 0.99),
+            "mean": statistics.fmean(latencies) if latencies else float("nan"),
+        }
+    return summary
+
+
+def print_summary(summary: dict, services: list) -> None:
+    print(f"\n{'flow':<7} {'n':>5} {'done':>5} {'queued':>6} {'failed':>6} {'timeout':>7} "
+          f"{'ack p50':>9} {'p50':>9} {'p99':>9}")
+    for flow, stats in summary["flows"].items():
+        print(f"{flow:<7} {stats['count']:>5} {stats['done']:>5} {stats['queued']:>6} {stats['failed']:>6} "
+              f"{stats['timeout']:>7} {stats['ack_p50'] * 1000:>7.0f}мс {stats['p50'] * 1000:>7.0f}мс "
+              f"{stats['p99'] * 1000:>7.0f}мс")
+    print(f"\nпропускная способность: {summary['throughput']:.2f} потоков/с за {summary['elapsed']:.1f} с")
+    print(f"пиковая память бота: {summary['peak_memory_mb']:.1f} МБ")
+    print("запуск бота: " + ", ".join(f"{phase} {seconds:.2f} с" for phase, seconds in summary["startup"].items()))
+    for service in services:
+        print(f"{service.name}: {json.dumps(service.stats(), ensure_ascii=False)}")
+
+
+def compare(summary: dict, baseline: dict, tolerance: float) -> bool:
+    """Печатает изменения относительно прошлого запуска; возвращает ``True`` при регрессии."""
+    regressed = False
+    rows = [("throughput", summary["throughput"], baseline.get("throughput"), False),
+            ("peak_memory_mb", summary["peak_memory_mb"], baseline.get("peak_memory_mb"), True)]
+    for phase, seconds in summary["startup"].items():
+        rows.append((f"startup.{phase}", seconds, baseline.get("startup", {}).get(phase), True))
+    for flow, stats in summary["flows"].items():
+        old = baseline.get("flows", {}).get(flow, {})
+        rows += [(f"{flow}.p50", stats["p50"], old.get("p50"), True),
+                 (f"{flow}.p99", stats["p99"], old.get("p99"), True)]
+    print("\nсравнение с базовым запуском:")
+    for name, value, old, lower_is_better in rows:
+        if not old or value != value:  # нет данных или NaN
+            continue
+        change = value / old - 1
+        worse = change > tolerance if lower_is_better else change < -tolerance
+        regressed |= worse
+        print(f"  {name:<16} {old:>10.3f} -> {value:>10.3f} ({change:+.0%}){'  ← регрессия' if worse else ''}")
+    return regressed
+
+
+async def main_async(args) -> int:
+    notion = FakeNotionApi(faults=Faults(args.notion_latency, args.jitter, args.notion_429, args.notion_errors))
+    openai = FakeOpenAI(faults=Faults(args.openai_latency, args.jitter, args.openai_429, args.openai_errors),
+                        stream_interval=args.stream_interval, whisper_latency=args.whisper_latency)
+    site = StaticSite(args.corpus, faults=Faults(args.site_latency, args.jitter))
+    api = FakeBotApi(port=args.api_port)
+    services = [notion, openai, site]
+    for service in (*services, api):
+        service.start()
+
+    workdir = tempfile.mkdtemp(prefix="notion-bot-bench-")
+    log_path = Path(workdir) / "bot.log"
+    flows = [flow.strip() for flow in args.flows.split(",") if flow.strip()]
+    driver = Driver(api, site, make_voice(args.voice_seconds), args)
+
+    with open(log_path, "wb") as log:
+        # Файлы SQLite бота создаются во временном каталоге
+        spawned = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, str(ROOT / "bot.py"), cwd=workdir,
+            env=bot_environment(api, notion, openai, args.env), stdout=log, stderr=log,
+        )
+        print(f"Бот запущен (pid {process.pid}), лог: {log_path}")
+        try:
+            if not await asyncio.to_thread(api.connected.wait, 30):
+                print("Бот не подключился к заглушке Bot API, см. лог.", file=sys.stderr)
+                return 2
+            connected = time.perf_counter() - spawned
+            await asyncio.sleep(args.warmup)
+
+            started = time.perf_counter()
+            interval = 1 / args.rate if args.rate else 0
+            sessions = []
+            for i in range(args.count):
+                delay = started + i * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                sessions.append(asyncio.create_task(driver.run_session(i, flows[i % len(flows)])))
+            await asyncio.gather(*sessions)
+            elapsed = max(r["finished"] for r in driver.results) - started
+        finally:
+            process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(process.wait(), timeout=60)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+            for service in (*services, api):
+                service.stop()
+
+    startup = {"connect": connected, **startup_phases(log_path)}
+    summary = summarize(driver.results, elapsed, peak_memory_mb(), startup)
+    summary["config"] = {key: value for key, value in vars(args).items() if key not in ("output", "baseline")}
+    print_summary(summary, services)
+    if args.output:
+        Path(args.output).write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        if compare(summary, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=40, help="число диалогов")
+    parser.add_argument("--rate", type=float, default=5, help="новых диалогов в секунду (0 — все сразу)")
+    parser.add_argument("--flows", default=",".join(FLOWS), help="потоки через запятую, чередуются по кругу")
+    parser.add_argument("--timeout", type=float, default=120.0, help="лимит на один диалог, с")
+    parser.add_argument("--warmup", type=float, default=1.0, help="пауза после подключения бота, с")
+    parser.add_argument("--corpus", default=str(Path(__file__).resolve().parent / "html_corpus"))
+    parser.add_argument("--voice-seconds", type=float, default=10.0, help="длительность голосовых, с")
+    parser.add_argument("--notion-latency", type=float, default=0.1)
+    parser.add_argument("--notion-429", type=float, default=0.0, help="доля ответов 429 от Notion")
+    parser.add_argument("--notion-errors", type=float, default=0.0, help="доля ответов 503 от Notion")
+    parser.add_argument("--openai-latency", type=float, default=0.3, help="задержка до первого токена, с")
+    parser.add_argument("--openai-429", type=float, default=0.0)
+    parser.add_argument("--openai-errors", type=float, default=0.0)
+    parser.add_argument("--stream-interval", type=float, default=0.02, help="пауза между кусками потока, с")
+    parser.add_argument("--whisper-latency", type=float, default=1.0, help="доп. задержка расшифровки, с")
+    parser.add_argument("--site-latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.0, help="разброс задержек заглушек, ±с")
+    parser.add_argument("--api-port", type=int, default=0, help="порт заглушки Bot API (0 — любой свободный)")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="переменная окружения для бота (можно несколько раз)")
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля")
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Нагрузочный тест: воспроизводит обновления Telegram против запущенного бота.
+
+Скрипт поднимает заглушку Bot API (bench/fake_telegram.py) и подает бота
+обновления либо через webhook (POST на адрес бота с секретным заголовком),
+либо через getUpdates (режим polling). Задержка одного обновления — время от
+его отправки до первого ответа бота в тот же чат.
+
+1. Запустите заглушку и тест:
+
+    python bench/replay_updates.py --mode webhook --count 500 --rate 100
+
+2. В другом терминале запустите бота, направив его на заглушку:
+
+    TELEGRAM_TOKEN=123:bench TELEGRAM_BASE_URL=http://127.0.0.1:8081/bot \\
+    BOT_MODE=webhook WEBHOOK_URL=http://127.0.0.1:8443 WEBHOOK_SECRET=bench \\
+    python bot.py
+
+Для режима polling запустите бота с ``BOT_MODE=polling`` и тест с ``--mode polling``.
+Без ``--updates`` используются синтетические команды /start от разных чатов.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_telegram import FakeBotApi  # noqa: E402
+
+
+def synthetic_updates(count: int) -> list:
+    """Команды /start от ``count`` разных пользователей."""
+    updates = []
+    for i in range(count):
+        user = {"id": 100000 + i, "is_bot": False, "first_name": "Load"}
+        updates.append({
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": int(time.time()),
+                "chat": {"id": user["id"], "type": "private"},
+                "from": user,
+                "text": "/start",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+            },
+        })
+    return updates
+
+
+def load_updates(path: str, count: int) -> list:
+    """Читает записанные обновления (по одному JSON на строку) и перенумеровывает их."""
+    updates = [json.loads(line) for line in Path(path).read_text(encoding="utf-8").splitlines() if line.strip()]
+    updates = (updates * (count // len(updates) + 1))[:count] if count else updates
+    return [{**update, "update_id": i + 1} for i, update in enumerate(updates)]
+
+
+def chat_id_of(update: dict) -> int | None:
+    for key in ("message", "edited_message", "channel_post"):
+        if key in update:
+            return update[key]["chat"]["id"]
+    if "callback_query" in update:
+        return update["callback_query"]["message"]["chat"]["id"]
+    return None
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def replay(api: FakeBotApi, updates: list, args) -> list:
+    """Отправляет обновления с заданной частотой; возвращает задержки подтверждения webhook."""
+    acks = []
+    interval = 1 / args.rate if args.rate else 0
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    semaphore = asyncio.Semaphore(args.connections)
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        async def post(update: dict) -> None:
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(args.webhook_url, json=update, headers=headers)
+                acks.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    print(f"webhook ответил {response.status_code}", file=sys.stderr)
+
+        tasks = []
+        started = time.perf_counter()
+        for i, update in enumerate(updates):
+            if interval:
+                delay = started + i * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            chat_id = chat_id_of(update)
+            if chat_id is not None:
+                api.expect_reply(chat_id, time.perf_counter())
+            if args.mode == "webhook":
+                tasks.append(asyncio.create_task(post(update)))
+            else:
+                api.push_update(update)
+        await asyncio.gather(*tasks)
+    return acks
+
+
+async def main_async(args) -> None:
+    updates = load_updates(args.updates, args.count) if args.updates else synthetic_updates(args.count)
+    expected = sum(1 for update in updates if chat_id_of(update) is not None)
+
+    api = FakeBotApi(port=args.api_port)
+    api.start()
+    print(f"Заглушка Bot API: {api.base_url}. Жду подключения бота...")
+    await asyncio.to_thread(api.connected.wait)
+    await asyncio.sleep(args.warmup)
+
+    started = time.perf_counter()
+    acks = await replay(api, updates, args)
+    deadline = time.perf_counter() + args.timeout
+    while len(api.latencies) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    api.stop()
+
+    latencies = api.latencies
+    print(f"режим: {args.mode}, обновлений: {len(updates)}, ответов: {len(latencies)}/{expected}")
+    print(f"пропускная способность: {len(latencies) / elapsed:.1f} обновлений/с")
+    print(f"задержка обработки: p50 {percentile(latencies, 0.5) * 1000:.1f} мс, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} мс, "
+          f"среднее {statistics.fmean(latencies) * 1000 if latencies else float('nan'):.1f} мс")
+    if acks:
+        print(f"подтверждение webhook: p50 {percentile(acks, 0.5) * 1000:.1f} мс, p99 {percentile(acks, 0.99) * 1000:.1f} мс")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["webhook", "polling"], default="webhook")
+    parser.add_argument("--updates", help="JSONL-файл с записанными обновлениями")
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=0, help="обновлений в секунду (0 — без ограничения)")
+    parser.add_argument("--connections", type=int, default=40, help="параллельных POST в режиме webhook")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--webhook-url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", default="bench")
+    parser.add_argument("--warmup", type=float, default=1.0, help="пауза после подключения бота, с")
+    parser.add_argument("--timeout", type=float, default=60.0, help="сколько ждать ответов после отправки, с")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Синтетические голосовые сообщения в формате OGG/Opus без внешних зависимостей.
+
+Telegram присылает голосовые в OGG/Opus, и бот отправляет их в Whisper без
+перекодирования, поэтому для теста достаточно корректного контейнера: файл
+состоит из заголовков OpusHead/OpusTags и 20-мс кадров тишины, дополненных
+до заданного битрейта, чтобы размер соответствовал настоящей записи.
+
+    python bench/voice_samples.py --seconds 30 --output voice.ogg
+"""
+import argparse
+import struct
+
+SAMPLE_RATE = 48000
+FRAME_SAMPLES = 960  # 20 мс при 48 кГц
+PRE_SKIP = 312
+FRAMES_PER_PAGE = 50  # секунда звука на страницу
+# Кадр тишины CELT (TOC 0xF8 без кода упаковки).
+SILENT_FRAME = b"\xff\xfe"
+
+
+def _crc_table() -> list:
+    table = []
+    for byte in range(256):
+        crc = byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def _ogg_crc(data: bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _CRC_TABLE[((crc >> 24) & 0xFF) ^ byte]
+    return crc
+
+
+def _ogg_page(packets: list, granule: int, serial: int, sequence: int, flags: int = 0) -> bytes:
+    lacing = bytearray()
+    for packet in packets:
+        lacing += b"\xff" * (len(packet) // 255) + bytes([len(packet) % 255])
+    header = struct.pack("<4sBBqIIIB", b"OggS", 0, flags, granule, serial, sequence, 0, len(lacing)) + bytes(lacing)
+    page = header + b"".join(packets)
+    crc = _ogg_crc(page)
+    return page[:22] + struct.pack("<I", crc) + page[26:]
+
+
+def _opus_packet(size: int) -> bytes:
+    """Кадр тишины, дополненный паддингом Opus (код упаковки 3) до ``size`` байт."""
+    base = bytes([0xF8]) + SILENT_FRAME
+    if size <= len(base) + 2:
+        return base
+    # TOC, счетчик кадров с флагом паддинга, длина паддинга, кадр, нули паддинга
+    padding = min(size - len(SILENT_FRAME) - 3, 254)
+    return bytes([0xF8 | 3, 0x41, padding]) + SILENT_FRAME + b"\x00" * padding
+
+
+def make_voice(seconds: float, bitrate: int = 16000, serial: int = 0x0B0E) -> bytes:
+    """Возвращает OGG/Opus-файл тишины длительностью ``seconds`` с заданным битрейтом."""
+    head = b"OpusHead" + struct.pack("<BBHIhB", 1, 1, PRE_SKIP, SAMPLE_RATE, 0, 0)
+    vendor = b"notion-bot-bench"
+    tags = b"OpusTags" + struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", 0)
+    pages = [_ogg_page([head], 0, serial, 0, flags=0x02), _ogg_page([tags], 0, serial, 1)]
+
+    frames = max(1, int(seconds * SAMPLE_RATE / FRAME_SAMPLES))
+    packet = _opus_packet(bitrate * FRAME_SAMPLES // SAMPLE_RATE // 8)
+    sequence = 2
+    for start in range(0, frames, FRAMES_PER_PAGE):
+        count = min(FRAMES_PER_PAGE, frames - start)
+        granule = PRE_SKIP + (start + count) * FRAME_SAMPLES
+        last = start + count >= frames
+        pages.append(_ogg_page([packet] * count, granule, serial, sequence, flags=0x04 if last else 0))
+        sequence += 1
+    return b"".join(pages)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--bitrate", type=int, default=16000, help="бит/с")
+    parser.add_argument("--output", default="voice.ogg")
+    args = parser.parse_args()
+    data = make_voice(args.seconds, args.bitrate)
+    with open(args.output, "wb") as f:
+        f.write(data)
+    print(f"{args.output}: {len(data)} байт, {args.seconds:g} с")
+
+
+if __name__ == "__main__":
+    main()
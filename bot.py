@@ -1,9 +1,14 @@
+import time
+
+# Отсчет холодного старта: от запуска модуля до первого ответа пользователю.
+STARTED_AT = time.perf_counter()
+
 import os
+import asyncio
 import logging
-from dotenv import load_dotenv
 
 # Загружаем переменные окружения в первую очередь!
-load_dotenv()
+from config import settings
 
 from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -13,26 +18,78 @@ from telegram.ext import (
     ConversationHandler,
     MessageHandler,
     CallbackQueryHandler,
+    TypeHandler,
     filters,
 )
 from notion_handler import (
-    create_notion_page,
-    create_link_page,
-
+    get_database_properties,
+    page_properties,
+    close_notion_client,
+    get_rate_limiter_stats,
+    schema_cache,
+    warm_up_schema_cache,
 )
-from transcriber import transcribe_voice
-from url_processor import process_url
+from notion_outbox import outbox
+from link_index import link_index
+from fair_scheduler import ffmpeg_limiter, openai_limiter, whisper_limiter
+from metrics import registry, start_metrics, startup, stop_metrics
+from transcriber import transcribe_voice, shutdown_audio_pool
+from openai_client import close_openai_client, warm_up_openai_client
+from background_jobs import JobStore, JobWorkerPool
+from update_processor import PerChatUpdateProcessor
+from persistence import SharedConversationHandler, SQLiteStateStore, StorePersistence
+from pipelines import JOB_HANDLERS, LINK_BATCH_MAX_URLS, extract_urls, make_transcription_progress
+from url_fetcher import close_http_client
+from url_cache import url_cache
+from html_extractor import shutdown_extractor_pool, warm_up_extractor
+from url_processor import warm_up_analysis_tokenizer
 
 # Настройка логирования
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+startup.begin(STARTED_AT)
+startup.mark("imports")
 
 
 # === Константы состояний ===
 # ConversationHandler использует числовые идентификаторы для обозначения этапов диалога.
 CHOOSING_ACTION, AWAITING_INPUT, AWAITING_LINK, SELECTING_TASK_PROPERTY = range(4)
 
+# === Настройки диалога задачи ===
+# Отложенная запись: задача создается одним запросом после ответа на все вопросы.
+TASK_DEFERRED_COMMIT = os.getenv("TASK_DEFERRED_COMMIT", "1") == "1"
+# Через сколько секунд бездействия диалог завершается, а частичные ответы сохраняются.
+TASK_DIALOG_TIMEOUT = float(os.getenv("TASK_DIALOG_TIMEOUT", "600")) or None
+
+# === Режим получения обновлений ===
+# polling — long polling через getUpdates; webhook — встроенный HTTP-сервер.
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Сколько обновлений обрабатываются одновременно; внутри одного чата — всегда по очереди.
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "8"))
+# Прогрев при запуске (схемы Notion, соединения с Notion и OpenAI, пул разбора HTML):
+# background — параллельно с приемом обновлений; blocking — до него; off — не прогревать.
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background")
+
+# === Хранение состояния диалогов ===
+# sqlite — состояние диалогов и user_data переживают перезапуск; none — только в памяти.
+PERSISTENCE_BACKEND = os.getenv("PERSISTENCE_BACKEND", "sqlite")
+CONVERSATION_NAME = "main"
+
+# 1 — не анализировать повторно ссылки, которые уже есть в базе ссылок.
+LINK_DEDUP = os.getenv("LINK_DEDUP", "1") == "1"
+
+# === Очередь и справедливость ===
+# С какой позиции в очереди пользователь сразу видит «в очереди, позиция N».
+QUEUE_NOTICE_THRESHOLD = int(os.getenv("QUEUE_NOTICE_THRESHOLD", "3"))
+# Сколько ожидающих задач может быть у одного чата; сверх этого новые не принимаются.
+JOB_MAX_QUEUED_PER_CHAT = int(os.getenv("JOB_MAX_QUEUED_PER_CHAT", "20"))
+
+# Тяжелая работа (загрузка, OpenAI, Whisper, Notion) выполняется фоновыми воркерами.
+job_pool = JobWorkerPool(JobStore(), JOB_HANDLERS)
+# Фоновый прогрев при STARTUP_WARMUP=background.
+warm_up_task: asyncio.Task | None = None
+
 # === Клавиатуры ===
 main_keyboard = [["Идея", "Задача", "Ссылка"]]
 main_markup = ReplyKeyboardMarkup(main_keyboard, one_time_keyboard=True, resize_keyboard=True)
@@ -64,69 +121,167 @@ async def received_input(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     choice = context.user_data.get('choice')
     text = ""
 
+    if choice == "Идея":
+        return await save_idea(update, context)
+
     if update.message.voice:
-        await update.message.reply_text("Получил голосовое, расшифровываю... 🎙️")
-        text = await transcribe_voice(update.message.voice.file_id, context)
+        voice = update.message.voice
+        position = whisper_limiter.position()
+        if position > QUEUE_NOTICE_THRESHOLD:
+            status = await update.message.reply_text(f"Голосовое в очереди на расшифровку, позиция {position}. ⏳")
+        else:
+            status = await update.message.reply_text("Получил голосовое, расшифровываю... 🎙️")
+        report_progress = make_transcription_progress(context.bot, status.chat_id, status.message_id)
+        text = await transcribe_voice(voice.file_id, context.bot, voice.mime_type, voice.duration, report_progress)
         if not text or text.startswith("Ошибка:"):
             await update.message.reply_text(text or "Не удалось расшифровать.")
             return ConversationHandler.END
     else:
         text = update.message.text
 
-    if choice == "Идея":
-        return await save_idea(update, context, text)
-    elif choice == "Задача":
+    if choice == "Задача":
         return await start_task_process(update, context, text)
 
-async def save_idea(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str) -> int:
-    """Сохраняет идею в Notion."""
-    db_id = os.getenv("NOTION_DATABASE_ID_IDEA")
-    title_prop = os.getenv("NOTION_IDEA_PROPERTY_TITLE", "Name")
-
-    if not db_id:
+async def save_idea(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Ставит сохранение идеи (текстовой или голосовой) в фоновую очередь."""
+    if not settings.idea_database_id:
         await update.message.reply_text("ID базы данных для 'Идей' не найден в .env.")
         return ConversationHandler.END
 
-
-    if result:
-        await update.message.reply_text("Идея успешно сохранена в Notion!")
+    voice = update.message.voice
+    if voice:
+        duration = voice.duration.total_seconds() if hasattr(voice.duration, "total_seconds") else voice.duration
+        payload = {'voice': {'file_id': voice.file_id, 'mime_type': voice.mime_type, 'duration': duration}}
     else:
-        await update.message.reply_text("Не удалось сохранить идею. Проверьте логи.")
+        payload = {'text': update.message.text}
+
+    await enqueue_job(update, "idea", payload, "Идея принята, сохраняю... ⏳")
     return ConversationHandler.END
 
+async def enqueue_job(update: Update, kind: str, payload: dict, accepted_text: str) -> bool:
+    """Ставит задачу в фоновую очередь и сразу сообщает пользователю, что с ней будет.
+
+    Если перед задачей много других, вместо обычного ответа показывается ее
+    позиция в очереди; если у чата уже слишком много ожидающих задач, новая
+    не принимается.
+    """
+    queued, position = await job_pool.store.backlog(update.effective_chat.id)
+    if queued >= JOB_MAX_QUEUED_PER_CHAT:
+        await update.message.reply_text(
+            f"У вас уже {queued} задач в очереди. Дождитесь их выполнения и отправьте снова."
+        )
+        return False
+    if position > QUEUE_NOTICE_THRESHOLD:
+        accepted_text = f"В очереди, позиция {position}. ⏳"
+    status = await update.message.reply_text(accepted_text)
+    await job_pool.submit(kind, payload, status.chat_id, status.message_id)
+    return True
+
 async def start_task_process(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str) -> int:
     """Начинает многошаговый процесс создания задачи."""
-    db_id = os.getenv("NOTION_DATABASE_ID_TASK")
-    title_prop = os.getenv("NOTION_TASK_PROPERTY_TITLE", "Name")
+    db_id = settings.task_database_id
+    title_prop = settings.task_title_property
 
     if not db_id:
         await update.message.reply_text("ID базы данных для 'Задач' не найден в .env.")
         return ConversationHandler.END
 
-    # 1. Создаем страницу с названием
-    page = await create_notion_page(db_id, title_prop, text)
-    if not page:
-        await update.message.reply_text("Не удалось создать задачу в Notion. Проверьте логи.")
-        return ConversationHandler.END
+    # 1. Получаем список интерактивных полей
+    properties_to_ask = list(settings.task_interactive_properties)
 
-    await update.message.reply_text(f"Задача '{text}' создана. Теперь давайте уточним детали.")
+    # Ключ идемпотентности всех записей этой задачи в журнале Notion
+    task_key = f"task:{update.effective_chat.id}:{update.message.message_id}"
 
-    # 2. Получаем список интерактивных полей
-    interactive_props_str = os.getenv("NOTION_TASK_INTERACTIVE_PROPERTIES", "")
-    properties_to_ask = [p.strip() for p in interactive_props_str.split(',') if p.strip()]
+    # 2. В режиме отложенной записи страница создается одним запросом после всех ответов
+    if TASK_DEFERRED_COMMIT and properties_to_ask:
+        await update.message.reply_text(f"Задача '{text}'. Теперь давайте уточним детали.")
+    else:
+        result = await outbox.create_page(
+            task_key, db_id, page_properties(title_prop, text),
+            notify=(update.effective_chat.id, None, f"Задача '{text}' сохранена в Notion (после восстановления связи)."),
+        )
+        if not result.saved:
+            await update.message.reply_text("Не удалось создать задачу в Notion. Проверьте логи.")
+            return ConversationHandler.END
 
-    if not properties_to_ask:
-        await update.message.reply_text("Настройка интерактивных полей не найдена. Задача сохранена без деталей.")
-        return ConversationHandler.END
+        if not properties_to_ask:
+            await update.message.reply_text("Настройка интерактивных полей не найдена. Задача сохранена без деталей.")
+            return ConversationHandler.END
+
+        await update.message.reply_text(f"Задача '{text}' создана. Теперь давайте уточним детали.")
+        context.user_data['task_created'] = True
 
     # 3. Сохраняем контекст для диалога
-    context.user_data['task_page_id'] = page['id']
+    context.user_data['task_key'] = task_key
+    context.user_data['task_title'] = text
+    context.user_data['task_db_id'] = db_id
+    context.user_data['task_answers'] = {}
     context.user_data['properties_to_ask'] = properties_to_ask
     context.user_data['current_property_index'] = 0
-    context.user_data['db_properties'] = await get_database_properties(db_id)
 
     return await ask_next_task_property(update, context)
 
+def build_task_properties(answers: dict, db_properties: dict) -> dict:
+    """Преобразует выбранные значения в payload свойств Notion."""
+    payload = {}
+    for prop_name, values in answers.items():
+        prop_type = (db_properties.get(prop_name) or {}).get('type')
+        if not values:
+            continue
+        if prop_type == 'select':
+            payload[prop_name] = {'select': {'name': values[-1]}}
+        elif prop_type == 'multi_select':
+            payload[prop_name] = {'multi_select': [{'name': value} for value in values]}
+    return payload
+
+def clear_task_state(user_data: dict) -> None:
+    """Удаляет из user_data все ключи диалога создания задачи."""
+    for key in ('task_created', 'task_key', 'task_title', 'task_db_id', 'task_answers',
+                'properties_to_ask', 'current_property_index'):
+        user_data.pop(key, None)
+
+async def commit_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+    """Записывает задачу со всеми накопленными ответами одним запросом к Notion.
+
+    Возвращает статус записи в журнале: ``done``, ``queued`` или ``failed``.
+    """
+    user_data = context.user_data
+    db_properties = await get_database_properties(user_data['task_db_id']) or {}
+    properties = build_task_properties(user_data.get('task_answers', {}), db_properties)
+    title_prop = settings.task_title_property
+    title = user_data['task_title']
+    result = await outbox.create_page(
+        user_data['task_key'], user_data['task_db_id'], page_properties(title_prop, title, properties),
+        notify=(update.effective_chat.id, None, f"Задача '{title}' сохранена в Notion (после восстановления связи)."),
+    )
+    return result.status
+
+async def finish_task(update: Update, context: ContextTypes.DEFAULT_TYPE, partial: bool = False) -> int:
+    """Завершает диалог задачи, записывая ее в Notion, если запись отложена."""
+    user_data = context.user_data
+    if user_data.get('task_created'):
+        text = "Отлично! Все детали задачи заполнены."
+    else:
+        text = {
+            "done": "Задача сохранена с заполненными полями." if partial else "Отлично! Задача сохранена со всеми деталями.",
+            "queued": "Notion сейчас недоступен. Задача сохранена локально и будет отправлена автоматически. ⏳",
+            "failed": "Не удалось сохранить задачу в Notion. Проверьте логи.",
+        }[await commit_task(update, context)]
+
+    clear_task_state(user_data)
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=text)
+    return ConversationHandler.END
+
+def task_property_markup(prop_info: dict, selected: list) -> InlineKeyboardMarkup:
+    """Строит клавиатуру вариантов свойства с отметками выбранных значений."""
+    keyboard = [
+        [InlineKeyboardButton(f"✅ {option}" if option in selected else option, callback_data=f"taskprop_{i}")]
+        for i, option in enumerate(prop_info['options'])
+    ]
+    if prop_info.get('type') == 'multi_select':
+        keyboard.append([InlineKeyboardButton("Готово", callback_data="taskdone")])
+    return InlineKeyboardMarkup(keyboard)
+
 async def ask_next_task_property(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Задает вопрос о следующем свойстве задачи."""
     user_data = context.user_data
@@ -134,27 +289,28 @@ async def ask_next_task_property(update: Update, context: ContextTypes.DEFAULT_T
     properties_to_ask = user_data['properties_to_ask']
 
     if idx >= len(properties_to_ask):
-        await context.bot.send_message(chat_id=update.effective_chat.id, text="Отлично! Все детали задачи заполнены.")
-        return ConversationHandler.END
-
+        return await finish_task(update, context)
 
+    prop_name = properties_to_ask[idx]
+    # Схема берется из общего кэша, а не хранится копией у каждого пользователя
+    db_properties = await get_database_properties(user_data['task_db_id']) or {}
+    prop_info = db_properties.get(prop_name)
 
     if not prop_info or not prop_info.get('options'):
         await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Не удалось найти свойство '{prop_name}' или его опции в Notion. Пропускаю...")
         user_data['current_property_index'] += 1
         return await ask_next_task_property(update, context)
 
-    keyboard = [
-        [InlineKeyboardButton(option, callback_data=f"taskprop_{prop_name}_{option}")]
-        for option in prop_info['options']
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = task_property_markup(prop_info, [])
+    text = f"Выберите '{prop_name}':"
+    if prop_info['type'] == 'multi_select':
+        text = f"Выберите один или несколько вариантов '{prop_name}' и нажмите «Готово»:"
 
     # Если это не первый вопрос, сначала редактируем предыдущее сообщение
     if update.callback_query:
-        await update.callback_query.edit_message_text(text=f"Выберите '{prop_name}':", reply_markup=reply_markup)
+        await update.callback_query.edit_message_text(text=text, reply_markup=reply_markup)
     else:
-        await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Выберите '{prop_name}':", reply_markup=reply_markup)
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=text, reply_markup=reply_markup)
 
     return SELECTING_TASK_PROPERTY
 
@@ -163,55 +319,128 @@ async def received_task_property(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     await query.answer()
 
-    _, prop_name, value = query.data.split('_', 2)
-    page_id = context.user_data['task_page_id']
-    prop_info = context.user_data.get('db_properties', {}).get(prop_name)
+    user_data = context.user_data
+    if 'properties_to_ask' not in user_data:
+        await query.edit_message_text(text="Диалог создания задачи уже завершен.")
+        return ConversationHandler.END
 
-    # Формируем payload для обновления
-    prop_type = prop_info.get('type')
-    update_payload = {}
-    if prop_type == 'select':
-        update_payload[prop_name] = {'select': {'name': value}}
-    elif prop_type == 'multi_select':
-        # Для простоты пока добавляем как единственный, для сложной логики нужно будет хранить текущие
-        update_payload[prop_name] = {'multi_select': [{'name': value}]}
+    prop_name = user_data['properties_to_ask'][user_data['current_property_index']]
+    db_properties = await get_database_properties(user_data['task_db_id']) or {}
+    prop_info = db_properties.get(prop_name) or {}
+    selected = user_data['task_answers'].setdefault(prop_name, [])
+
+    if query.data.startswith("taskprop_"):
+        option_index = int(query.data.split('_', 1)[1])
+        if option_index >= len(prop_info.get('options', [])):
+            # Схема базы изменилась, пока пользователь выбирал — задаем вопрос заново
+            return await ask_next_task_property(update, context)
+        value = prop_info['options'][option_index]
+        if prop_info.get('type') == 'multi_select':
+            # Накапливаем значения, пока пользователь не нажмет «Готово»
+            if value in selected:
+                selected.remove(value)
+            else:
+                selected.append(value)
+            await query.edit_message_reply_markup(reply_markup=task_property_markup(prop_info, selected))
+            return SELECTING_TASK_PROPERTY
+        selected[:] = [value]
+
+    # В режиме немедленной записи обновляем уже созданную страницу
+    if user_data.get('task_created') and selected:
+        task_key = user_data['task_key']
+        await outbox.update_page(
+            f"{task_key}:{prop_name}", task_key, build_task_properties({prop_name: selected}, db_properties)
+        )
+    await query.edit_message_text(text=f"Выбрано: {prop_name} -> {', '.join(selected) or '—'}")
+
+    user_data['current_property_index'] += 1
+    return await ask_next_task_property(update, context)
 
-    # Обновляем страницу в Notion
-    await update_page_properties(page_id, update_payload)
-    await query.edit_message_text(text=f"Выбрано: {prop_name} -> {value}")
+async def task_dialog_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Сохраняет частично заполненную задачу, если пользователь бросил диалог."""
+    if 'task_db_id' in context.user_data:
+        logger.info("Диалог задачи прерван по таймауту, сохраняю частичные ответы.")
+        return await finish_task(update, context, partial=True)
+    return ConversationHandler.END
 
-    context.user_data['current_property_index'] += 1
-    return await ask_next_task_property(update, context)
+def format_known_links(known: dict) -> str:
+    """Сообщение о ссылках, которые уже сохранены в Notion."""
+    lines = ["Эта ссылка уже сохранена в Notion:" if len(known) == 1 else f"Уже сохранены в Notion: {len(known)}"]
+    for url, page in known.items():
+        line = page['title'] or url
+        if page['url']:
+            line += f"\n{page['url']}"
+        else:
+            line += " (ждет отправки в Notion)"
+        lines.append(line)
+    return "\n\n".join(lines)[:4096]
 
 async def received_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Обрабатывает полученную ссылку, анализирует и сохраняет в Notion."""
-    url = update.message.text
-    if not url.startswith("http"):
+    """Принимает одну или несколько ссылок и ставит их обработку в фоновую очередь."""
+    urls = extract_urls(update.message)
+    if not urls:
         await update.message.reply_text("Пожалуйста, отправьте корректную ссылку.")
         return AWAITING_LINK
-
-    await update.message.reply_text("Анализирую ссылку... 🧠")
-    processed_data = await process_url(url)
-    if not processed_data:
-        await update.message.reply_text("Не удалось обработать ссылку.")
+    if len(urls) > LINK_BATCH_MAX_URLS:
+        await update.message.reply_text(
+            f"В сообщении {len(urls)} ссылок — обработаю первые {LINK_BATCH_MAX_URLS}, "
+            f"остальные {len(urls) - LINK_BATCH_MAX_URLS} пропущены. Отправьте их отдельным сообщением."
+        )
+        urls = urls[:LINK_BATCH_MAX_URLS]
+
+    if not settings.link_database_id:
+        await update.message.reply_text("ID базы данных для 'Ссылок' не найден в .env.")
         return ConversationHandler.END
 
-    db_id = os.getenv("NOTION_DATABASE_ID_LINK")
-    title_prop = os.getenv("NOTION_LINK_PROPERTY_TITLE", "Name")
-    url_prop = os.getenv("NOTION_LINK_PROPERTY_URL", "URL")
-    tags_prop = os.getenv("NOTION_LINK_PROPERTY_TAGS", "Tags")
-
-    if not db_id:
-        await update.message.reply_text("ID базы данных для 'Ссылок' не найден в .env.")
+    known = {}
+    if LINK_DEDUP:
+        # Проверка по локальному индексу, без обращений к сети
+        known = {url: page for url in urls if (page := link_index.get(url))}
+        urls = [url for url in urls if url not in known]
+    if known:
+        await update.message.reply_text(format_known_links(known))
+    if not urls:
         return ConversationHandler.END
 
-    result = await create_link_page(db_id, title_prop, url_prop, tags_prop, processed_data)
-    if result:
-        await update.message.reply_text(f"Ссылка успешно сохранена в Notion!\n\n**Заголовок:** {processed_data.get('title')}")
+    if len(urls) == 1:
+        await enqueue_job(update, "link", {'url': urls[0]}, "Ссылка принята, в очереди на анализ... ⏳")
     else:
-        await update.message.reply_text("Не удалось сохранить ссылку. Проверьте логи.")
+        await enqueue_job(update, "link_batch", {'urls': urls}, f"Получено ссылок: {len(urls)}, в очереди на анализ... ⏳")
     return ConversationHandler.END
 
+def format_age(seconds: float) -> str:
+    """Форматирует возраст записи: секунды, минуты или часы."""
+    if seconds < 60:
+        return f"{seconds:.0f} с"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} мин"
+    return f"{seconds / 3600:.1f} ч"
+
+def is_admin(update: Update) -> bool:
+    """Проверяет, есть ли пользователь в ADMIN_USER_IDS (если список не задан — не доступно никому)."""
+    return update.effective_user is not None and update.effective_user.id in settings.admin_user_ids
+
+async def status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показывает состояние очереди записей в Notion и фоновых задач (только для администраторов)."""
+    if not is_admin(update):
+        return
+    stats = await outbox.stats()
+    lines = [
+        f"Записей в Notion ожидает отправки: {stats['pending']}",
+        f"Самой старой: {format_age(stats['oldest_age'])}" if stats['pending'] else "Очередь пуста.",
+        f"Notion: {'недоступен, записи копятся локально' if stats['degraded'] else 'доступен'}",
+        f"Фоновых задач в работе: {await job_pool.store.pending_count()}",
+    ]
+    if stats['failed']:
+        lines.append(f"Отклонено Notion: {stats['failed']} (подробности в логах)")
+    await update.message.reply_text("\n".join(lines))
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показывает задержки этапов, счетчики и метрики кэшей (только для администраторов)."""
+    if not is_admin(update):
+        return
+    await update.message.reply_text(registry.render_summary()[:4096])
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Отменяет любой диалог."""
     await update.message.reply_text("Действие отменено.", reply_markup=ReplyKeyboardRemove())
@@ -219,11 +448,134 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return ConversationHandler.END
 
 
+async def warm_up() -> None:
+    """Параллельно прогревает все, что иначе ждал бы первый пользователь.
+
+    Загружает схемы баз Notion (заодно открывая соединения с Notion и
+    проверяя токен), импортирует клиент OpenAI и проверяет ключ, запускает
+    воркеры разбора HTML и загружает токенизатор. Ошибки прогрева только логируются.
+    """
+    results = await asyncio.gather(
+        warm_up_schema_cache(settings.database_ids),
+        warm_up_openai_client(),
+        warm_up_extractor(),
+        warm_up_analysis_tokenizer(),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"Ошибка прогрева: {result}")
+    startup.mark("warm_up")
+
+
+async def post_init(application: Application) -> None:
+    """Запускает фоновые воркеры и прогрев (STARTUP_WARMUP)."""
+    global warm_up_task
+    registry.register_collector("url_cache", url_cache.stats)
+    registry.register_collector("schema_cache", schema_cache.stats)
+    registry.register_collector("notion_queue", get_rate_limiter_stats)
+    registry.register_collector("link_index", link_index.stats)
+    registry.register_collector("startup", startup.stats)
+    for limiter in (openai_limiter, whisper_limiter, ffmpeg_limiter):
+        registry.register_collector(f"fair_{limiter.name}", limiter.stats)
+    await start_metrics()
+    # Ссылка, запись которой Notion отклонил, не должна числиться «ждет отправки»
+    outbox.add_failure_listener(link_index.forget_pending)
+    await outbox.start(application.bot)
+    await link_index.start()
+    await job_pool.start(application.bot)
+    if STARTUP_WARMUP == "blocking":
+        await warm_up()
+    elif STARTUP_WARMUP == "background":
+        warm_up_task = asyncio.create_task(warm_up())
+    startup.mark("ready")
+
+
+async def post_stop(application: Application) -> None:
+    """Дожидается завершения текущих фоновых задач, пока бот еще доступен."""
+    if warm_up_task is not None and not warm_up_task.done():
+        warm_up_task.cancel()
+        await asyncio.gather(warm_up_task, return_exceptions=True)
+    await job_pool.stop()
+    await outbox.stop()
+    await link_index.stop()
+    await stop_metrics()
+
+
+async def post_shutdown(application: Application) -> None:
+    """Освобождает общие сетевые ресурсы при остановке бота."""
+    await close_notion_client()
+    await close_http_client()
+    url_cache.close()
+    shutdown_extractor_pool()
+    shutdown_audio_pool()
+    await close_openai_client()
+
+
+def make_persistence_flush(application: Application, persistence: StorePersistence):
+    """Возвращает корутину, сразу записывающую состояние после обновления (PERSISTENCE_SHARED=1).
+
+    Иначе изменения попадают в хранилище только через ``update_interval``, и
+    следующее сообщение, принятое другим экземпляром, увидит старое состояние.
+    """
+    async def persist_update() -> None:
+        await application.update_persistence()
+        await persistence.write_now()
+
+    return persist_update
+
+
+def run(application: Application) -> None:
+    """Запускает получение обновлений в режиме BOT_MODE.
+
+    В обоих режимах при остановке бот перестает принимать новые обновления,
+    дообрабатывает уже полученные и дожидается фоновых задач (post_stop).
+    """
+    if BOT_MODE == "webhook":
+        if not settings.webhook_url:
+            raise RuntimeError("Для BOT_MODE=webhook необходимо задать WEBHOOK_URL.")
+        if not settings.webhook_secret:
+            # Без секрета любой, кто узнает адрес, сможет присылать поддельные обновления
+            raise RuntimeError("Для BOT_MODE=webhook необходимо задать WEBHOOK_SECRET.")
+        application.run_webhook(
+            listen=settings.webhook_listen,
+            port=settings.webhook_port,
+            url_path=settings.webhook_path,
+            webhook_url=f"{settings.webhook_url.rstrip('/')}/{settings.webhook_path}",
+            secret_token=settings.webhook_secret,
+            max_connections=settings.webhook_max_connections,
+        )
+    else:
+        application.run_polling()
+
+
 def main() -> None:
     """Запускает бота."""
-    application = Application.builder().token(os.getenv("TELEGRAM_TOKEN")).build()
+    if not settings.telegram_token:
+        raise RuntimeError("TELEGRAM_TOKEN не задан.")
+    for problem in settings.problems():
+        logger.warning(problem)
+    builder = Application.builder().token(settings.telegram_token)
+    if settings.telegram_base_url:
+        # Позволяет направить бота на локальный Bot API (например, при нагрузочном тесте)
+        builder = builder.base_url(settings.telegram_base_url).base_file_url(settings.telegram_base_file_url)
+    persistence = None
+    if PERSISTENCE_BACKEND == "sqlite":
+        persistence = StorePersistence(SQLiteStateStore())
+        builder = builder.persistence(persistence)
+    update_processor = PerChatUpdateProcessor(UPDATE_CONCURRENCY)
+    application = (
+        builder
+        .concurrent_updates(update_processor)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
-    conv_handler = ConversationHandler(
+    shared = persistence is not None and persistence.shared
+    conv_options = {"persistence": persistence} if shared else {}
+    conv_handler = (SharedConversationHandler if shared else ConversationHandler)(
         entry_points=[CommandHandler("start", start)],
         states={
             CHOOSING_ACTION: [
@@ -233,16 +585,28 @@ def main() -> None:
                 MessageHandler((filters.TEXT & ~filters.COMMAND) | filters.VOICE, received_input)
             ],
             AWAITING_LINK: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, received_link)
+                MessageHandler((filters.TEXT | filters.CAPTION) & ~filters.COMMAND, received_link)
             ],
             SELECTING_TASK_PROPERTY: [
-                CallbackQueryHandler(received_task_property, pattern=r"^taskprop_")
+                CallbackQueryHandler(received_task_property, pattern=r"^task(prop_\d+|done)$")
+            ],
+            ConversationHandler.TIMEOUT: [
+                TypeHandler(Update, task_dialog_timeout)
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=TASK_DIALOG_TIMEOUT,
+        name=CONVERSATION_NAME,
+        persistent=persistence is not None,
+        **conv_options,
     )
+    if shared:
+        application.add_handler(TypeHandler(Update, conv_handler.load_state), group=-1)
+        update_processor.after_update = make_persistence_flush(application, persistence)
     application.add_handler(conv_handler)
-    application.run_polling()
+    application.add_handler(CommandHandler("status", status))
+    application.add_handler(CommandHandler("stats", stats))
+    run(application)
 
 if __name__ == "__main__":
     main()
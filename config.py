@@ -0,0 +1,111 @@
+import os
+import logging
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+
+# Переменные окружения из .env загружаются один раз, до того как модули
+# прочитают из них свои настройки.
+load_dotenv()
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def _csv(value: str | None) -> tuple:
+    """Разбирает список через запятую, отбрасывая пустые элементы."""
+    return tuple(item.strip() for item in (value or "").split(",") if item.strip())
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Общие настройки бота: токены, базы Notion, имена свойств и параметры webhook.
+
+    Читаются из окружения один раз при запуске (``settings``), поэтому
+    обработчики не обращаются к ``os.getenv`` на каждом сообщении.
+    Параметры производительности (лимиты, пулы, таймауты) по-прежнему
+    задаются константами в модулях, которые их используют.
+    """
+
+    telegram_token: str | None = None
+    telegram_base_url: str | None = None
+    telegram_base_file_url: str | None = None
+    openai_api_key: str | None = None
+    notion_token: str | None = None
+
+    idea_database_id: str | None = None
+    task_database_id: str | None = None
+    link_database_id: str | None = None
+
+    idea_title_property: str = "Name"
+    task_title_property: str = "Name"
+    task_interactive_properties: tuple = ()
+    link_title_property: str = "Name"
+    link_url_property: str = "URL"
+    link_tags_property: str = "Tags"
+
+    admin_user_ids: frozenset = frozenset()
+
+    webhook_url: str | None = None
+    webhook_path: str = "telegram"
+    webhook_listen: str = "0.0.0.0"
+    webhook_port: int = 8443
+    webhook_secret: str | None = None
+    webhook_max_connections: int = 40
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """Собирает настройки из переменных окружения."""
+        telegram_base_url = os.getenv("TELEGRAM_BASE_URL") or None
+        return cls(
+            telegram_token=os.getenv("TELEGRAM_TOKEN"),
+            telegram_base_url=telegram_base_url,
+            telegram_base_file_url=os.getenv("TELEGRAM_BASE_FILE_URL") or (
+                telegram_base_url.replace("/bot", "/file/bot") if telegram_base_url else None
+            ),
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            notion_token=os.getenv("NOTION_TOKEN"),
+            idea_database_id=os.getenv("NOTION_DATABASE_ID_IDEA"),
+            task_database_id=os.getenv("NOTION_DATABASE_ID_TASK"),
+            link_database_id=os.getenv("NOTION_DATABASE_ID_LINK"),
+            idea_title_property=os.getenv("NOTION_IDEA_PROPERTY_TITLE", "Name"),
+            task_title_property=os.getenv("NOTION_TASK_PROPERTY_TITLE", "Name"),
+            task_interactive_properties=_csv(os.getenv("NOTION_TASK_INTERACTIVE_PROPERTIES")),
+            link_title_property=os.getenv("NOTION_LINK_PROPERTY_TITLE", "Name"),
+            link_url_property=os.getenv("NOTION_LINK_PROPERTY_URL", "URL"),
+            link_tags_property=os.getenv("NOTION_LINK_PROPERTY_TAGS", "Tags"),
+            admin_user_ids=frozenset(int(user_id) for user_id in _csv(os.getenv("ADMIN_USER_IDS"))),
+            webhook_url=os.getenv("WEBHOOK_URL") or None,
+            webhook_path=os.getenv("WEBHOOK_PATH", "telegram"),
+            webhook_listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+            webhook_port=int(os.getenv("WEBHOOK_PORT", "8443")),
+            webhook_secret=os.getenv("WEBHOOK_SECRET") or None,
+            webhook_max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")),
+        )
+
+    @property
+    def database_ids(self) -> list:
+        """Идентификаторы всех настроенных баз Notion."""
+        return [db_id for db_id in (self.idea_database_id, self.task_database_id, self.link_database_id) if db_id]
+
+    def problems(self) -> list:
+        """Возвращает описания незаполненных настроек, без которых часть функций не работает."""
+        problems = []
+        if not self.notion_token:
+            problems.append("NOTION_TOKEN не задан: запись в Notion работать не будет.")
+        if not self.openai_api_key:
+            problems.append("OPENAI_API_KEY не задан: транскрипция и анализ ссылок не будут работать.")
+        if not self.admin_user_ids:
+            problems.append("ADMIN_USER_IDS не задан: команды /status и /stats недоступны.")
+        for name, value in (("NOTION_DATABASE_ID_IDEA", self.idea_database_id),
+                            ("NOTION_DATABASE_ID_TASK", self.task_database_id),
+                            ("NOTION_DATABASE_ID_LINK", self.link_database_id)):
+            if not value:
+                problems.append(f"{name} не задан.")
+        return problems
+
+
+settings = Settings.from_env()
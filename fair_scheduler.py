@@ -0,0 +1,139 @@
+import os
+import heapq
+import asyncio
+import logging
+import itertools
+import contextvars
+from contextlib import asynccontextmanager, contextmanager
+
+from metrics import timer
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Сколько запросов к ресурсу выполняется одновременно всего и от одного чата.
+FAIR_OPENAI_CONCURRENCY = int(os.getenv("FAIR_OPENAI_CONCURRENCY", "8"))
+FAIR_OPENAI_PER_CHAT = int(os.getenv("FAIR_OPENAI_PER_CHAT", "2"))
+FAIR_WHISPER_CONCURRENCY = int(os.getenv("FAIR_WHISPER_CONCURRENCY", "4"))
+FAIR_WHISPER_PER_CHAT = int(os.getenv("FAIR_WHISPER_PER_CHAT", "2"))
+FAIR_FFMPEG_CONCURRENCY = int(os.getenv("FAIR_FFMPEG_CONCURRENCY", os.getenv("AUDIO_CONVERT_WORKERS", "2")))
+FAIR_FFMPEG_PER_CHAT = int(os.getenv("FAIR_FFMPEG_PER_CHAT", "1"))
+
+# Чат, от имени которого выполняется текущая работа (задает воркер задач или обработчик обновления).
+_chat_var: contextvars.ContextVar = contextvars.ContextVar("fair_chat", default=None)
+
+
+@contextmanager
+def chat_context(chat_id: int | None):
+    """Помечает работу внутри блока как выполняемую для ``chat_id``."""
+    token = _chat_var.set(chat_id)
+    try:
+        yield
+    finally:
+        _chat_var.reset(token)
+
+
+class FairLimiter:
+    """Допуск к дорогому ресурсу (OpenAI, Whisper, ffmpeg) с честной очередью между чатами.
+
+    Одновременно выполняется не больше ``limit`` запросов всего и не больше
+    ``per_chat`` от одного чата. Ожидающие запросы упорядочены по алгоритму
+    start-time fair queuing: каждый запрос получает метку начала
+    ``max(виртуальное время, метка окончания прошлого запроса чата)``, а метка
+    окончания больше ее на стоимость запроса. Поэтому чат, отправивший сотню
+    ссылок, не задерживает чат с одной ссылкой больше, чем на один запрос, а
+    дорогие запросы (длинный текст, долгое аудио) весят больше дешевых.
+    """
+
+    def __init__(self, name: str, limit: int, per_chat: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.per_chat = max(1, per_chat)
+        self.active = 0
+        self._active_by_chat: dict = {}
+        self._finish_tags: dict = {}
+        self._virtual_time = 0.0
+        self._waiters: list = []
+        self._sequence = itertools.count()
+
+    def _can_start(self, chat) -> bool:
+        return self._active_by_chat.get(chat, 0) < self.per_chat
+
+    def _start(self, chat, start_tag: float) -> None:
+        self.active += 1
+        self._active_by_chat[chat] = self._active_by_chat.get(chat, 0) + 1
+        self._virtual_time = max(self._virtual_time, start_tag)
+
+    def _release(self, chat) -> None:
+        self.active -= 1
+        self._active_by_chat[chat] -= 1
+        if not self._active_by_chat[chat]:
+            del self._active_by_chat[chat]
+            # Метка, уже не опережающая виртуальное время, ни на что не влияет
+            if self._finish_tags.get(chat, 0.0) <= self._virtual_time:
+                self._finish_tags.pop(chat, None)
+        self._dispatch()
+        if not self.active and not self._waiters:
+            # Ресурс простаивает — прошлые метки чатов больше не нужны
+            self._finish_tags.clear()
+
+    def _dispatch(self) -> None:
+        """Запускает ожидающие запросы с наименьшими метками, пока есть свободные места."""
+        skipped = []
+        while self._waiters and self.active < self.limit:
+            entry = heapq.heappop(self._waiters)
+            start_tag, _, chat, future = entry
+            if future.done():  # запрос отменен, пока ждал
+                continue
+            if not self._can_start(chat):
+                skipped.append(entry)
+                continue
+            self._start(chat, start_tag)
+            future.set_result(None)
+        for entry in skipped:
+            heapq.heappush(self._waiters, entry)
+
+    @asynccontextmanager
+    async def slot(self, cost: float = 1.0):
+        """Ждет своей очереди и удерживает место на время блока."""
+        chat = _chat_var.get()
+        start_tag = max(self._virtual_time, self._finish_tags.get(chat, 0.0))
+        self._finish_tags[chat] = start_tag + max(cost, 0.01)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (start_tag, next(self._sequence), chat, future))
+        self._dispatch()
+        if not future.done():
+            try:
+                with timer("fair_wait_seconds", resource=self.name):
+                    await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Место выдано в момент отмены — возвращаем его
+                    self._release(chat)
+                raise
+        try:
+            yield
+        finally:
+            self._release(chat)
+
+    def position(self, chat=None) -> int:
+        """Сколько ожидающих запросов будет допущено раньше нового запроса чата (с ним самим)."""
+        chat = _chat_var.get() if chat is None else chat
+        start_tag = max(self._virtual_time, self._finish_tags.get(chat, 0.0))
+        return 1 + sum(1 for tag, _, _, future in self._waiters if tag <= start_tag and not future.done())
+
+    def stats(self) -> dict:
+        """Возвращает число выполняющихся и ожидающих запросов."""
+        return {
+            "active": self.active,
+            "waiting": sum(1 for *_, future in self._waiters if not future.done()),
+            "chats": len(self._active_by_chat),
+        }
+
+
+openai_limiter = FairLimiter("openai", FAIR_OPENAI_CONCURRENCY, FAIR_OPENAI_PER_CHAT)
+whisper_limiter = FairLimiter("whisper", FAIR_WHISPER_CONCURRENCY, FAIR_WHISPER_PER_CHAT)
+ffmpeg_limiter = FairLimiter("ffmpeg", FAIR_FFMPEG_CONCURRENCY, FAIR_FFMPEG_PER_CHAT)
@@ -0,0 +1,285 @@
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# auto | selectolax | lxml | bs4 | legacy
+HTML_EXTRACTOR = os.getenv("HTML_EXTRACTOR", "auto")
+# process | thread
+HTML_EXTRACTOR_POOL = os.getenv("HTML_EXTRACTOR_POOL", "process")
+HTML_EXTRACTOR_WORKERS = int(os.getenv("HTML_EXTRACTOR_WORKERS", "2"))
+
+# Элементы, которые почти никогда не относятся к основному содержимому.
+BOILERPLATE_TAGS = ("script", "style", "noscript", "nav", "footer", "header", "aside", "form", "iframe", "svg", "button")
+BLOCK_TAGS = ("p", "pre", "blockquote", "li", "h1", "h2", "h3", "h4", "h5", "h6")
+# Блоки короче этого порога не добавляют веса своему контейнеру.
+MIN_BLOCK_CHARS = 25
+
+
+def _select_main_text(blocks: list) -> str:
+    """Выбирает контейнер с наибольшим весом текста и возвращает его блоки.
+
+    Каждый блок — кортеж ``(текст, длина текста ссылок, ключ родителя,
+    ключ прародителя, содержит ли блок <p>)``.
+
+    Упрощенный вариант алгоритма Readability: каждый абзац добавляет родителю
+    вес, пропорциональный длине текста и уменьшенный на долю ссылок, а
+    прародителю — половину этого веса. Побеждает самый «тяжелый» контейнер.
+    """
+    scores: dict = {}
+    for text, link_chars, parent, grandparent, _ in blocks:
+        if len(text) < MIN_BLOCK_CHARS:
+            continue
+        link_density = link_chars / len(text)
+        score = (1 + text.count(",") + min(len(text) // 100, 3)) * (1 - link_density)
+        scores[parent] = scores.get(parent, 0) + score
+        if grandparent is not None:
+            scores[grandparent] = scores.get(grandparent, 0) + score / 2
+
+    if not scores:
+        return ""
+
+    best = max(scores, key=scores.get)
+    lines = []
+    for text, link_chars, parent, grandparent, has_paragraph in blocks:
+        if best in (parent, grandparent) and not has_paragraph and text:
+            if len(text) >= MIN_BLOCK_CHARS and link_chars / len(text) > 0.5:
+                continue
+            lines.append(text)
+    return "\n".join(lines)
+
+
+def _extract_selectolax(html: str) -> dict:
+    from selectolax.lexbor import LexborHTMLParser
+
+    tree = LexborHTMLParser(html)
+    title_node = tree.css_first("title")
+    canonical = tree.css_first('link[rel="canonical"]')
+    tree.strip_tags(list(BOILERPLATE_TAGS))
+
+    blocks = []
+    for node in tree.css(", ".join(BLOCK_TAGS)):
+        text = node.text(separator=" ", strip=True)
+        link_chars = sum(len(a.text(strip=True)) for a in node.css("a"))
+        parent = node.parent
+        grandparent = parent.parent if parent is not None else None
+        blocks.append((
+            text,
+            link_chars,
+            parent.mem_id if parent is not None else None,
+            grandparent.mem_id if grandparent is not None else None,
+            node.tag != "p" and node.css_first("p") is not None,
+        ))
+
+    body = tree.body
+    return {
+        "title": title_node.text(strip=True) if title_node else None,
+        "canonical": canonical.attributes.get("href") if canonical else None,
+        "text": _select_main_text(blocks) or (body.text(separator="\n", strip=True) if body else ""),
+    }
+
+
+def _extract_lxml(html: str) -> dict:
+    import lxml.html
+
+    root = lxml.html.document_fromstring(html)
+    tree = root.getroottree()
+    title = root.findtext(".//title")
+    canonical = root.xpath('//link[@rel="canonical"]/@href')
+    for element in list(root.iter(*BOILERPLATE_TAGS)):
+        element.drop_tree()
+
+    blocks = []
+    for element in root.iter(*BLOCK_TAGS):
+        text = " ".join(element.text_content().split())
+        link_chars = sum(len(a.text_content().strip()) for a in element.iter("a"))
+        parent = element.getparent()
+        grandparent = parent.getparent() if parent is not None else None
+        blocks.append((
+            text,
+            link_chars,
+            tree.getpath(parent) if parent is not None else None,
+            tree.getpath(grandparent) if grandparent is not None else None,
+            element.tag != "p" and element.find(".//p") is not None,
+        ))
+
+    body = root.find("body")
+    fallback = "\n".join(line.strip() for line in body.text_content().splitlines() if line.strip()) if body is not None else ""
+    return {
+        "title": title.strip() if title else None,
+        "canonical": canonical[0] if canonical else None,
+        "text": _select_main_text(blocks) or fallback,
+    }
+
+
+def _make_soup(html: str):
+    from bs4 import BeautifulSoup
+
+    try:
+        return BeautifulSoup(html, "lxml")
+    except Exception:
+        return BeautifulSoup(html, "html.parser")
+
+
+def _extract_bs4(html: str) -> dict:
+    soup = _make_soup(html)
+    title = str(soup.title.string) if soup.title and soup.title.string else None
+    canonical = soup.find("link", rel="canonical")
+    for element in soup.find_all(BOILERPLATE_TAGS):
+        element.decompose()
+
+    blocks = []
+    for element in soup.find_all(BLOCK_TAGS):
+        text = element.get_text(" ", strip=True)
+        link_chars = sum(len(a.get_text(strip=True)) for a in element.find_all("a"))
+        parent = element.parent
+        grandparent = parent.parent if parent is not None else None
+        blocks.append((
+            text,
+            link_chars,
+            id(parent) if parent is not None else None,
+            id(grandparent) if grandparent is not None else None,
+            element.name != "p" and element.find("p") is not None,
+        ))
+
+    body = soup.body
+    return {
+        "title": title.strip() if title else None,
+        "canonical": canonical.get("href") if canonical else None,
+        "text": _select_main_text(blocks) or (body.get_text(separator="\n", strip=True) if body else ""),
+    }
+
+
+def extract_legacy(html: str) -> dict:
+    """Прежний способ извлечения: все ``<p>`` страницы через ``html.parser``."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    original_title = str(soup.title.string) if soup.title and soup.title.string else None
+    canonical = soup.find('link', rel='canonical')
+
+    # Простой способ извлечь текст: взять все параграфы
+    paragraphs = soup.find_all('p')
+    text = "\n".join([p.get_text() for p in paragraphs])
+
+    if not text:
+        # Если параграфов нет, попробуем извлечь основной контент
+        main_content = soup.find('main') or soup.find('article') or soup.find('body')
+        if main_content:
+            text = main_content.get_text(separator='\n', strip=True)
+
+    return {"title": original_title, "canonical": canonical.get('href') if canonical else None, "text": text}
+
+
+EXTRACTORS: dict[str, Callable[[str], dict]] = {
+    "selectolax": _extract_selectolax,
+    "lxml": _extract_lxml,
+    "bs4": _extract_bs4,
+    "legacy": extract_legacy,
+}
+
+
+def available_extractors() -> list:
+    """Возвращает имена движков, зависимости которых установлены."""
+    modules = {"selectolax": "selectolax.lexbor", "lxml": "lxml.html", "bs4": "bs4", "legacy": "bs4"}
+    available = []
+    for name, module in modules.items():
+        try:
+            __import__(module)
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+
+def resolve_extractor(name: str = HTML_EXTRACTOR) -> str:
+    """Выбирает движок: заданный явно или самый быстрый из установленных."""
+    available = available_extractors()
+    if name != "auto":
+        if name not in available:
+            logger.warning(f"Движок извлечения '{name}' недоступен, использую автоматический выбор.")
+        else:
+            return name
+    for candidate in ("selectolax", "lxml", "bs4"):
+        if candidate in available:
+            return candidate
+    return "legacy"
+
+
+def extract(html: str, engine: str | None = None) -> dict:
+    """Извлекает заголовок, canonical-ссылку и основной текст из HTML.
+
+    Returns:
+        Словарь с ключами ``title``, ``canonical`` и ``text``.
+    """
+    engine = engine or resolve_extractor()
+    try:
+        return EXTRACTORS[engine](html)
+    except Exception as e:
+        if engine == "legacy":
+            raise
+        logger.warning(f"Движок '{engine}' не справился со страницей ({e}), использую прежний способ.")
+        return extract_legacy(html)
+
+
+_executor: Executor | None = None
+_engine: str | None = None
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if HTML_EXTRACTOR_POOL == "process":
+            # К моменту создания пула в процессе уже работают потоки (asyncio, httpx,
+            # пул ffmpeg), и fork может унаследовать захваченную блокировку
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _executor = ProcessPoolExecutor(
+                max_workers=HTML_EXTRACTOR_WORKERS, mp_context=multiprocessing.get_context(method),
+            )
+        else:
+            _executor = ThreadPoolExecutor(max_workers=HTML_EXTRACTOR_WORKERS, thread_name_prefix="html-extract")
+    return _executor
+
+
+def _get_engine() -> str:
+    global _engine
+    if _engine is None:
+        _engine = resolve_extractor()
+        logger.info(f"Движок извлечения HTML: {_engine}")
+    return _engine
+
+
+async def extract_async(html: str) -> dict:
+    """Извлекает содержимое страницы в пуле воркеров, не блокируя цикл событий."""
+    engine = _get_engine()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), extract, html, engine)
+
+
+async def warm_up_extractor() -> None:
+    """Выбирает движок и запускает воркеры пула, чтобы первая ссылка не ждала их старта."""
+    engine = await asyncio.to_thread(_get_engine)
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    html = "<html><head><title>warm-up</title></head><body><p>warm-up</p></body></html>"
+    await asyncio.gather(*(
+        loop.run_in_executor(executor, extract, html, engine) for _ in range(HTML_EXTRACTOR_WORKERS)
+    ))
+
+
+def shutdown_extractor_pool() -> None:
+    """Останавливает пул воркеров извлечения."""
+    global _executor
+    if _executor is not None:
+        # Ждем выхода воркеров: иначе atexit-обработчик ProcessPoolExecutor пишет
+        # в уже закрытый канал пробуждения (OSError: Bad file descriptor)
+        _executor.shutdown(wait=True, cancel_futures=True)
+    _executor = None
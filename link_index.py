@@ -0,0 +1,282 @@
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from config import settings
+from notion_handler import NOTION_ERRORS, get_notion_client, query_database
+from url_cache import normalize_url
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+LINK_INDEX_PATH = os.getenv("LINK_INDEX_PATH", "link_index.sqlite3")
+# Как часто подтягивать изменения базы ссылок и как часто перечитывать ее целиком
+# (полная синхронизация замечает удаленные страницы), секунд.
+LINK_INDEX_REFRESH_INTERVAL = float(os.getenv("LINK_INDEX_REFRESH_INTERVAL", "300"))
+LINK_INDEX_FULL_SYNC_INTERVAL = float(os.getenv("LINK_INDEX_FULL_SYNC_INTERVAL", "86400"))
+# Сколько секунд запись, ждущая отправки в Notion, переживает полную синхронизацию.
+LINK_INDEX_PENDING_TTL = float(os.getenv("LINK_INDEX_PENDING_TTL", "86400"))
+# Фильтр last_edited_time в Notion работает с точностью до минуты.
+SYNC_OVERLAP = 120
+
+
+def link_key(url: str) -> str:
+    """Ключ ссылки в индексе: нормализованный URL без схемы (http и https — одна ссылка)."""
+    return normalize_url(url).split("://", 1)[-1]
+
+
+def notion_page_url(page_id: str) -> str:
+    """Возвращает ссылку на страницу Notion по ее идентификатору."""
+    return f"https://www.notion.so/{page_id.replace('-', '')}"
+
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat()
+
+
+class LinkIndex:
+    """Индекс ссылок, уже сохраненных в базе ``NOTION_DATABASE_ID_LINK``.
+
+    Индекс целиком хранится в памяти (нормализованный URL -> страница), поэтому
+    проверка на дубликат не требует сетевых запросов. Копия лежит в SQLite,
+    чтобы после перезапуска не перечитывать базу Notion. Первое заполнение
+    идет постраничной выборкой из базы (``query_database``), дальше в фоне
+    подтягиваются только страницы с новым ``last_edited_time``.
+
+    Ссылки, запись которых еще ждет в журнале (``notion_outbox``), хранятся
+    с ключом записи: если Notion ее отклонит, ``forget_pending`` убирает
+    ссылку из индекса, а полная синхронизация забывает такие записи старше
+    ``pending_ttl``.
+    """
+
+    def __init__(self, path: str = LINK_INDEX_PATH, refresh_interval: float = LINK_INDEX_REFRESH_INTERVAL,
+                 full_sync_interval: float = LINK_INDEX_FULL_SYNC_INTERVAL, pending_ttl: float = LINK_INDEX_PENDING_TTL):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.full_sync_interval = full_sync_interval
+        self.pending_ttl = pending_ttl
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._by_url: dict = {}
+        self._url_by_page: dict = {}
+        # Ссылки, ждущие отправки: URL -> (ключ записи журнала, когда добавлена)
+        self._pending: dict = {}
+        self._last_sync = 0.0
+        self._last_full_sync = 0.0
+        self._task: asyncio.Task | None = None
+
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+
+    # === SQLite ===
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS links (
+                    url TEXT PRIMARY KEY,
+                    page_id TEXT,
+                    title TEXT,
+                    outbox_key TEXT,
+                    added_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    name TEXT PRIMARY KEY,
+                    value REAL NOT NULL
+                );
+            """)
+            # Индекс, созданный до появления записей журнала
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(links)")}
+            for column, kind in (("outbox_key", "TEXT"), ("added_at", "REAL")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE links ADD COLUMN {column} {kind}")
+        return self._conn
+
+    def _load_sync(self) -> None:
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute("SELECT url, page_id, title, outbox_key, added_at FROM links").fetchall()
+            meta = dict(conn.execute("SELECT name, value FROM meta").fetchall())
+        for url, page_id, title, outbox_key, added_at in rows:
+            self._remember(url, page_id, title, outbox_key, added_at)
+        self._last_sync = meta.get("last_sync", 0.0)
+        self._last_full_sync = meta.get("last_full_sync", 0.0)
+
+    def _save_sync(self, entries: list, removed: list, full: bool, synced_at: float | None) -> None:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                if full:
+                    conn.execute("DELETE FROM links")
+                conn.executemany("DELETE FROM links WHERE url = ?", [(url,) for url in removed])
+                conn.executemany(
+                    "INSERT OR REPLACE INTO links (url, page_id, title, outbox_key, added_at) VALUES (?, ?, ?, ?, ?)",
+                    entries,
+                )
+                if synced_at is not None:
+                    conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('last_sync', ?)", (synced_at,))
+                    if full:
+                        conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('last_full_sync', ?)", (synced_at,))
+
+    def close(self) -> None:
+        """Закрывает соединение с базой."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # === Индекс в памяти ===
+
+    def _remember(self, url: str, page_id: str | None, title: str | None,
+                  outbox_key: str | None = None, added_at: float | None = None) -> str | None:
+        """Добавляет запись; возвращает прежний URL страницы, если он изменился."""
+        previous = self._url_by_page.get(page_id) if page_id else None
+        if previous and previous != url:
+            self._by_url.pop(previous, None)
+        self._by_url[url] = (page_id, title)
+        if page_id:
+            self._url_by_page[page_id] = url
+            self._pending.pop(url, None)
+        else:
+            self._pending[url] = (outbox_key, added_at or time.time())
+        return previous if previous != url else None
+
+    def get(self, url: str) -> dict | None:
+        """Возвращает сохраненную страницу для ссылки или ``None``.
+
+        ``page_id`` равен ``None``, если запись еще ждет отправки в Notion.
+        """
+        entry = self._by_url.get(link_key(url))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        page_id, title = entry
+        return {"page_id": page_id, "title": title, "url": notion_page_url(page_id) if page_id else None}
+
+    async def add(self, url: str, page_id: str | None, title: str | None, outbox_key: str | None = None) -> None:
+        """Запоминает только что сохраненную ссылку.
+
+        Для ссылки, ждущей отправки (``page_id`` равен ``None``), ``outbox_key`` —
+        ключ записи журнала, создающей ее страницу.
+        """
+        key = link_key(url)
+        added_at = time.time()
+        previous = self._remember(key, page_id, title, outbox_key, added_at)
+        entry = (key, page_id, title, None if page_id else outbox_key, None if page_id else added_at)
+        await asyncio.to_thread(self._save_sync, [entry], [previous] if previous else [], False, None)
+
+    async def forget_pending(self, outbox_keys: list) -> None:
+        """Убирает ссылки, чьи записи в журнале окончательно отклонены Notion."""
+        keys = set(outbox_keys)
+        removed = [url for url, (outbox_key, _) in self._pending.items() if outbox_key in keys]
+        for url in removed:
+            del self._pending[url]
+            self._by_url.pop(url, None)
+        if removed:
+            logger.info(f"Из индекса ссылок убраны неотправленные записи: {len(removed)}")
+            await asyncio.to_thread(self._save_sync, [], removed, False, None)
+
+    def stats(self) -> dict:
+        """Возвращает размер индекса и число попаданий."""
+        return {"size": len(self._by_url), "hits": self.hits, "misses": self.misses,
+                "last_sync_age": time.time() - self._last_sync if self._last_sync else None}
+
+    # === Синхронизация с Notion ===
+
+    async def sync(self, full: bool = False) -> int:
+        """Подтягивает из Notion страницы базы ссылок.
+
+        При ``full=True`` (или если индекс еще не заполнялся) база читается
+        целиком и индекс строится заново, иначе запрашиваются только страницы,
+        измененные после прошлой синхронизации. Возвращает число прочитанных страниц.
+        """
+        database_id = settings.link_database_id
+        url_prop = settings.link_url_property
+        if not database_id or not get_notion_client():
+            return 0
+
+        full = full or not self._last_sync
+        started = time.time()
+        query = {"page_size": 100}
+        if not full:
+            query["filter"] = {
+                "timestamp": "last_edited_time",
+                "last_edited_time": {"on_or_after": _iso(self._last_sync - SYNC_OVERLAP)},
+            }
+
+        entries = []
+        cursor = None
+        while True:
+            response = await query_database(database_id, **query, **({"start_cursor": cursor} if cursor else {}))
+            for page in response.get('results', []):
+                properties = page.get('properties', {})
+                url = (properties.get(url_prop) or {}).get('url')
+                if not url:
+                    continue
+                title = next(
+                    ("".join(part.get('plain_text', '') for part in prop['title'])
+                     for prop in properties.values() if prop.get('type') == 'title'),
+                    None,
+                )
+                entries.append((link_key(url), page['id'], title, None, None))
+            if not response.get('has_more'):
+                break
+            cursor = response.get('next_cursor')
+
+        if full:
+            # Недавние записи, еще ждущие отправки в Notion, переживают полную перестройку
+            pending = [
+                (url, None, title, *self._pending[url])
+                for url, (page_id, title) in self._by_url.items()
+                if page_id is None and started - self._pending[url][1] < self.pending_ttl
+            ]
+            self._by_url, self._url_by_page, self._pending = {}, {}, {}
+            entries = pending + entries
+        removed = [previous for entry in entries if (previous := self._remember(*entry))]
+        await asyncio.to_thread(self._save_sync, entries, removed, full, started)
+        self._last_sync = started
+        if full:
+            self._last_full_sync = started
+        logger.info(f"Индекс ссылок {'перестроен' if full else 'обновлен'}: прочитано {len(entries)}, всего {len(self._by_url)}.")
+        return len(entries)
+
+    async def start(self) -> None:
+        """Загружает индекс с диска и запускает фоновую синхронизацию."""
+        await asyncio.to_thread(self._load_sync)
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        """Останавливает синхронизацию и закрывает базу."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.close()
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                full = time.time() - self._last_full_sync >= self.full_sync_interval
+                await self.sync(full=full)
+            except asyncio.CancelledError:
+                raise
+            except NOTION_ERRORS as e:
+                logger.warning(f"Не удалось синхронизировать индекс ссылок: {e}")
+            except Exception as e:
+                # Любая другая ошибка не должна останавливать фоновую синхронизацию
+                logger.error(f"Ошибка синхронизации индекса ссылок: {e!r}")
+            await asyncio.sleep(self.refresh_interval)
+
+
+link_index = LinkIndex()
@@ -0,0 +1,356 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from bisect import bisect_left
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Callable
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Порт HTTP-эндпоинта /metrics в формате Prometheus (0 — не запускать).
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Запросы дольше порога (секунд) логируются с разбивкой по этапам.
+SLOW_REQUEST_THRESHOLD = float(os.getenv("SLOW_REQUEST_THRESHOLD", "15"))
+# 1 — семплировать стек потока событий и показывать горячие места медленных запросов.
+PROFILE_SLOW_REQUESTS = os.getenv("PROFILE_SLOW_REQUESTS", "0") == "1"
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", "0.01"))
+
+# Границы корзин гистограмм задержек, секунд.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами, как в Prometheus."""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Оценивает квантиль по корзинам (верхняя граница корзины)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: tuple, extra: dict | None = None) -> str:
+    items = list(labels) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+class Registry:
+    """Счетчики, гистограммы и сборщики метрик процесса.
+
+    Сборщики — функции без аргументов, возвращающие словарь чисел (например,
+    ``url_cache.stats``); их значения отдаются как gauge при каждом чтении.
+    """
+
+    def __init__(self):
+        self.counters: dict = {}
+        self.histograms: dict = {}
+        self.collectors: dict = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _labels_key(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, _labels_key(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def register_collector(self, name: str, collect: Callable[[], dict]) -> None:
+        self.collectors[name] = collect
+
+    def _collect(self) -> dict:
+        gauges = {}
+        for prefix, collect in self.collectors.items():
+            try:
+                values = collect()
+            except Exception as e:
+                logger.warning(f"Не удалось собрать метрики {prefix}: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges[f"{prefix}_{key}"] = value
+        return gauges
+
+    def render_prometheus(self) -> str:
+        """Возвращает метрики в текстовом формате Prometheus."""
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, {'le': bound})} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, {'le': '+Inf'})} {histogram.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        for name, value in sorted(self._collect().items()):
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def render_summary(self) -> str:
+        """Возвращает краткую сводку для команды /stats."""
+        lines = []
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            label = ",".join(str(value) for _, value in labels)
+            lines.append(
+                f"{name}[{label}]: n={histogram.count}, среднее {histogram.sum / histogram.count:.2f} с, "
+                f"p50≤{histogram.quantile(0.5)} с, p99≤{histogram.quantile(0.99)} с"
+            )
+        for (name, labels), value in sorted(self.counters.items()):
+            label = ",".join(str(value) for _, value in labels)
+            lines.append(f"{name}[{label}]: {value:g}")
+        for name, value in sorted(self._collect().items()):
+            lines.append(f"{name}: {value:g}")
+        return "\n".join(lines) or "Метрик пока нет."
+
+
+registry = Registry()
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """Увеличивает счетчик."""
+    registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """Добавляет наблюдение в гистограмму."""
+    registry.observe(name, value, **labels)
+
+
+class StartupTimer:
+    """Этапы холодного старта в секундах от запуска бота.
+
+    Этапы: ``imports`` — модули загружены, ``ready`` — бот принимает
+    обновления, ``warm_up`` — прогрев завершен, ``first_response`` — обработано
+    первое обновление. Каждый этап фиксируется один раз и пишется в лог.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: dict = {}
+
+    def begin(self, started: float) -> None:
+        """Задает момент запуска (например, замеренный до тяжелых импортов)."""
+        self.started = started
+
+    def mark(self, phase: str) -> None:
+        if phase in self.phases:
+            return
+        self.phases[phase] = time.perf_counter() - self.started
+        logger.info(f"Запуск: этап {phase} через {self.phases[phase]:.2f} с")
+
+    def stats(self) -> dict:
+        return {f"{phase}_seconds": round(seconds, 3) for phase, seconds in self.phases.items()}
+
+
+startup = StartupTimer()
+
+
+# === Замеры ===
+
+# Трассировка текущего запроса: этапы, замеренные внутри track_request().
+_trace_var: contextvars.ContextVar = contextvars.ContextVar("metrics_trace", default=None)
+
+
+@contextmanager
+def timer(name: str, **labels):
+    """Замеряет блок кода (в том числе с ``await`` внутри).
+
+    Длительность попадает в гистограмму ``name``, ошибка — в счетчик
+    ``<name>_errors_total``. Этап также записывается в текущую трассировку
+    запроса, если она есть.
+    """
+    trace = _trace_var.get()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        registry.inc(f"{name.removesuffix('_seconds')}_errors_total", **labels)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        registry.observe(name, elapsed, **labels)
+        if trace is not None:
+            trace.stages.append((",".join(str(value) for value in labels.values()) or name, elapsed))
+
+
+# === Трассировка запросов и профилировщик ===
+
+class RequestTrace:
+    """Этапы одного запроса (обработки ссылки, голосового и т.п.)."""
+
+    def __init__(self, flow: str):
+        self.flow = flow
+        self.stages: list = []
+        self.started = time.perf_counter()
+
+
+class SamplingProfiler:
+    """Семплирующий профилировщик потока событий.
+
+    Отдельный поток раз в ``interval`` секунд снимает стек главного потока
+    и хранит снимки за последние ``window`` секунд. Для медленного запроса
+    можно получить самые частые стеки за время его выполнения. Снимки
+    включают работу всех одновременных запросов, поэтому это подсказка, а
+    не точная атрибуция.
+    """
+
+    def __init__(self, interval: float = PROFILER_INTERVAL, window: float = 300.0):
+        self.interval = interval
+        self._samples: deque = deque(maxlen=int(window / interval))
+        self._thread_id = threading.main_thread().ident
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < 6:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            self._samples.append((time.perf_counter(), tuple(stack)))
+
+    def top(self, since: float, until: float, limit: int = 5) -> tuple:
+        """Возвращает ``(всего снимков, доля простоя, [(стек, доля), ...])`` за интервал."""
+        samples = [stack for taken, stack in list(self._samples) if since <= taken <= until]
+        if not samples:
+            return 0, 0.0, []
+        # Ожидание в селекторе — цикл событий простаивает в ожидании сети
+        busy = [stack for stack in samples if not stack[0].startswith("selectors.py")]
+        counts = Counter(busy)
+        idle = 1 - len(busy) / len(samples)
+        return len(samples), idle, [(stack, count / len(samples)) for stack, count in counts.most_common(limit)]
+
+
+profiler: SamplingProfiler | None = None
+
+
+@contextmanager
+def track_request(flow: str):
+    """Замеряет весь запрос и логирует разбивку по этапам, если он медленный."""
+    trace = RequestTrace(flow)
+    try:
+        with timer("request_seconds", flow=flow):
+            token = _trace_var.set(trace)
+            try:
+                yield trace
+            finally:
+                _trace_var.reset(token)
+    finally:
+        elapsed = time.perf_counter() - trace.started
+        if elapsed >= SLOW_REQUEST_THRESHOLD:
+            _log_slow_request(trace, elapsed)
+
+
+def _log_slow_request(trace: RequestTrace, elapsed: float) -> None:
+    stages = ", ".join(f"{stage} {seconds:.2f} с" for stage, seconds in trace.stages) or "нет данных"
+    message = f"Медленный запрос {trace.flow}: {elapsed:.1f} с. Этапы: {stages}"
+    if profiler is not None:
+        total, idle, top = profiler.top(trace.started, trace.started + elapsed)
+        if total:
+            message += f"\nПрофиль ({total} снимков, ожидание сети {idle:.0%}):"
+            for stack, share in top:
+                message += f"\n  {share:.0%}  " + " <- ".join(stack)
+    logger.warning(message)
+
+
+# === HTTP-эндпоинт ===
+
+_server: asyncio.AbstractServer | None = None
+
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await reader.readline()
+        # Заголовки запроса не нужны, но их надо дочитать
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        path = request_line.split()[1].decode() if len(request_line.split()) > 1 else "/"
+        if path.split("?")[0] == "/metrics":
+            status, body = "200 OK", registry.render_prometheus().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics(port: int = METRICS_PORT, host: str = METRICS_HOST) -> None:
+    """Запускает эндпоинт /metrics (если задан порт) и профилировщик (если включен)."""
+    global _server, profiler
+    if port:
+        _server = await asyncio.start_server(_handle_http, host, port)
+        logger.info(f"Метрики Prometheus доступны на http://{host}:{port}/metrics")
+    if PROFILE_SLOW_REQUESTS and profiler is None:
+        profiler = SamplingProfiler()
+        profiler.start()
+        logger.info("Профилировщик медленных запросов включен.")
+
+
+async def stop_metrics() -> None:
+    """Останавливает эндпоинт и профилировщик."""
+    global _server, profiler
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
+    if profiler is not None:
+        profiler.stop()
+        profiler = None
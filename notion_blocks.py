@@ -0,0 +1,54 @@
+# Лимиты API Notion: символов в одном элементе rich_text, элементов rich_text
+# в одном блоке и дочерних блоков в одном запросе.
+RICH_TEXT_LIMIT = 2000
+RICH_TEXT_ITEMS_LIMIT = 100
+CHILDREN_LIMIT = 100
+
+
+def split_text(text: str, limit: int = RICH_TEXT_LIMIT) -> list:
+    """Делит текст на максимальные куски не длиннее ``limit`` символов.
+
+    Разрез по возможности делается после пробела, чтобы не рвать слова;
+    склеенные куски дают исходный текст без потерь.
+    """
+    segments = []
+    while len(text) > limit:
+        cut = text.rfind(" ", limit // 2, limit)
+        cut = cut + 1 if cut != -1 else limit
+        segments.append(text[:cut])
+        text = text[cut:]
+    if text:
+        segments.append(text)
+    return segments
+
+
+def rich_text(text: str) -> list:
+    """Возвращает массив rich_text для текста любой длины (до 100 сегментов)."""
+    return [{"type": "text", "text": {"content": segment}} for segment in split_text(text)][:RICH_TEXT_ITEMS_LIMIT]
+
+
+def paragraph_blocks(text: str | None) -> list:
+    """Превращает текст в как можно меньше блоков paragraph.
+
+    Непустые строки склеиваются через ``\n`` и делятся на максимальные
+    сегменты по 2000 символов; блок вмещает до 100 сегментов, поэтому новый
+    блок начинается, только когда заполнен предыдущий.
+    """
+    segments = split_text("\n".join(line for line in (text or "").split("\n") if line))
+    return [
+        {
+            "object": "block",
+            "type": "paragraph",
+            "paragraph": {"rich_text": [
+                {"type": "text", "text": {"content": segment}}
+                for segment in segments[start:start + RICH_TEXT_ITEMS_LIMIT]
+            ]},
+        }
+        for start in range(0, len(segments), RICH_TEXT_ITEMS_LIMIT)
+    ]
+
+
+def split_children(blocks: list) -> tuple:
+    """Делит блоки на первую порцию для ``pages.create`` и остаток пачками по 100."""
+    batches = [blocks[start:start + CHILDREN_LIMIT] for start in range(0, len(blocks), CHILDREN_LIMIT)]
+    return (batches[0] if batches else []), batches[1:]
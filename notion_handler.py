@@ -1,23 +1,186 @@
 import os
+import asyncio
 import logging
+import operator
+import httpx
 import notion_client
-from typing import Dict, List, Optional, Tuple
+from notion_client.errors import HTTPResponseError, RequestTimeoutError
+
+from config import settings
+from metrics import inc, timer
+from notion_blocks import rich_text
+from rate_limiter import TokenBucket, call_with_retry
+from schema_cache import SchemaCache
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_notion_client():
-    """Инициализирует и возвращает клиент Notion."""
-    notion_token = os.getenv("NOTION_TOKEN")
+# Один долгоживущий асинхронный клиент на весь процесс: соединения с API Notion
+# переиспользуются (keep-alive), а число одновременных запросов ограничено семафором.
+NOTION_MAX_CONCURRENCY = int(os.getenv("NOTION_MAX_CONCURRENCY", "3"))
+NOTION_TIMEOUT = float(os.getenv("NOTION_TIMEOUT", "30"))
+# Notion допускает в среднем ~3 запроса в секунду на интеграцию.
+NOTION_RATE_LIMIT = float(os.getenv("NOTION_RATE_LIMIT", "3"))
+NOTION_RATE_BURST = float(os.getenv("NOTION_RATE_BURST", "3"))
+NOTION_MAX_RETRIES = int(os.getenv("NOTION_MAX_RETRIES", "5"))
+# Адрес API Notion (например, локальная заглушка из bench/fake_services.py).
+NOTION_BASE_URL = os.getenv("NOTION_BASE_URL", "https://api.notion.com")
+# Версия API, под которую написан бот: схема и выборки на уровне базы данных.
+# notion-client 3 по умолчанию использует версию с источниками данных (data sources).
+NOTION_VERSION = os.getenv("NOTION_VERSION", "2022-06-28")
+
+# Запросы, повтор которых после таймаута или 5xx может создать дубликат
+# (ответ мог потеряться уже после записи). Для них повторяются только 429 и
+# 503, а таймауты разбирает сверка в журнале записей (notion_outbox).
+NON_IDEMPOTENT_ENDPOINTS = frozenset({"pages.create", "blocks.children.append"})
+
+# Общий для всего процесса ограничитель частоты запросов к Notion.
+rate_limiter = TokenBucket(NOTION_RATE_LIMIT, NOTION_RATE_BURST)
+
+# Ошибки, которые остаются после исчерпания повторов.
+NOTION_ERRORS = (HTTPResponseError, RequestTimeoutError, httpx.HTTPError)
+
+_notion: notion_client.AsyncClient | None = None
+_semaphore: asyncio.Semaphore | None = None
+
+
+def get_notion_client() -> notion_client.AsyncClient | None:
+    """Возвращает общий асинхронный клиент Notion, создавая его при первом вызове."""
+    global _notion
+    if _notion is not None:
+        return _notion
+
+    notion_token = settings.notion_token
     if not notion_token:
         logger.error("NOTION_TOKEN не найден в переменных окружения.")
         return None
-    return notion_client.Client(auth=notion_token)
 
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=NOTION_MAX_CONCURRENCY,
+            max_keepalive_connections=NOTION_MAX_CONCURRENCY,
+            keepalive_expiry=60,
+        ),
+    )
+    _notion = notion_client.AsyncClient(
+        auth=notion_token,
+        client=http_client,
+        timeout_ms=int(NOTION_TIMEOUT * 1000),
+        base_url=NOTION_BASE_URL,
+        notion_version=NOTION_VERSION,
+        # Повторы выполняет только call_with_retry: через ограничитель частоты и с метриками
+        retry=False,
+    )
+    return _notion
+
+
+async def close_notion_client() -> None:
+    """Закрывает общий клиент Notion и его пул соединений."""
+    global _notion, _semaphore
+    if _notion is not None:
+        await _notion.aclose()
+        logger.info("Клиент Notion закрыт.")
+    _notion = None
+    _semaphore = None
+
+
+def _retry_after(error: Exception) -> float | None:
+    """Определяет, можно ли повторить запрос после ошибки.
+
+    Возвращает паузу из ``Retry-After`` для 429, ``0`` для прочих временных
+    ошибок (5xx, таймауты, сетевые сбои) и ``None``, если повтор бессмыслен.
+    """
+    if isinstance(error, (RequestTimeoutError, httpx.TimeoutException, httpx.TransportError)):
+        return 0
+    if isinstance(error, HTTPResponseError):
+        if error.status == 429:
+            try:
+                return max(float(error.headers.get("Retry-After", 1)), 0.1)
+            except (TypeError, ValueError):
+                return 1.0
+        if error.status >= 500:
+            return 0
+    return None
+
+
+def _retry_after_unsafe(error: Exception) -> float | None:
+    """Как ``_retry_after``, но только для ответов, означающих, что запрос не выполнен (429, 503)."""
+    if isinstance(error, HTTPResponseError) and error.status in (429, 503):
+        return _retry_after(error)
+    return None
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Возвращает ``True``, если запрос имеет смысл повторить позже."""
+    return _retry_after(error) is not None
+
+
+def is_ambiguous_error(error: Exception) -> bool:
+    """Возвращает ``True``, если запрос мог выполниться, хотя ответ не получен.
+
+    Так бывает при таймауте, обрыве соединения и 5xx, кроме 503. Ответы 429 и
+    503, а также неудачная попытка соединиться означают, что запрос не выполнен.
+    """
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)):
+        return False
+    return is_transient_error(error) and _retry_after_unsafe(error) is None
+
+
+def _log_retry(error: Exception, attempt: int, delay: float) -> None:
+    inc("notion_retries_total")
+    logger.warning(f"Временная ошибка Notion ({error}), повтор #{attempt} через {delay:.1f} с.")
+
+
+def get_rate_limiter_stats() -> dict:
+    """Возвращает метрики очереди запросов к Notion."""
+    return rate_limiter.stats()
+
+
+async def notion_request(endpoint: str, **kwargs) -> dict:
+    """Выполняет запрос к API Notion через общий клиент.
+
+    Запрос проходит через общий ограничитель частоты; ответы 429 (с учетом
+    ``Retry-After``), 5xx и таймауты повторяются с экспоненциальной задержкой.
+    Для ``NON_IDEMPOTENT_ENDPOINTS`` повторяются только 429 и 503.
+
+    Args:
+        endpoint: Путь к методу клиента, например ``"pages.create"``.
+        **kwargs: Аргументы метода.
+
+    Returns:
+        Ответ API Notion.
+
+    Raises:
+        RuntimeError: Если клиент не настроен.
+        notion_client.errors.HTTPResponseError: При ошибке API после всех повторов.
+    """
+    global _semaphore
+    notion = get_notion_client()
+    if not notion:
+        raise RuntimeError("Клиент Notion не настроен.")
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(NOTION_MAX_CONCURRENCY)
+
+    method = operator.attrgetter(endpoint)(notion)
 
-def get_database_properties(database_id: str) -> dict:
-    """Возвращает свойства Notion-базы данных с типами select и multi_select.
+    async def attempt():
+        async with _semaphore:
+            return await method(**kwargs)
+
+    # Время включает ожидание ограничителя частоты и все повторы
+    with timer("notion_request_seconds", endpoint=endpoint):
+        return await call_with_retry(
+            attempt,
+            limiter=rate_limiter,
+            classify=_retry_after_unsafe if endpoint in NON_IDEMPOTENT_ENDPOINTS else _retry_after,
+            max_retries=NOTION_MAX_RETRIES,
+            on_retry=_log_retry,
+        )
+
+
+async def fetch_database_properties(database_id: str) -> dict:
+    """Загружает из Notion свойства базы данных с типами select и multi_select.
 
     Args:
         database_id: Идентификатор базы данных в Notion.
@@ -26,12 +189,11 @@ def get_database_properties(database_id: str) -> dict:
         Словарь с именами свойств и их возможными значениями.
         Возвращает ``None`` в случае ошибки или отсутствия клиента.
     """
-    notion = get_notion_client()
-    if not notion:
+    if not get_notion_client():
         return None
 
     try:
-        response = notion.databases.retrieve(database_id=database_id)
+        response = await notion_request("databases.retrieve", database_id=database_id)
         properties = {}
         for name, prop_data in response.get('properties', {}).items():
             if prop_data.get('type') in ['select', 'multi_select']:
@@ -40,63 +202,66 @@ def get_database_properties(database_id: str) -> dict:
                     'options': [opt['name'] for opt in prop_data[prop_data['type']]['options']]
                 }
         return properties
-    except notion_client.APIResponseError as e:
+    except NOTION_ERRORS as e:
         logger.error(
             f"Ошибка при получении свойств базы данных {database_id}: {e}"
         )
         return None
 
-def update_page_properties(page_id: str, properties_to_update: dict):
-    """
 
+# Схемы баз меняются редко, поэтому держим их в памяти и обновляем в фоне.
+schema_cache = SchemaCache(
+    fetch_database_properties,
+    ttl=float(os.getenv("NOTION_SCHEMA_CACHE_TTL", "300")),
+)
 
-    try:
-        title_prop = title_property_name or "Name"
-        new_page_data = {
-            "parent": {"database_id": database_id},
-            "properties": {
 
-                }
-            }
-        }
-        response = notion.pages.create(**new_page_data)
-        logger.info("Успешно создана новая страница в Notion.")
-        return response
-    except notion_client.APIResponseError as e:
-        logger.error(f"Ошибка при создании страницы Notion: {e}")
-        return None
+async def get_database_properties(database_id: str) -> dict:
+    """Возвращает свойства базы данных из кэша схем.
 
-def create_link_page(database_id: str, title_prop: str, url_prop: str, tags_prop: str, data: dict):
-    """
-    Создает страницу для ссылки в Notion с кастомными названиями свойств.
-    """
+    Args:
+        database_id: Идентификатор базы данных в Notion.
 
+    Returns:
+        Словарь с именами свойств и их возможными значениями
+        или ``None``, если схему не удалось получить.
+    """
+    return await schema_cache.get(database_id)
 
-    try:
 
-        new_page_response = notion.pages.create(
-            parent={"database_id": database_id},
-            properties=page_properties
-        )
-        page_id = new_page_response['id']
-        logger.info(f"Успешно создана страница для ссылки с ID: {page_id}")
+async def warm_up_schema_cache(database_ids: list) -> None:
+    """Предзагружает схемы указанных баз данных."""
+    await schema_cache.warm_up(database_ids)
 
+async def query_database(database_id: str, **body) -> dict:
+    """Выполняет ``databases.query`` через общий ``notion_request``.
 
-        if summary:
-            summary_blocks = []
-            for p in summary.split('\n'):
-                if p: # Игнорируем пустые строки
-                    summary_blocks.append({
-                        "object": "block",
-                        "type": "paragraph",
-                        "paragraph": {"rich_text": [{"type": "text", "text": {"content": p}}]}
-                    })
+    В notion-client 3 метода ``databases.query`` нет, поэтому запрос
+    отправляется через универсальный ``request`` клиента.
+    """
+    return await notion_request("request", path=f"databases/{database_id}/query", method="POST", body=body)
 
-            if summary_blocks:
-                notion.blocks.children.append(block_id=page_id, children=summary_blocks)
-                logger.info(f"Успешно добавлено саммари на страницу {page_id}")
+def page_properties(title_property_name: str, title: str, properties: dict | None = None) -> dict:
+    """Собирает свойства страницы: заголовок и дополнительные свойства."""
+    return {
+        (title_property_name or "Name"): {"title": rich_text(title)},
+        **(properties or {}),
+    }
 
-        return new_page_response
-    except notion_client.APIResponseError as e:
+def link_page_properties(title_prop: str, url_prop: str, tags_prop: str, data: dict) -> dict:
+    """Собирает свойства страницы ссылки: заголовок, URL и теги."""
+    properties = {
+        title_prop: {"title": rich_text(data.get('title') or data.get('url', ''))},
+        url_prop: {"url": data.get('url')},
+    }
+    if data.get('tags'):
+        properties[tags_prop] = {"multi_select": [{"name": tag} for tag in data['tags'] if tag]}
+    return properties
 
-        return None
+async def append_blocks(page_id: str, batches: list) -> None:
+    """
+    Дописывает на страницу пачки блоков (не больше 100 в пачке) по порядку.
+    Ошибки API пробрасываются вызывающему.
+    """
+    for batch in batches:
+        await notion_request("blocks.children.append", block_id=page_id, children=batch)
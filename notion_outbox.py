@@ -0,0 +1,661 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from telegram import Bot
+from telegram.error import TelegramError
+
+from metrics import inc
+from notion_blocks import rich_text, split_children
+from notion_handler import (
+    NOTION_ERRORS,
+    append_blocks,
+    is_ambiguous_error,
+    is_transient_error,
+    notion_request,
+    query_database,
+)
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "outbox.sqlite3")
+# Задержка повтора после временной ошибки: удваивается с каждой попыткой до OUTBOX_MAX_RETRY_DELAY.
+OUTBOX_RETRY_DELAY = float(os.getenv("OUTBOX_RETRY_DELAY", "15"))
+OUTBOX_MAX_RETRY_DELAY = float(os.getenv("OUTBOX_MAX_RETRY_DELAY", "600"))
+# После стольких неудачных попыток запись отклоняется, а пользователь получает сообщение об этом.
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "12"))
+# При такой длине очереди записи об одной странице объединяются в один запрос.
+OUTBOX_COALESCE_THRESHOLD = int(os.getenv("OUTBOX_COALESCE_THRESHOLD", "20"))
+# Сколько хранить выполненные записи (для идемпотентности повторов), секунд.
+OUTBOX_KEEP_DONE = float(os.getenv("OUTBOX_KEEP_DONE", "86400"))
+# Необязательное текстовое свойство баз Notion, в которое пишется ключ идемпотентности.
+NOTION_IDEMPOTENCY_PROPERTY = os.getenv("NOTION_IDEMPOTENCY_PROPERTY", "")
+# Notion сравнивает в фильтре не больше 2000 символов.
+RICH_TEXT_FILTER_LIMIT = 2000
+
+CREATE_PAGE = "create_page"
+UPDATE_PAGE = "update_page"
+APPEND_BLOCKS = "append_blocks"
+
+
+@dataclass
+class OutboxEntry:
+    """Запись о намерении изменить Notion."""
+    id: int
+    key: str
+    op: str
+    payload: dict
+    page_ref: str | None
+    attempts: int
+    created_at: float
+    chat_id: int | None
+    message_id: int | None
+    notify_text: str | None
+    page_id: str | None = None
+    uncertain: bool = False
+
+
+@dataclass
+class OutboxResult:
+    """Итог отправки записи: ``done`` — выполнена, ``queued`` — ждет в очереди, ``failed`` — отклонена."""
+    status: str
+    response: dict | None = None
+
+    @property
+    def saved(self) -> bool:
+        return self.status in ("done", "queued")
+
+
+class OutboxStore:
+    """Журнал записей в Notion в SQLite.
+
+    Каждая запись сохраняется до первой попытки выполнить ее и помечается
+    выполненной только после ответа Notion. Ключ записи уникален, поэтому
+    повторная постановка того же намерения ничего не дублирует.
+    """
+
+    COLUMNS = "id, key, op, payload, page_ref, attempts, created_at, chat_id, message_id, notify_text, page_id, uncertain"
+    # Записи одной страницы (создающая и зависящие от нее) выполняются строго по порядку,
+    # записи разных страниц друг друга не ждут
+    CHAIN_READY = ("NOT EXISTS (SELECT 1 FROM outbox AS prev WHERE prev.id < outbox.id "
+                   "AND prev.status IN ('pending', 'running') AND outbox.page_ref IS NOT NULL "
+                   "AND (prev.key = outbox.page_ref OR prev.page_ref = outbox.page_ref))")
+
+    def __init__(self, path: str = OUTBOX_PATH):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT NOT NULL UNIQUE,
+                    op TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    page_ref TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    run_after REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    page_id TEXT,
+                    error TEXT,
+                    chat_id INTEGER,
+                    message_id INTEGER,
+                    notify_text TEXT
+                );
+                CREATE INDEX IF NOT EXISTS outbox_pending ON outbox(status, id);
+                CREATE INDEX IF NOT EXISTS outbox_page_ref ON outbox(page_ref, status);
+            """)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+            if "uncertain" not in columns:
+                # 1 — прошлая попытка могла выполниться в Notion, хотя ответ не получен
+                self._conn.execute("ALTER TABLE outbox ADD COLUMN uncertain INTEGER NOT NULL DEFAULT 0")
+        return self._conn
+
+    @classmethod
+    def _entry(cls, row: tuple) -> OutboxEntry:
+        return OutboxEntry(
+            id=row[0], key=row[1], op=row[2], payload=json.loads(row[3]), page_ref=row[4], attempts=row[5],
+            created_at=row[6], chat_id=row[7], message_id=row[8], notify_text=row[9], page_id=row[10],
+            uncertain=bool(row[11]),
+        )
+
+    def _add_sync(self, key: str, op: str, payload: dict, page_ref: str | None, notify: tuple | None,
+                  claim: bool) -> tuple:
+        chat_id, message_id, notify_text = notify or (None, None, None)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO outbox (key, op, payload, page_ref, run_after, created_at, chat_id, message_id, notify_text) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, op, json.dumps(payload, ensure_ascii=False), page_ref, now, now, chat_id, message_id, notify_text),
+                )
+                # Забираем запись под той же блокировкой, чтобы ее не перехватил разборщик
+                claimed = self._claim_locked(
+                    conn, f"key = ? AND status = 'pending' AND {self.CHAIN_READY}", (key,),
+                ) if claim else []
+            status, page_id = conn.execute("SELECT status, page_id FROM outbox WHERE key = ?", (key,)).fetchone()
+        return status, page_id, claimed[0] if claimed else None
+
+    def _claim_locked(self, conn: sqlite3.Connection, where: str, params: tuple) -> list:
+        rows = conn.execute(
+            f"UPDATE outbox SET status = 'running', attempts = attempts + 1 WHERE {where} RETURNING {self.COLUMNS}",
+            params,
+        ).fetchall()
+        return sorted((self._entry(row) for row in rows), key=lambda entry: entry.id)
+
+    def _claim_sync(self, where: str, params: tuple) -> list:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return self._claim_locked(conn, where, params)
+
+    def _next_sync(self) -> tuple:
+        """Забирает запись, которая раньше других готова к повтору.
+
+        Запись, перед которой в очереди стоит невыполненная запись той же
+        страницы, ждет ее. Возвращает ``(запись, None)`` или
+        ``(None, сколько секунд ждать)``.
+        """
+        with self._lock:
+            row = self._connect().execute(
+                f"SELECT id, run_after FROM outbox WHERE status = 'pending' AND {self.CHAIN_READY} "
+                "ORDER BY run_after, id LIMIT 1"
+            ).fetchone()
+        if row is None:
+            return None, None
+        wait = row[1] - time.time()
+        if wait > 0:
+            return None, wait
+        claimed = self._claim_sync("id = ? AND status = 'pending'", (row[0],))
+        return (claimed[0], None) if claimed else (None, 0)
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return cursor
+
+    def _execute_many(self, sql: str, params: list) -> None:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(sql, params)
+
+    def _stats_sync(self) -> dict:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT COUNT(*), MIN(created_at) FROM outbox WHERE status IN ('pending', 'running')"
+            ).fetchone()
+            failed = self._connect().execute("SELECT COUNT(*) FROM outbox WHERE status = 'failed'").fetchone()[0]
+        return {"pending": row[0], "oldest_age": time.time() - row[1] if row[1] else 0.0, "failed": failed}
+
+    async def add(self, key: str, op: str, payload: dict, page_ref: str | None = None, notify: tuple | None = None,
+                  claim: bool = False) -> tuple:
+        """Сохраняет запись, если записи с таким ключом еще нет.
+
+        С ``claim=True`` сразу забирает ожидающую запись для выполнения, если
+        перед ней нет невыполненных записей той же страницы.
+
+        Returns:
+            ``(status, page_id, забранная запись или None)``.
+        """
+        return await asyncio.to_thread(self._add_sync, key, op, payload, page_ref, notify, claim)
+
+    async def claim_next(self) -> tuple:
+        """Забирает следующую готовую запись очереди (по порядку внутри страницы)."""
+        return await asyncio.to_thread(self._next_sync)
+
+    async def claim_related(self, entry: OutboxEntry) -> list:
+        """Забирает ожидающие записи, которые можно объединить с ``entry``."""
+        if entry.attempts > 1 or entry.page_id:
+            # Прошлая попытка могла создать страницу — объединять небезопасно
+            return []
+        if entry.op == CREATE_PAGE:
+            where, params = "status = 'pending' AND page_ref = ? AND op IN (?, ?)", (entry.key, UPDATE_PAGE, APPEND_BLOCKS)
+        else:
+            target = entry.page_ref or entry.payload.get('page_id')
+            where = ("status = 'pending' AND op = ? AND id > ? AND "
+                     "(page_ref = ? OR json_extract(payload, '$.page_id') = ?)")
+            params = (entry.op, entry.id, target, target)
+        return await asyncio.to_thread(self._claim_sync, where, params)
+
+    async def resolve(self, key: str) -> tuple:
+        """Возвращает ``(status, page_id)`` записи с ключом ``key``."""
+        def lookup():
+            with self._lock:
+                return self._connect().execute("SELECT status, page_id FROM outbox WHERE key = ?", (key,)).fetchone()
+        return await asyncio.to_thread(lookup) or (None, None)
+
+    async def page_owner(self, page_id: str) -> str | None:
+        """Возвращает ключ записи, создавшей страницу ``page_id``, если она есть в журнале."""
+        def lookup():
+            with self._lock:
+                return self._connect().execute(
+                    "SELECT key FROM outbox WHERE page_id = ? AND op = ?", (page_id, CREATE_PAGE),
+                ).fetchone()
+        row = await asyncio.to_thread(lookup)
+        return row[0] if row else None
+
+    async def save_progress(self, entry: OutboxEntry, page_id: str, blocks: list) -> None:
+        """Запоминает созданную страницу и блоки, которые на нее еще не дописаны."""
+        payload = {**entry.payload, "blocks": blocks}
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE outbox SET page_id = ?, payload = ? WHERE id = ?",
+            (page_id, json.dumps(payload, ensure_ascii=False), entry.id),
+        )
+
+    async def complete(self, entries: list, page_id: str | None) -> None:
+        """Помечает записи выполненными и запоминает страницу, к которой они относятся."""
+        await asyncio.to_thread(
+            self._execute_many,
+            "UPDATE outbox SET status = 'done', page_id = ?, error = NULL WHERE id = ?",
+            [(page_id, entry.id) for entry in entries],
+        )
+
+    async def reschedule(self, entries: list, error: str | None, delay: float, count_attempt: bool = True,
+                         uncertain: bool = False) -> None:
+        """Возвращает записи в очередь с задержкой.
+
+        ``uncertain`` — попытка могла выполниться в Notion (таймаут, отмена);
+        отметка сохраняется до успешной записи.
+        """
+        await asyncio.to_thread(
+            self._execute_many,
+            "UPDATE outbox SET status = 'pending', run_after = ?, error = COALESCE(?, error), "
+            "attempts = attempts - ?, uncertain = MAX(uncertain, ?) WHERE id = ? AND status = 'running'",
+            [(time.time() + delay, error, 0 if count_attempt else 1, int(uncertain), entry.id) for entry in entries],
+        )
+
+    async def fail(self, entries: list, error: str) -> None:
+        """Помечает записи как отклоненные Notion."""
+        await asyncio.to_thread(
+            self._execute_many,
+            "UPDATE outbox SET status = 'failed', error = ? WHERE id = ? AND status = 'running'",
+            [(error, entry.id) for entry in entries],
+        )
+
+    async def requeue_running(self) -> int:
+        """Возвращает в очередь записи, прерванные остановкой бота."""
+        cursor = await asyncio.to_thread(self._execute, "UPDATE outbox SET status = 'pending' WHERE status = 'running'")
+        return cursor.rowcount
+
+    async def prune_done(self, older_than: float) -> int:
+        """Удаляет давно выполненные записи."""
+        # Записи, на страницы которых ссылаются невыполненные, остаются
+        cursor = await asyncio.to_thread(
+            self._execute,
+            "DELETE FROM outbox WHERE status = 'done' AND created_at < ? AND key NOT IN "
+            "(SELECT page_ref FROM outbox WHERE page_ref IS NOT NULL AND status IN ('pending', 'running'))",
+            (time.time() - older_than,),
+        )
+        return cursor.rowcount
+
+    async def stats(self) -> dict:
+        """Возвращает число ожидающих записей, возраст самой старой (с) и число отклоненных."""
+        return await asyncio.to_thread(self._stats_sync)
+
+    def close(self) -> None:
+        """Закрывает соединение с базой."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _title_text(properties: dict) -> tuple:
+    """Возвращает имя свойства-заголовка и его текст."""
+    for name, value in properties.items():
+        if "title" in value:
+            return name, "".join(part["text"]["content"] for part in value["title"])
+    return None, ""
+
+
+def _property_value(value: dict):
+    """Приводит значение свойства (из запроса или из ответа Notion) к сравнимому виду.
+
+    Возвращает ``None`` для типов, которые не сравниваются.
+    """
+    for kind in ("title", "rich_text"):
+        if kind in value:
+            return "".join(part.get("plain_text") or part.get("text", {}).get("content", "") for part in value[kind])
+    if "url" in value:
+        return value["url"] or None
+    if "select" in value:
+        return (value["select"] or {}).get("name")
+    if "multi_select" in value:
+        return frozenset(option["name"] for option in value["multi_select"])
+    for kind in ("number", "checkbox"):
+        if kind in value:
+            return value[kind]
+    return None
+
+
+def _same_properties(page: dict, properties: dict) -> bool:
+    """Проверяет, что у страницы те же значения свойств, что в записи."""
+    for name, value in properties.items():
+        expected = _property_value(value)
+        if expected is None:
+            continue
+        if _property_value(page['properties'].get(name, {})) != expected:
+            return False
+    return True
+
+
+async def find_created_page(entry: OutboxEntry, store: "OutboxStore") -> dict | None:
+    """Ищет страницу, созданную прошлой попыткой записи, ответ на которую не дошел.
+
+    Если задано ``NOTION_IDEMPOTENCY_PROPERTY``, страница ищется по ключу
+    записи. Иначе среди страниц, созданных после постановки записи в очередь,
+    ищется страница с теми же заголовком, URL и остальными свойствами записи,
+    которую не создала другая запись журнала.
+    """
+    payload = entry.payload
+    since = datetime.fromtimestamp(entry.created_at - 60, tz=timezone.utc).isoformat()
+    conditions = [{"timestamp": "created_time", "created_time": {"on_or_after": since}}]
+    if NOTION_IDEMPOTENCY_PROPERTY:
+        conditions.append({"property": NOTION_IDEMPOTENCY_PROPERTY, "rich_text": {"equals": entry.key}})
+    else:
+        title_prop, title = _title_text(payload['properties'])
+        if title_prop:
+            conditions.append({"property": title_prop, "title": {"equals": title[:RICH_TEXT_FILTER_LIMIT]}})
+        for name, value in payload['properties'].items():
+            if value.get("url"):
+                conditions.append({"property": name, "url": {"equals": value["url"]}})
+    response = await query_database(payload['database_id'], filter={"and": conditions}, page_size=10)
+    for page in response.get('results', []):
+        if not NOTION_IDEMPOTENCY_PROPERTY and not _same_properties(page, payload['properties']):
+            continue
+        if await store.page_owner(page['id']) not in (None, entry.key):
+            continue
+        return page
+    return None
+
+
+class NotionOutbox:
+    """Надежная очередь записей в Notion.
+
+    Каждое изменение сначала записывается в журнал, а затем сразу
+    выполняется. Если Notion недоступен, запись остается в журнале, и
+    фоновый разборщик повторяет ее с растущей задержкой; записи одной
+    страницы повторяются в порядке появления, записи разных страниц друг
+    друга не ждут. Пока Notion недоступен, новые записи сразу ставятся в
+    очередь, не дожидаясь таймаутов; только одна из них (проба) выполняется
+    сразу, и ее успех снимает этот режим. Запись, не выполненная за
+    ``max_attempts`` попыток, отклоняется, и пользователь получает сообщение.
+    При длинной очереди изменения одной страницы объединяются в один запрос.
+    """
+
+    def __init__(self, store: OutboxStore, retry_delay: float = OUTBOX_RETRY_DELAY,
+                 max_retry_delay: float = OUTBOX_MAX_RETRY_DELAY, coalesce_threshold: int = OUTBOX_COALESCE_THRESHOLD,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.store = store
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.coalesce_threshold = coalesce_threshold
+        self.max_attempts = max(1, max_attempts)
+        self._bot: Bot | None = None
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+        self._degraded = False
+        self._probing = False
+        self._failure_listeners: list = []
+
+    def add_failure_listener(self, listener) -> None:
+        """Регистрирует корутину ``listener(keys)``, вызываемую, когда записи окончательно отклонены."""
+        self._failure_listeners.append(listener)
+
+    async def start(self, bot: Bot) -> None:
+        """Запускает фоновый разборщик очереди."""
+        self._bot = bot
+        requeued = await self.store.requeue_running()
+        pruned = await self.store.prune_done(OUTBOX_KEEP_DONE)
+        stats = await self.store.stats()
+        logger.info(f"Очередь записей в Notion: {stats['pending']} ожидают (возвращено {requeued}, очищено {pruned}).")
+        self._task = asyncio.create_task(self._drain())
+
+    async def stop(self) -> None:
+        """Останавливает разборщик; невыполненные записи останутся до следующего запуска."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.store.close()
+
+    # === Постановка записей ===
+
+    async def create_page(self, key: str, database_id: str, properties: dict, blocks: list | None = None,
+                          notify: tuple | None = None) -> OutboxResult:
+        """Создает страницу с содержимым через журнал.
+
+        Args:
+            key: Ключ идемпотентности: повтор с тем же ключом вернет уже созданную страницу.
+            database_id: Идентификатор базы данных.
+            properties: Свойства страницы.
+            blocks: Блоки содержимого.
+            notify: ``(chat_id, message_id, текст)`` — что показать пользователю,
+                если запись выполнится позже из очереди.
+        """
+        if NOTION_IDEMPOTENCY_PROPERTY:
+            properties = {**properties, NOTION_IDEMPOTENCY_PROPERTY: {"rich_text": rich_text(key)}}
+        payload = {"database_id": database_id, "properties": properties, "blocks": blocks or []}
+        return await self._submit(key, CREATE_PAGE, payload, None, notify)
+
+    async def update_page(self, key: str, page: str, properties: dict, notify: tuple | None = None) -> OutboxResult:
+        """Обновляет свойства страницы ``page`` — ключа записи, создавшей страницу."""
+        return await self._submit(key, UPDATE_PAGE, {"properties": properties}, page, notify)
+
+    async def append_blocks(self, key: str, page: str, blocks: list, notify: tuple | None = None) -> OutboxResult:
+        """Дописывает блоки на страницу ``page`` — ключа записи, создавшей страницу."""
+        return await self._submit(key, APPEND_BLOCKS, {"blocks": blocks}, page, notify)
+
+    async def _submit(self, key: str, op: str, payload: dict, page_ref: str | None, notify: tuple | None) -> OutboxResult:
+        # Пока Notion недоступен, сразу выполняется только одна запись-проба,
+        # остальные не ждут таймаутов и уходят в очередь
+        probe = self._degraded and not self._probing
+        if probe:
+            self._probing = True
+        try:
+            status, page_id, entry = await self.store.add(
+                key, op, payload, page_ref, notify, claim=probe or not self._degraded,
+            )
+            if status == "done":
+                return OutboxResult("done", {"id": page_id})
+            if status == "failed":
+                return OutboxResult("failed")
+            if entry is None:
+                # Запись уже выполняется, стоит в очереди после прошлой попытки
+                # или ждет более ранних записей той же страницы
+                self._wakeup.set()
+                return OutboxResult("queued")
+            return await self._run([entry], inline=True)
+        finally:
+            if probe:
+                self._probing = False
+
+    # === Выполнение ===
+
+    async def _page_id(self, entry: OutboxEntry) -> str | None:
+        """Определяет страницу для изменения; ``None`` — создающая ее запись еще не выполнена.
+
+        Если создающая запись отклонена или отсутствует в журнале, зависимая
+        запись не может быть выполнена и отклоняется (``LookupError``).
+        """
+        if entry.payload.get('page_id'):
+            return entry.payload['page_id']
+        status, page_id = await self.store.resolve(entry.page_ref)
+        if status == "failed":
+            raise LookupError(f"страница {entry.page_ref} не была создана")
+        if status is None:
+            raise LookupError(f"запись {entry.page_ref}, создающая страницу, не найдена")
+        return page_id
+
+    async def _execute(self, entries: list) -> dict | None:
+        """Выполняет запись (и объединенные с ней) одним запросом к Notion."""
+        head = entries[0]
+        payload = head.payload
+        if head.op == CREATE_PAGE:
+            if head.page_id:
+                # Страница создана прошлой попыткой, осталось дописать содержимое
+                await self._append_remaining(head, head.page_id, payload['blocks'])
+                return {"id": head.page_id}
+            if head.uncertain:
+                existing = await find_created_page(head, self.store)
+                if existing:
+                    logger.info(f"Страница для записи {head.key} уже создана прошлой попыткой.")
+                    return existing
+            properties = dict(payload['properties'])
+            blocks = list(payload['blocks'])
+            for entry in entries[1:]:
+                properties.update(entry.payload.get('properties', {}))
+                blocks.extend(entry.payload.get('blocks', []))
+            first, overflow = split_children(blocks)
+            page_data = {"parent": {"database_id": payload['database_id']}, "properties": properties}
+            if first:
+                page_data["children"] = first
+            response = await notion_request("pages.create", **page_data)
+            if overflow:
+                # Запоминаем страницу, чтобы повтор после сбоя дописал остаток, а не создал ее заново
+                remaining = [block for batch in overflow for block in batch]
+                await self.store.save_progress(head, response['id'], remaining)
+                await self.store.complete(entries[1:], response['id'])
+                await self._append_remaining(head, response['id'], remaining)
+            return response
+
+        page_id = await self._page_id(head)
+        if page_id is None:
+            return None
+        if head.op == UPDATE_PAGE:
+            properties = {}
+            for entry in entries:
+                properties.update(entry.payload['properties'])
+            await notion_request("pages.update", page_id=page_id, properties=properties)
+        else:
+            blocks = [block for entry in entries for block in entry.payload['blocks']]
+            first, overflow = split_children(blocks)
+            if first:
+                await append_blocks(page_id, [first, *overflow])
+        return {"id": page_id}
+
+    async def _append_remaining(self, head: OutboxEntry, page_id: str, blocks: list) -> None:
+        """Дописывает блоки на созданную страницу, запоминая после каждой пачки, что осталось."""
+        first, overflow = split_children(blocks)
+        batches = [first, *overflow] if first else []
+        for index, batch in enumerate(batches):
+            await append_blocks(page_id, [batch])
+            await self.store.save_progress(head, page_id, [block for rest in batches[index + 1:] for block in rest])
+
+    async def _run(self, entries: list, inline: bool = False) -> OutboxResult:
+        head = entries[0]
+        try:
+            response = await self._execute(entries)
+        except asyncio.CancelledError:
+            # Запрос мог уже уйти в Notion: попытка засчитывается, а следующая
+            # сначала поищет созданную страницу (find_created_page)
+            await self.store.reschedule(entries, None, 0, uncertain=True)
+            raise
+        except (*NOTION_ERRORS, LookupError, RuntimeError) as e:
+            error = str(e)
+            if isinstance(e, NOTION_ERRORS) and is_transient_error(e):
+                self._degraded = True
+                if head.attempts < self.max_attempts:
+                    delay = min(self.retry_delay * 2 ** (head.attempts - 1), self.max_retry_delay)
+                    logger.warning(f"Notion недоступен ({e}); запись {head.key} повторится через {delay:.0f} с.")
+                    inc("outbox_deferred_total")
+                    await self.store.reschedule(entries, error, delay, uncertain=is_ambiguous_error(e))
+                    self._wakeup.set()
+                    return OutboxResult("queued")
+                error = f"Notion не ответил за {head.attempts} попыток: {e}"
+            logger.error(f"Notion отклонил запись {head.key}: {error}")
+            await self.store.fail(entries, error)
+            for listener in self._failure_listeners:
+                try:
+                    await listener([entry.key for entry in entries])
+                except Exception as listener_error:
+                    logger.error(f"Ошибка обработчика отклоненной записи {head.key}: {listener_error}")
+            if not inline:
+                for entry in entries:
+                    await self._notify(entry, failed=True)
+            return OutboxResult("failed")
+
+        if response is None:
+            # Страница, которую нужно изменить, еще создается
+            await self.store.reschedule(entries, None, 1.0, count_attempt=False)
+            self._wakeup.set()
+            return OutboxResult("queued")
+
+        self._degraded = False
+        inc("outbox_written_total", len(entries), path="inline" if inline else "replay")
+        await self.store.complete(entries, response.get('id'))
+        # Записи той же страницы, ждавшие эту, можно выполнять
+        self._wakeup.set()
+        if not inline:
+            for entry in entries:
+                await self._notify(entry)
+        return OutboxResult("done", response)
+
+    async def _notify(self, entry: OutboxEntry, failed: bool = False) -> None:
+        if not (self._bot and entry.chat_id and entry.notify_text):
+            return
+        text = entry.notify_text
+        if failed:
+            _, title = _title_text(entry.payload.get('properties', {}))
+            text = f"❌ Не удалось сохранить в Notion{f' «{title}»' if title else ''}. Проверьте логи."
+        try:
+            if entry.message_id:
+                await self._bot.edit_message_text(chat_id=entry.chat_id, message_id=entry.message_id, text=text)
+            else:
+                await self._bot.send_message(chat_id=entry.chat_id, text=text)
+        except TelegramError as e:
+            logger.warning(f"Не удалось сообщить о записи {entry.key}: {e}")
+
+    async def _drain(self) -> None:
+        """Повторяет записи очереди; записи одной страницы — в порядке их появления."""
+        while True:
+            self._wakeup.clear()
+            try:
+                entry, wait = await self.store.claim_next()
+                if entry is None:
+                    timeout = 5.0 if wait is None else min(max(wait, 0.1), 30.0)
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                entries = [entry]
+                if (await self.store.stats())['pending'] >= self.coalesce_threshold:
+                    entries += await self.store.claim_related(entry)
+                    if len(entries) > 1:
+                        logger.info(f"Объединено записей для одной страницы: {len(entries)}")
+                await self._run(entries)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка разбора очереди записей в Notion: {e}")
+                await asyncio.sleep(self.retry_delay)
+
+    async def stats(self) -> dict:
+        """Возвращает состояние очереди для команды /status."""
+        return {**await self.store.stats(), "degraded": self._degraded}
+
+
+# Общая очередь записей процесса; разборщик запускается вместе с ботом.
+outbox = NotionOutbox(OutboxStore())
@@ -0,0 +1,59 @@
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+from config import settings
+
+if TYPE_CHECKING:
+    import openai
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+_client: "openai.AsyncOpenAI | None" = None
+
+
+def get_openai_client() -> "openai.AsyncOpenAI | None":
+    """Возвращает общий асинхронный клиент OpenAI или ``None``, если ключ не задан.
+
+    Пакет ``openai`` импортируется при первом вызове: его импорт занимает
+    большую часть времени запуска бота.
+    """
+    global _client
+    if _client is not None:
+        return _client
+
+    if not settings.openai_api_key:
+        logger.warning("OPENAI_API_KEY не найден. Транскрипция и анализ ссылок не будут работать.")
+        return None
+    import openai
+
+    _client = openai.AsyncOpenAI(api_key=settings.openai_api_key)
+    return _client
+
+
+async def warm_up_openai_client() -> None:
+    """Создает клиент, открывает соединение с API и проверяет ключ одним запросом."""
+    client = await asyncio.to_thread(get_openai_client)
+    if client is None:
+        return
+    import openai
+
+    try:
+        await client.with_options(max_retries=0).models.list()
+        logger.info("Соединение с OpenAI установлено, ключ принят.")
+    except openai.AuthenticationError:
+        logger.error("OpenAI отклонил OPENAI_API_KEY.")
+    except openai.APIError as e:
+        logger.warning(f"Не удалось прогреть соединение с OpenAI: {e}")
+
+
+async def close_openai_client() -> None:
+    """Закрывает общий клиент OpenAI и его пул соединений."""
+    global _client
+    if _client is not None:
+        await _client.close()
+    _client = None
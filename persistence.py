@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+
+from telegram import Update
+from telegram.ext import BasePersistence, ContextTypes, ConversationHandler, PersistenceInput
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+PERSISTENCE_PATH = os.getenv("PERSISTENCE_PATH", "state.sqlite3")
+# Как часто PTB отдает изменения в хранилище и с какой задержкой они пишутся одной транзакцией.
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "5"))
+PERSISTENCE_WRITE_DELAY = float(os.getenv("PERSISTENCE_WRITE_DELAY", "0.5"))
+# 1 — несколько экземпляров бота: состояние перечитывается перед каждым обновлением
+# и записывается сразу после него.
+PERSISTENCE_SHARED = os.getenv("PERSISTENCE_SHARED", "0") == "1"
+
+USER_DATA = "user_data"
+CONVERSATION_PREFIX = "conversation:"
+
+
+class StateStore(ABC):
+    """Хранилище состояния диалогов: пространство имен -> ключ -> JSON-строка.
+
+    Методы синхронные и вызываются из пула потоков. Сетевое хранилище
+    (Redis, Postgres и т.п.) для нескольких экземпляров бота реализует тот
+    же интерфейс.
+    """
+
+    @abstractmethod
+    def load_all(self, namespace: str) -> dict:
+        """Возвращает все записи пространства имен."""
+
+    @abstractmethod
+    def load(self, namespace: str, key: str) -> str | None:
+        """Возвращает одну запись или ``None``."""
+
+    @abstractmethod
+    def write_batch(self, items: list) -> None:
+        """Атомарно записывает пачку ``(namespace, key, value)``; ``value=None`` удаляет запись."""
+
+    def close(self) -> None:
+        """Освобождает ресурсы хранилища."""
+
+
+class SQLiteStateStore(StateStore):
+    """Локальное хранилище состояния в SQLite."""
+
+    def __init__(self, path: str = PERSISTENCE_PATH):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS state (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+        return self._conn
+
+    def load_all(self, namespace: str) -> dict:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT key, value FROM state WHERE namespace = ?", (namespace,)
+            ).fetchall()
+        return dict(rows)
+
+    def load(self, namespace: str, key: str) -> str | None:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def write_batch(self, items: list) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "DELETE FROM state WHERE namespace = ? AND key = ?",
+                    [(namespace, key) for namespace, key, value in items if value is None],
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO state (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                    [(namespace, key, value, now) for namespace, key, value in items if value is not None],
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _dump(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def conversation_key(key: tuple) -> str:
+    """Сериализует ключ диалога ``(chat_id, user_id, ...)`` в строку."""
+    return ":".join(str(part) for part in key)
+
+
+class StorePersistence(BasePersistence):
+    """Персистентность PTB поверх ``StateStore`` с отложенной пакетной записью.
+
+    Сохраняются только ``user_data`` и состояния ``ConversationHandler``.
+    Изменения копятся в памяти и пишутся одной транзакцией не чаще раза в
+    ``write_delay`` секунд, поэтому переходы диалога не ждут диска. При
+    ``shared=True`` данные пользователя перечитываются перед каждым
+    обновлением, а изменения пишутся сразу после него (``write_now``), чтобы
+    несколько экземпляров бота видели общее состояние.
+    """
+
+    def __init__(self, store: StateStore, update_interval: float = PERSISTENCE_UPDATE_INTERVAL,
+                 write_delay: float = PERSISTENCE_WRITE_DELAY, shared: bool = PERSISTENCE_SHARED):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.store = store
+        self.write_delay = write_delay
+        self.shared = shared
+        self._pending: dict = {}
+        self._flush_task: asyncio.Task | None = None
+
+    # === Запись ===
+
+    def _schedule(self, namespace: str, key: str, value: str | None) -> None:
+        self._pending[(namespace, key)] = value
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.write_delay)
+        await self._write_pending()
+
+    async def _write_pending(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        items = [(namespace, key, value) for (namespace, key), value in batch.items()]
+        try:
+            await asyncio.to_thread(self.store.write_batch, items)
+        except Exception as e:
+            logger.error(f"Ошибка записи состояния ({len(items)} записей): {e}")
+            # Возвращаем в буфер, не затирая более свежие изменения
+            for key, value in batch.items():
+                self._pending.setdefault(key, value)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._schedule(USER_DATA, str(user_id), _dump(data))
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._schedule(USER_DATA, str(user_id), None)
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object | None) -> None:
+        self._schedule(CONVERSATION_PREFIX + name, conversation_key(key), None if new_state is None else _dump(new_state))
+
+    async def write_now(self) -> None:
+        """Сразу пишет накопленные изменения, не дожидаясь ``write_delay``."""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self._write_pending()
+
+    async def flush(self) -> None:
+        await self.write_now()
+        self.store.close()
+
+    # === Чтение ===
+
+    async def get_user_data(self) -> dict:
+        rows = await asyncio.to_thread(self.store.load_all, USER_DATA)
+        return {int(key): json.loads(value) for key, value in rows.items()}
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = await asyncio.to_thread(self.store.load_all, CONVERSATION_PREFIX + name)
+        return {tuple(int(part) for part in key.split(":")): json.loads(value) for key, value in rows.items()}
+
+    async def load_conversation_state(self, name: str, key: tuple) -> object | None:
+        """Читает актуальное состояние одного диалога из хранилища."""
+        pending = self._pending.get((CONVERSATION_PREFIX + name, conversation_key(key)), ...)
+        if pending is not ...:
+            return None if pending is None else json.loads(pending)
+        value = await asyncio.to_thread(self.store.load, CONVERSATION_PREFIX + name, conversation_key(key))
+        return None if value is None else json.loads(value)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if not self.shared or (USER_DATA, str(user_id)) in self._pending:
+            return
+        value = await asyncio.to_thread(self.store.load, USER_DATA, str(user_id))
+        if value is not None:
+            user_data.clear()
+            user_data.update(json.loads(value))
+
+    # === Не используются ===
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+
+class SharedConversationHandler(ConversationHandler):
+    """``ConversationHandler``, берущий состояние диалога из общего хранилища.
+
+    PTB читает состояния диалогов из персистентности только при запуске, и при
+    нескольких экземплярах бота состояние в памяти отстает от хранилища.
+    ``load_state`` (обработчик группы -1) асинхронно читает актуальное
+    состояние чата, а ``check_update`` применяет его до выбора шага диалога
+    через закрытый метод PTB ``_update_state``.
+    """
+
+    def __init__(self, *args, persistence: StorePersistence, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.persistence = persistence
+        self._loaded: dict = {}
+
+    @staticmethod
+    def _key(update: object) -> tuple | None:
+        if isinstance(update, Update) and update.effective_chat and update.effective_user:
+            return update.effective_chat.id, update.effective_user.id
+        return None
+
+    async def load_state(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Читает состояние диалога для обновления из хранилища."""
+        key = self._key(update)
+        if key is not None:
+            self._loaded[key] = await self.persistence.load_conversation_state(self.name, key)
+
+    def check_update(self, update: object):
+        key = self._key(update)
+        if key in self._loaded:
+            state = self._loaded.pop(key)
+            # Публичного способа задать состояние диалога в PTB нет, поэтому
+            # используется закрытый ConversationHandler._update_state (PTB 22);
+            # при обновлении PTB его сигнатуру нужно проверить
+            self._update_state(self.END if state is None else state, key)
+        return super().check_update(update)
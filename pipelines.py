@@ -0,0 +1,316 @@
+import os
+import re
+import time
+import asyncio
+import logging
+
+from telegram import Bot, Message, MessageEntity
+from telegram.error import TelegramError
+
+from background_jobs import Job, update_status
+from config import settings
+from notion_blocks import RICH_TEXT_LIMIT, paragraph_blocks, split_text
+from notion_handler import link_page_properties, page_properties
+from link_index import link_index
+from notion_outbox import outbox
+from transcriber import transcribe_voice
+from url_cache import normalize_url
+from url_processor import process_url
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Сколько последних символов частичной расшифровки показывать в статусе.
+PROGRESS_PREVIEW_CHARS = 300
+
+# Сколько ссылок из одного сообщения обрабатываются одновременно.
+LINK_BATCH_CONCURRENCY = int(os.getenv("LINK_BATCH_CONCURRENCY", "5"))
+LINK_BATCH_MAX_URLS = int(os.getenv("LINK_BATCH_MAX_URLS", "50"))
+# Не чаще, чем раз в столько секунд, обновляем сводное сообщение о ходе пакета.
+STATUS_UPDATE_INTERVAL = 2.0
+# Длина заголовка для идей, не помещающихся в один сегмент rich_text.
+IDEA_TITLE_CHARS = 200
+# Не чаще, чем раз в столько секунд, показываем в статусе потоковый ответ OpenAI.
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+# Ответ пользователю, если Notion недоступен и запись осталась в журнале.
+QUEUED_TEXT = "Notion сейчас недоступен. {what} локально и будет отправлена автоматически. ⏳"
+# Лимит длины сообщения Telegram.
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+URL_PATTERN = re.compile(r"https?://[^\s<>\"'«»]+")
+
+
+def _trim_url(url: str) -> str:
+    """Убирает знаки препинания, прилипшие к концу ссылки в тексте.
+
+    Закрывающая скобка убирается, только если в ссылке ей нет пары:
+    ``…/Foo_(bar)`` остается целым, а ``(см. https://a.b/c)`` теряет скобку.
+    """
+    while url:
+        if url[-1] in ".,;:!?":
+            url = url[:-1]
+        elif url[-1] == ")" and url.count(")") > url.count("("):
+            url = url[:-1]
+        else:
+            break
+    return url
+
+
+def extract_urls(message: Message) -> list:
+    """Возвращает уникальные ссылки из текста, подписи и entities сообщения.
+
+    Учитываются обычные ссылки и ссылки под текстом (``text_link``). Текст
+    сообщения просматривается регулярным выражением, только если Telegram не
+    разметил в нем ни одной ссылки (например, в пересланном тексте). Дубликаты определяются по нормализованному URL,
+    порядок появления сохраняется. Ограничение ``LINK_BATCH_MAX_URLS``
+    применяет вызывающий, чтобы сообщить пользователю о пропущенных ссылках.
+    """
+    candidates = []
+    for entity, text in {**message.parse_entities(), **message.parse_caption_entities()}.items():
+        if entity.type == MessageEntity.TEXT_LINK and entity.url:
+            candidates.append(entity.url)
+        elif entity.type == MessageEntity.URL:
+            candidates.append(text if "://" in text else f"http://{text}")
+    if not candidates:
+        for text in (message.text, message.caption):
+            if text:
+                candidates.extend(_trim_url(match) for match in URL_PATTERN.findall(text))
+
+    urls = {}
+    for url in candidates:
+        urls.setdefault(normalize_url(url), url)
+    return list(urls.values())
+
+
+def make_transcription_progress(bot: Bot, chat_id: int, message_id: int):
+    """Возвращает колбэк, показывающий ход расшифровки в статусном сообщении."""
+    async def report_progress(done: int, total: int, partial_text: str) -> None:
+        preview = partial_text[-PROGRESS_PREVIEW_CHARS:]
+        text = f"Расшифровываю... {done}/{total} 🎙️"
+        if preview:
+            text += f"\n\n…{preview}"
+        try:
+            await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
+        except TelegramError as e:
+            logger.warning(f"Не удалось обновить статус расшифровки: {e}")
+
+    return report_progress
+
+
+def split_idea(text: str) -> tuple:
+    """Возвращает заголовок и тело страницы для идеи.
+
+    Короткая идея целиком идет в заголовок, как и раньше. У длинной
+    (например, расшифровки долгого голосового) заголовком становится начало
+    первой строки, а полный текст записывается в тело страницы.
+    """
+    if len(text) <= RICH_TEXT_LIMIT:
+        return text, None
+    first_line = text.strip().split("\n", 1)[0]
+    return split_text(first_line, IDEA_TITLE_CHARS)[0].rstrip() + "…", text
+
+
+async def run_idea_job(bot: Bot, job: Job) -> None:
+    """Сохраняет идею: при необходимости расшифровывает голосовое и пишет страницу в Notion."""
+    text = job.payload.get('text')
+    voice = job.payload.get('voice')
+
+    if voice:
+        await update_status(bot, job, "Получил голосовое, расшифровываю... 🎙️")
+        text = await transcribe_voice(
+            voice['file_id'], bot, voice.get('mime_type'), voice.get('duration'),
+            make_transcription_progress(bot, job.chat_id, job.message_id),
+        )
+        if not text or text.startswith("Ошибка:"):
+            await update_status(bot, job, text or "Не удалось расшифровать.")
+            return
+        # Повторная попытка не должна заново расшифровывать голосовое
+        job.payload = {'text': text}
+
+    db_id = settings.idea_database_id
+    title_prop = settings.idea_title_property
+
+    title, content = split_idea(text)
+    # Запись сначала попадает в журнал: при недоступности Notion идея не потеряется
+    result = await outbox.create_page(
+        f"idea:{job.id}", db_id, page_properties(title_prop, title), paragraph_blocks(content),
+        notify=(job.chat_id, job.message_id, "Идея сохранена в Notion (после восстановления связи)."),
+    )
+    await update_status(bot, job, {
+        "done": "Идея успешно сохранена в Notion!",
+        "queued": QUEUED_TEXT.format(what="Идея сохранена"),
+        "failed": "Не удалось сохранить идею в Notion. Проверьте логи.",
+    }[result.status])
+
+
+def make_analysis_progress(bot: Bot, job: Job):
+    """Возвращает колбэк, показывающий потоковый анализ ссылки в статусе.
+
+    Сообщение редактируется не чаще раза в ``STREAM_EDIT_INTERVAL`` секунд и
+    только если текст изменился, чтобы не упираться в лимиты Telegram.
+    """
+    last_edit = 0.0
+    last_text = None
+
+    async def report_progress(fields: dict) -> None:
+        nonlocal last_edit, last_text
+        if not fields.get('title') or time.monotonic() - last_edit < STREAM_EDIT_INTERVAL:
+            return
+        text = f"Анализирую ссылку... 🧠\n\n{fields['title']}"
+        if fields.get('summary'):
+            text += f"\n\n{fields['summary']}…"
+        text = text[:TELEGRAM_MESSAGE_LIMIT]
+        if text == last_text:
+            return
+        last_edit, last_text = time.monotonic(), text
+        await update_status(bot, job, text)
+
+    return report_progress
+
+
+async def run_link_job(bot: Bot, job: Job) -> None:
+    """Анализирует ссылку и сохраняет ее в Notion.
+
+    Ответ OpenAI показывается по мере генерации, а страница создается, как
+    только готовы заголовок и теги; саммари дописывается на нее в конце.
+    """
+    url = job.payload['url']
+    await update_status(bot, job, "Анализирую ссылку... 🧠")
+
+    db_id = settings.link_database_id
+    title_prop = settings.link_title_property
+    url_prop = settings.link_url_property
+    tags_prop = settings.link_tags_property
+
+    page_key = f"link:{job.id}"
+    early_page: asyncio.Task | None = None
+
+    async def save_early(fields: dict) -> None:
+        nonlocal early_page
+        early_page = asyncio.create_task(outbox.create_page(
+            page_key, db_id,
+            link_page_properties(title_prop, url_prop, tags_prop, {'title': fields['title'], 'tags': fields['tags'], 'url': url}),
+        ))
+
+    processed_data = await process_url(url, on_progress=make_analysis_progress(bot, job), on_ready=save_early)
+    page = await early_page if early_page else None
+
+    if not processed_data:
+        await update_status(bot, job, "Не удалось обработать ссылку.")
+        return
+
+    title = processed_data.get('title')
+    notify = (job.chat_id, job.message_id, f"Ссылка сохранена в Notion (после восстановления связи): {title}")
+    blocks = paragraph_blocks(processed_data.get('summary'))
+    if page is not None and page.saved:
+        # Страница уже создана (или ждет в журнале) — дописываем саммари
+        result = await outbox.append_blocks(f"{page_key}:summary", page_key, blocks, notify=notify)
+    else:
+        result = await outbox.create_page(
+            page_key, db_id, link_page_properties(title_prop, url_prop, tags_prop, processed_data), blocks, notify=notify,
+        )
+    if result.saved:
+        await link_index.add(url, (result.response or {}).get('id'), title, outbox_key=page_key)
+    await update_status(bot, job, {
+        "done": f"Ссылка успешно сохранена в Notion!\n\n**Заголовок:** {title}",
+        "queued": QUEUED_TEXT.format(what="Ссылка сохранена"),
+        "failed": "Не удалось сохранить ссылку в Notion. Проверьте логи.",
+    }[result.status])
+
+
+def _format_batch_report(results: list) -> str:
+    """Собирает итоговое сообщение по пакету ссылок, укладываясь в лимит Telegram.
+
+    ``results`` — кортежи ``(url, статус, заголовок или причина ошибки)``.
+    """
+    saved = sum(1 for _, status, _ in results if status == "done")
+    queued = sum(1 for _, status, _ in results if status == "queued")
+    failed = len(results) - saved - queued
+    lines = [f"Сохранено ссылок: {saved} из {len(results)}"]
+    if queued:
+        lines.append(f"Ждут отправки в Notion: {queued} ⏳")
+    if failed:
+        lines.append(f"Не удалось: {failed}")
+    marks = {"done": "✅", "queued": "⏳"}
+    for url, status, detail in results:
+        if status in marks:
+            lines.append(f"{marks[status]} {detail or url}")
+        else:
+            lines.append(f"❌ {url} — {detail}")
+    text = "\n".join(lines)
+    if len(text) > TELEGRAM_MESSAGE_LIMIT:
+        text = text[:TELEGRAM_MESSAGE_LIMIT - 1] + "…"
+    return text
+
+
+async def run_link_batch_job(bot: Bot, job: Job) -> None:
+    """Параллельно анализирует пакет ссылок и сохраняет их в Notion.
+
+    Ход обработки показывается в одном сводном сообщении. Ссылки, которые не
+    удалось записать в Notion из-за его недоступности, остаются в журнале
+    записей и будут отправлены позже.
+    """
+    urls = job.payload['urls']
+    done = 0
+    last_update = 0.0
+    semaphore = asyncio.Semaphore(LINK_BATCH_CONCURRENCY)
+
+    async def process(url: str) -> dict | None:
+        nonlocal done, last_update
+        try:
+            async with semaphore:
+                data = await process_url(url)
+        finally:
+            done += 1
+        if time.monotonic() - last_update >= STATUS_UPDATE_INTERVAL or done == len(urls):
+            last_update = time.monotonic()
+            await update_status(bot, job, f"Анализирую ссылки... {done}/{len(urls)} 🧠")
+        return data
+
+    await update_status(bot, job, f"Анализирую ссылки... 0/{len(urls)} 🧠")
+    # Ошибка одной ссылки не должна проваливать весь пакет: иначе повтор задачи
+    # заново обработал бы и уже сохраненные ссылки
+    processed = await asyncio.gather(*(process(url) for url in urls), return_exceptions=True)
+    for url, data in zip(urls, processed):
+        if isinstance(data, Exception):
+            logger.error(f"Ошибка обработки ссылки {url} в пакете: {data}")
+
+    db_id = settings.link_database_id
+    title_prop = settings.link_title_property
+    url_prop = settings.link_url_property
+    tags_prop = settings.link_tags_property
+
+    async def save(url: str, data: dict | Exception | None) -> tuple:
+        if isinstance(data, Exception):
+            return url, "failed", "ошибка обработки"
+        if not data:
+            return url, "failed", "не удалось загрузить или проанализировать"
+        key = f"link_batch:{job.id}:{normalize_url(url)}"
+        result = await outbox.create_page(
+            key, db_id, link_page_properties(title_prop, url_prop, tags_prop, data), paragraph_blocks(data.get('summary')),
+        )
+        if result.saved:
+            await link_index.add(url, (result.response or {}).get('id'), data.get('title'), outbox_key=key)
+        return url, result.status, data.get('title') if result.saved else "Notion отклонил запись"
+
+    saved_count = sum(1 for data in processed if data and not isinstance(data, Exception))
+    await update_status(bot, job, f"Сохраняю в Notion {saved_count} ссылок... 💾")
+    # Частоту запросов регулирует общий ограничитель, поэтому пакет пишется параллельно
+    saved = await asyncio.gather(*(save(url, data) for url, data in zip(urls, processed)), return_exceptions=True)
+    results = []
+    for url, result in zip(urls, saved):
+        if isinstance(result, Exception):
+            logger.error(f"Ошибка сохранения ссылки {url} в пакете: {result}")
+            result = (url, "failed", "ошибка сохранения")
+        results.append(result)
+    await update_status(bot, job, _format_batch_report(results))
+
+
+JOB_HANDLERS = {
+    "idea": run_idea_job,
+    "link": run_link_job,
+    "link_batch": run_link_batch_job,
+}
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, TypeVar
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """Асинхронный token bucket с очередью ожидания в порядке поступления.
+
+    Запросы получают токены строго по очереди (``asyncio.Lock`` справедлив),
+    поэтому при всплеске нагрузки они выстраиваются в очередь, а не
+    соревнуются за токены. ``pause()`` останавливает выдачу токенов для всех,
+    например по заголовку ``Retry-After``.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+        # Метрики
+        self._waiting = 0
+        self.acquired_total = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.pauses_total = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество запросов, ожидающих токен."""
+        return self._waiting
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Приостанавливает выдачу токенов на ``seconds`` секунд."""
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            self.pauses_total += 1
+            # После паузы начинаем с пустого ведра, чтобы не выдать всплеск.
+            self._tokens = 0
+
+    async def acquire(self) -> float:
+        """Ожидает свободный токен и возвращает время ожидания в секундах."""
+        started = time.monotonic()
+        self._waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    if now < self._paused_until:
+                        await asyncio.sleep(self._paused_until - now)
+                        continue
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+                    await asyncio.sleep((1 - self._tokens) / self.rate)
+        finally:
+            self._waiting -= 1
+
+        waited = time.monotonic() - started
+        self.acquired_total += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+        return waited
+
+    def stats(self) -> dict:
+        """Возвращает снимок метрик ограничителя."""
+        return {
+            "queue_depth": self.queue_depth,
+            "acquired_total": self.acquired_total,
+            "wait_time_total": round(self.wait_time_total, 3),
+            "wait_time_avg": round(self.wait_time_total / self.acquired_total, 3) if self.acquired_total else 0.0,
+            "wait_time_max": round(self.wait_time_max, 3),
+            "pauses_total": self.pauses_total,
+        }
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """Экспоненциальная задержка с полным джиттером для попытки ``attempt`` (с нуля)."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+async def call_with_retry(
+    func: Callable[[], Awaitable[T]],
+    *,
+    limiter: TokenBucket,
+    classify: Callable[[Exception], float | None],
+    max_retries: int = 5,
+    base_delay: float = 0.5,
+    max_delay: float = 30.0,
+    on_retry: Callable[[Exception, int, float], None] | None = None,
+) -> T:
+    """Вызывает ``func`` через ограничитель, повторяя временные ошибки.
+
+    Args:
+        func: Фабрика корутины, выполняющей один запрос.
+        limiter: Общий ограничитель частоты запросов.
+        classify: Возвращает ``None``, если ошибку нельзя повторять; ``0`` для
+            повтора с обычной задержкой; положительное число — явная пауза
+            (например, ``Retry-After``), которая применяется ко всему ограничителю.
+        max_retries: Максимальное число повторов.
+        base_delay: Базовая задержка экспоненциального отката.
+        max_delay: Верхняя граница задержки.
+        on_retry: Необязательный колбэк ``(ошибка, номер попытки, задержка)``.
+
+    Returns:
+        Результат ``func``.
+    """
+    attempt = 0
+    while True:
+        await limiter.acquire()
+        try:
+            return await func()
+        except Exception as e:
+            retry_after = classify(e)
+            if retry_after is None or attempt >= max_retries:
+                raise
+            if retry_after > 0:
+                limiter.pause(retry_after)
+                delay = retry_after + random.uniform(0, base_delay)
+            else:
+                delay = backoff_delay(attempt, base_delay, max_delay)
+            if on_retry:
+                on_retry(e, attempt + 1, delay)
+            attempt += 1
+            await asyncio.sleep(delay)
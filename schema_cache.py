@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Iterable
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+class SchemaCache:
+    """Кэш схем баз данных Notion в памяти с TTL и фоновым обновлением.
+
+    Запись считается свежей в течение ``ttl`` секунд. После ``refresh_ahead``
+    доли TTL первое обращение запускает обновление в фоне и сразу отдает
+    текущее значение. Если загрузка не удалась, отдается устаревшая запись
+    (stale-while-revalidate), пока она не старше ``max_stale`` секунд.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], Awaitable[Any]],
+        ttl: float = 300.0,
+        refresh_ahead: float = 0.8,
+        max_stale: float = 86400.0,
+    ):
+        self._loader = loader
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.max_stale = max_stale
+        self._entries: dict[str, tuple[Any, float]] = {}
+        self._inflight: dict[str, asyncio.Task] = {}
+
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+        self.stale_served = 0
+        self.refreshes = 0
+
+    async def _load(self, key: str) -> Any:
+        try:
+            value = await self._loader(key)
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке схемы {key}: {e}")
+            value = None
+        if value is not None:
+            self._entries[key] = (value, time.monotonic())
+        return value
+
+    def _load_once(self, key: str) -> asyncio.Task:
+        """Запускает загрузку ключа, объединяя параллельные запросы."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    async def get(self, key: str) -> Any:
+        """Возвращает схему по ключу, загружая или обновляя ее при необходимости."""
+        entry = self._entries.get(key)
+        now = time.monotonic()
+
+        if entry is not None:
+            value, loaded_at = entry
+            age = now - loaded_at
+            if age < self.ttl:
+                self.hits += 1
+                if age >= self.ttl * self.refresh_ahead and key not in self._inflight:
+                    self.refreshes += 1
+                    self._load_once(key)
+                return value
+
+        self.misses += 1
+        value = await asyncio.shield(self._load_once(key))
+        if value is None and entry is not None and now - entry[1] < self.max_stale:
+            logger.warning(f"Notion недоступен, использую устаревшую схему {key}.")
+            self.stale_served += 1
+            return entry[0]
+        return value
+
+    async def warm_up(self, keys: Iterable[str]) -> None:
+        """Параллельно загружает схемы для указанных ключей."""
+        keys = [key for key in keys if key]
+        if keys:
+            await asyncio.gather(*(self._load_once(key) for key in keys))
+            logger.info(f"Кэш схем прогрет: {len(self._entries)} из {len(keys)}.")
+
+    def invalidate(self, key: str) -> None:
+        """Удаляет запись из кэша."""
+        self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        """Возвращает метрики кэша."""
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_served": self.stale_served,
+            "refreshes": self.refreshes,
+        }
@@ -0,0 +1,111 @@
+import re
+import logging
+from functools import lru_cache
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Токены считает tiktoken (зависимость из requirements.txt). Если он недоступен
+# (не установлен или не смог загрузить словарь), число токенов оценивается по
+# длине: ~3 символа на токен (для английского текста ближе к 4, для русского — к 2.5).
+CHARS_PER_TOKEN = 3
+SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken не установлен, число токенов оценивается по длине текста.")
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # Словарь токенизатора скачивается при первом использовании и может быть недоступен
+        logger.warning(f"Не удалось загрузить токенизатор для {model} ({e}), число токенов оценивается по длине текста.")
+        return None
+
+
+def count_tokens(text: str, model: str) -> int:
+    """Считает токены текста локальным токенизатором модели (или оценивает)."""
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def warm_up_tokenizer(model: str) -> None:
+    """Загружает словарь токенизатора заранее, чтобы первая ссылка не ждала его."""
+    encoding = _get_encoding(model)
+    logger.info(f"Токенизатор для {model}: {encoding.name if encoding else 'оценка по длине текста'}")
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str) -> str:
+    """Обрезает текст до ``max_tokens`` токенов."""
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def dedupe_text(text: str) -> str:
+    """Убирает повторяющиеся строки и абзацы, оставляя первое вхождение.
+
+    Меню, подписи, кнопки «Поделиться» и повторы заголовков на страницах
+    часто дублируются; сравнение идет без учета регистра и пробелов.
+    """
+    seen = set()
+    lines = []
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        key = line.casefold()
+        if not line or key in seen:
+            continue
+        seen.add(key)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _split_long_line(line: str, max_tokens: int, model: str) -> list:
+    """Делит строку длиннее бюджета по предложениям, а при необходимости — по токенам."""
+    parts = []
+    for sentence in SENTENCE_END.split(line):
+        while count_tokens(sentence, model) > max_tokens:
+            head = truncate_to_tokens(sentence, max_tokens, model)
+            parts.append(head)
+            sentence = sentence[len(head):]
+        if sentence:
+            parts.append(sentence)
+    return parts
+
+
+def split_chunks(text: str, max_tokens: int, model: str) -> list:
+    """Делит текст на последовательные куски не длиннее ``max_tokens`` токенов.
+
+    Границы кусков проходят по строкам (абзацам), а слишком длинные абзацы
+    делятся по предложениям.
+    """
+    chunks = []
+    current: list = []
+    current_tokens = 0
+    for line in text.splitlines():
+        line_tokens = count_tokens(line, model)
+        pieces = [line] if line_tokens <= max_tokens else _split_long_line(line, max_tokens, model)
+        for piece in pieces:
+            piece_tokens = line_tokens if len(pieces) == 1 else count_tokens(piece, model)
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
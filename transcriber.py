@@ -1,9 +1,15 @@
+import io
 import os
+import time
+import asyncio
 import logging
-import openai
-from pydub import AudioSegment
-import tempfile
-from telegram.ext import ContextTypes
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable
+from telegram import Bot
+
+from fair_scheduler import ffmpeg_limiter, whisper_limiter
+from metrics import timer
+from openai_client import get_openai_client
 
 # Настройка логирования
 logging.basicConfig(
@@ -11,48 +17,192 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Настройка клиента OpenAI
-# Ключ API будет загружен из переменных окружения при запуске bot.py
-if os.getenv("OPENAI_API_KEY"):
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-else:
-    logger.warning("OPENAI_API_KEY не найден. Модуль транскрипции не будет работать.")
-    openai.api_key = None
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "whisper-1")
+AUDIO_CONVERT_WORKERS = int(os.getenv("AUDIO_CONVERT_WORKERS", "2"))
+
+# Длинные сообщения режутся по паузам на куски и расшифровываются параллельно.
+LONG_AUDIO_THRESHOLD = float(os.getenv("LONG_AUDIO_THRESHOLD", "300"))
+AUDIO_CHUNK_SECONDS = float(os.getenv("AUDIO_CHUNK_SECONDS", "120"))
+TRANSCRIBE_PARALLELISM = int(os.getenv("TRANSCRIBE_PARALLELISM", "4"))
+# Лимит Whisper на размер файла — 25 МБ, оставляем запас.
+WHISPER_MAX_UPLOAD_BYTES = 24 * 1024 * 1024
+# В каком окне перед границей куска искать паузу и какая пауза считается паузой.
+SILENCE_SEARCH_SECONDS = 15
+MIN_SILENCE_MS = 400
+
+ProgressCallback = Callable[[int, int, str], Awaitable[None]]
+
+# Форматы, которые Whisper принимает напрямую, и расширения для них.
+# Голосовые Telegram приходят в OGG/Opus и отправляются без перекодирования.
+WHISPER_FORMATS = {
+    "audio/ogg": "ogg",
+    "audio/opus": "ogg",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/mp4": "m4a",
+    "audio/x-m4a": "m4a",
+    "audio/m4a": "m4a",
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/webm": "webm",
+    "audio/flac": "flac",
+}
+
+# Конвертация через ffmpeg выполняется вне цикла событий.
+_executor = ThreadPoolExecutor(max_workers=AUDIO_CONVERT_WORKERS, thread_name_prefix="audio-convert")
+
+
+def _convert_to_mp3(data: bytes) -> bytes:
+    """Перекодирует аудио в MP3 в памяти (требуется ffmpeg)."""
+    from pydub import AudioSegment
+
+    audio = AudioSegment.from_file(io.BytesIO(data))
+    output = io.BytesIO()
+    audio.export(output, format="mp3")
+    return output.getvalue()
+
+
+def _split_on_silence(data: bytes, chunk_seconds: float = AUDIO_CHUNK_SECONDS) -> list:
+    """Режет аудио на куски не длиннее ``chunk_seconds``, по возможности по паузам.
+
+    Паузы ищутся только в окне перед каждой границей, поэтому стоимость не
+    зависит от длины всей записи. Возвращает список MP3-кусков в порядке следования.
+    """
+    from pydub import AudioSegment
+    from pydub.silence import detect_silence
+
+    audio = AudioSegment.from_file(io.BytesIO(data))
+    chunk_ms = int(chunk_seconds * 1000)
+    window_ms = min(SILENCE_SEARCH_SECONDS * 1000, chunk_ms // 2)
+    silence_thresh = audio.dBFS - 16
 
+    cuts = [0]
+    while len(audio) - cuts[-1] > chunk_ms:
+        boundary = cuts[-1] + chunk_ms
+        window_start = boundary - window_ms
+        silences = detect_silence(
+            audio[window_start:boundary],
+            min_silence_len=MIN_SILENCE_MS,
+            silence_thresh=silence_thresh,
+            seek_step=10,
+        )
+        if silences:
+            # Режем посередине последней паузы в окне
+            start, end = silences[-1]
+            boundary = window_start + (start + end) // 2
+        cuts.append(boundary)
+    cuts.append(len(audio))
 
-async def transcribe_voice(voice_file_id: str, context: ContextTypes.DEFAULT_TYPE) -> str | None:
+    chunks = []
+    for start, end in zip(cuts, cuts[1:]):
+        output = io.BytesIO()
+        audio[start:end].export(output, format="mp3", bitrate="64k")
+        chunks.append(output.getvalue())
+    return chunks
+
+
+def _audio_cost(seconds: float | None) -> float:
+    """Вес аудио в честной очереди: минуты записи, не меньше единицы."""
+    return max(1.0, (seconds or 0) / 60)
+
+
+async def _transcribe_long(client, data: bytes, duration: float | None, progress: ProgressCallback | None) -> str:
+    """Расшифровывает длинную запись кусками с ограниченным параллелизмом."""
+    loop = asyncio.get_running_loop()
+    async with ffmpeg_limiter.slot(cost=_audio_cost(duration)):
+        with timer("stage_seconds", stage="ffmpeg_split"):
+            chunks = await loop.run_in_executor(_executor, _split_on_silence, data)
+    logger.info(f"Длинное голосовое разбито на {len(chunks)} кусков.")
+
+    semaphore = asyncio.Semaphore(TRANSCRIBE_PARALLELISM)
+    texts: list = [None] * len(chunks)
+    done = 0
+
+    async def transcribe_chunk(index: int, chunk: bytes) -> None:
+        nonlocal done
+        async with semaphore, whisper_limiter.slot(cost=_audio_cost(AUDIO_CHUNK_SECONDS)):
+            with timer("stage_seconds", stage="whisper_chunk"):
+                response = await client.audio.transcriptions.create(
+                    model=WHISPER_MODEL,
+                    file=(f"voice_{index}.mp3", chunk),
+                )
+        texts[index] = response.text.strip()
+        done += 1
+        if progress:
+            # Показываем непрерывный уже готовый префикс текста
+            prefix = []
+            for text in texts:
+                if text is None:
+                    break
+                prefix.append(text)
+            await progress(done, len(chunks), " ".join(prefix))
+
+    await asyncio.gather(*(transcribe_chunk(i, chunk) for i, chunk in enumerate(chunks)))
+    return " ".join(texts)
+
+
+def shutdown_audio_pool() -> None:
+    """Останавливает пул конвертации аудио."""
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def transcribe_voice(
+    voice_file_id: str,
+    bot: Bot,
+    mime_type: str | None = "audio/ogg",
+    duration: float | None = None,
+    progress: ProgressCallback | None = None,
+) -> str | None:
     """
-    Скачивает голосовое сообщение, конвертирует его в mp3 и транскрибирует с помощью OpenAI Whisper.
+    Скачивает голосовое сообщение в память и транскрибирует его с помощью OpenAI Whisper.
+    Аудио перекодируется в mp3 только если Whisper не принимает исходный формат.
+    Записи длиннее ``LONG_AUDIO_THRESHOLD`` секунд или больше лимита загрузки
+    режутся по паузам и расшифровываются параллельно; ``progress`` вызывается
+    после каждого куска с числом готовых кусков, их общим числом и готовым текстом.
     Возвращает текст транскрипции или строку с описанием ошибки.
     """
-    if not openai.api_key:
+    client = get_openai_client()
+    if not client:
         return "Ошибка: Ключ OpenAI API не настроен."
+    import openai  # уже загружен вместе с клиентом
 
-    ogg_path = None
-    mp3_path = None
-
+    started = time.perf_counter()
     try:
-        voice_file = await context.bot.get_file(voice_file_id)
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.ogg') as ogg_file:
-            await voice_file.download_to_drive(ogg_file.name)
-            ogg_path = ogg_file.name
+        with timer("stage_seconds", stage="voice_download"):
+            voice_file = await bot.get_file(voice_file_id)
+            data = bytes(await voice_file.download_as_bytearray())
 
-        mp3_path = ogg_path.replace(".ogg", ".mp3")
+        if hasattr(duration, "total_seconds"):
+            duration = duration.total_seconds()
+        if (duration and duration > LONG_AUDIO_THRESHOLD) or len(data) > WHISPER_MAX_UPLOAD_BYTES:
+            try:
+                return await _transcribe_long(client, data, duration, progress)
+            except openai.APIError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка нарезки аудио (убедитесь, что ffmpeg установлен): {e}")
+                return "Ошибка: Не удалось обработать аудиофайл. Убедитесь, что на сервере установлен ffmpeg."
 
-        try:
-            audio = AudioSegment.from_ogg(ogg_path)
-            audio.export(mp3_path, format="mp3")
-        except Exception as e:
-            logger.error(f"Ошибка конвертации аудио (убедитесь, что ffmpeg установлен): {e}")
-            return "Ошибка: Не удалось обработать аудиофайл. Убедитесь, что на сервере установлен ffmpeg."
+        extension = WHISPER_FORMATS.get((mime_type or "").lower())
+        if extension is None:
+            try:
+                loop = asyncio.get_running_loop()
+                async with ffmpeg_limiter.slot(cost=_audio_cost(duration)):
+                    with timer("stage_seconds", stage="ffmpeg_convert"):
+                        data = await loop.run_in_executor(_executor, _convert_to_mp3, data)
+                extension = "mp3"
+            except Exception as e:
+                logger.error(f"Ошибка конвертации аудио (убедитесь, что ffmpeg установлен): {e}")
+                return "Ошибка: Не удалось обработать аудиофайл. Убедитесь, что на сервере установлен ffmpeg."
 
-        with open(mp3_path, "rb") as audio_file:
-            response = await openai.audio.transcriptions.acreate(
-                model="whisper-1",
-                file=audio_file
-            )
+        async with whisper_limiter.slot(cost=_audio_cost(duration)):
+            with timer("stage_seconds", stage="whisper"):
+                response = await client.audio.transcriptions.create(
+                    model=WHISPER_MODEL,
+                    file=(f"voice.{extension}", data),
+                )
 
+        logger.info(f"Голосовое ({len(data)} байт) расшифровано за {time.perf_counter() - started:.1f} с.")
         return response.text
 
     except openai.APIError as e:
@@ -61,9 +211,3 @@ async def transcribe_voice(voice_file_id: str, context: ContextTypes.DEFAULT_TYP
     except Exception as e:
         logger.error(f"Неожиданная ошибка при транскрипции: {e}")
         return "Ошибка: Произошла внутренняя ошибка при обработке вашего сообщения."
-    finally:
-        # Гарантированное удаление временных файлов
-        if ogg_path and os.path.exists(ogg_path):
-            os.remove(ogg_path)
-        if mp3_path and os.path.exists(mp3_path):
-            os.remove(mp3_path)
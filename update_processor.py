@@ -0,0 +1,75 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from fair_scheduler import chat_context
+from metrics import startup, timer
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления параллельно, но последовательно внутри одного чата.
+
+    Общее число одновременно обрабатываемых обновлений ограничено
+    ``max_concurrent_updates``. Обновления одного чата выполняются по очереди,
+    чтобы ``ConversationHandler`` не видел гонок между шагами диалога. Очередь
+    чата проходится до того, как занимается общий слот: иначе ждущие
+    обновления одного чата заняли бы все слоты и остановили остальные чаты.
+
+    ``after_update`` (если задан) вызывается после каждого обновления, пока
+    чат еще занят, — например, чтобы сразу записать состояние диалога.
+    """
+
+    def __init__(self, max_concurrent_updates: int,
+                 after_update: Callable[[], Awaitable[None]] | None = None):
+        super().__init__(max_concurrent_updates)
+        self.after_update = after_update
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._users: dict[int, int] = {}
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:  # type: ignore[misc]
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await super().process_update(update, coroutine)
+            return
+
+        lock = self._locks.setdefault(chat.id, asyncio.Lock())
+        self._users[chat.id] = self._users.get(chat.id, 0) + 1
+        try:
+            with timer("update_wait_seconds"):
+                await lock.acquire()
+            try:
+                # Общий слот занимается только на время самой обработки
+                await super().process_update(update, coroutine)
+            finally:
+                lock.release()
+        finally:
+            self._users[chat.id] -= 1
+            if not self._users[chat.id]:
+                # Больше никто не ждет этот чат — освобождаем блокировку
+                del self._users[chat.id]
+                del self._locks[chat.id]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        with timer("update_seconds"), chat_context(chat.id if chat else None):
+            try:
+                await coroutine
+            finally:
+                if self.after_update is not None:
+                    await self.after_update()
+        startup.mark("first_response")
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+URL_CACHE_PATH = os.getenv("URL_CACHE_PATH", "url_cache.sqlite3")
+URL_CACHE_TTL = float(os.getenv("URL_CACHE_TTL", str(30 * 24 * 3600)))
+URL_CACHE_MAX_ENTRIES = int(os.getenv("URL_CACHE_MAX_ENTRIES", "10000"))
+URL_CACHE_MAX_BYTES = int(os.getenv("URL_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# Параметры, которые не влияют на содержимое страницы.
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "yclid", "dclid", "msclkid", "igshid", "mc_cid", "mc_eid",
+    "ref", "ref_src", "ref_url", "si", "spm", "_hsenc", "_hsmi",
+}
+
+
+def normalize_url(url: str) -> str:
+    """Приводит URL к каноническому виду для использования в качестве ключа.
+
+    Схема и хост приводятся к нижнему регистру, удаляются порт по умолчанию,
+    фрагмент, трекинговые параметры (``utm_*``, ``fbclid`` и т.п.) и завершающий
+    слеш; оставшиеся параметры сортируются.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower() or "http"
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port and not ((scheme == "http" and parts.port == 80) or (scheme == "https" and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    )
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+def content_hash(text: str) -> str:
+    """Возвращает хэш извлеченного текста без учета пробельных различий."""
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+class UrlCache:
+    """Постоянный двухуровневый кэш результатов анализа ссылок в SQLite.
+
+    Первый уровень связывает нормализованный URL с хэшем содержимого, второй —
+    хэш содержимого с результатом анализа ``{title, summary, tags}``. Так одна
+    и та же статья по разным адресам анализируется один раз. Записи вытесняются
+    по TTL, по числу записей и по суммарному размеру (самые давно
+    использованные первыми).
+    """
+
+    def __init__(self, path: str = URL_CACHE_PATH, ttl: float = URL_CACHE_TTL,
+                 max_entries: int = URL_CACHE_MAX_ENTRIES, max_bytes: int = URL_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+        # Метрики
+        self.url_hits = 0
+        self.content_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS url_map (
+                    url TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS results (
+                    content_hash TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS results_accessed ON results(accessed_at);
+            """)
+        return self._conn
+
+    def _get_by_hash_sync(self, digest: str) -> dict | None:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT data, created_at FROM results WHERE content_hash = ?", (digest,)
+            ).fetchone()
+            if not row:
+                return None
+            if now - row[1] > self.ttl:
+                conn.execute("DELETE FROM results WHERE content_hash = ?", (digest,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE results SET accessed_at = ? WHERE content_hash = ?", (now, digest))
+            conn.commit()
+            return json.loads(row[0])
+
+    def _get_by_url_sync(self, url: str) -> dict | None:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT content_hash FROM url_map WHERE url = ?", (normalize_url(url),)
+            ).fetchone()
+        return self._get_by_hash_sync(row[0]) if row else None
+
+    def _link_sync(self, urls: list, digest: str) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO url_map (url, content_hash, created_at) VALUES (?, ?, ?)",
+                [(normalize_url(url), digest, now) for url in urls if url],
+            )
+            conn.commit()
+
+    def _put_sync(self, urls: list, digest: str, data: dict) -> None:
+        now = time.time()
+        payload = json.dumps(data, ensure_ascii=False)
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO results (content_hash, data, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (digest, payload, len(payload.encode("utf-8")), now, now),
+            )
+            conn.commit()
+        self._link_sync(urls, digest)
+        self._evict_sync()
+
+    def _evict_sync(self) -> None:
+        with self._lock:
+            conn = self._connect()
+            removed = conn.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.ttl,)).rowcount
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+            if count > self.max_entries or total > self.max_bytes:
+                # Вытесняем давно использованные записи, пока не уложимся в лимиты
+                for digest, size in conn.execute(
+                    "SELECT content_hash, size FROM results ORDER BY accessed_at"
+                ).fetchall():
+                    if count <= self.max_entries and total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM results WHERE content_hash = ?", (digest,))
+                    count -= 1
+                    total -= size
+                    removed += 1
+            if removed:
+                conn.execute("DELETE FROM url_map WHERE content_hash NOT IN (SELECT content_hash FROM results)")
+                self.evictions += removed
+            conn.commit()
+
+    async def get_by_url(self, url: str) -> dict | None:
+        """Возвращает результат анализа по URL без загрузки страницы."""
+        data = await asyncio.to_thread(self._get_by_url_sync, url)
+        if data is not None:
+            self.url_hits += 1
+        return data
+
+    async def get_by_hash(self, digest: str, urls: list) -> dict | None:
+        """Возвращает результат по хэшу содержимого и запоминает для него новые URL."""
+        data = await asyncio.to_thread(self._get_by_hash_sync, digest)
+        if data is None:
+            self.misses += 1
+            return None
+        self.content_hits += 1
+        await asyncio.to_thread(self._link_sync, urls, digest)
+        return data
+
+    async def put(self, urls: list, digest: str, data: dict) -> None:
+        """Сохраняет результат анализа для содержимого и всех его URL."""
+        await asyncio.to_thread(self._put_sync, urls, digest, data)
+
+    def stats(self) -> dict:
+        """Возвращает счетчики попаданий и промахов."""
+        return {
+            "url_hits": self.url_hits,
+            "content_hits": self.content_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def close(self) -> None:
+        """Закрывает соединение с базой."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+url_cache = UrlCache()
@@ -0,0 +1,156 @@
+import os
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from urllib.parse import urljoin
+
+import httpx
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+URL_FETCH_TIMEOUT = float(os.getenv("URL_FETCH_TIMEOUT", "10"))
+URL_MAX_BYTES = int(os.getenv("URL_MAX_BYTES", str(2 * 1024 * 1024)))
+URL_MAX_REDIRECTS = int(os.getenv("URL_MAX_REDIRECTS", "5"))
+URL_MAX_CONNECTIONS = int(os.getenv("URL_MAX_CONNECTIONS", "20"))
+# Сколько ответов хранить для условных запросов (ETag / Last-Modified): не больше
+# URL_VALIDATOR_CACHE_SIZE страниц общим объемом не больше URL_VALIDATOR_CACHE_BYTES.
+URL_VALIDATOR_CACHE_SIZE = int(os.getenv("URL_VALIDATOR_CACHE_SIZE", "256"))
+URL_VALIDATOR_CACHE_BYTES = int(os.getenv("URL_VALIDATOR_CACHE_BYTES", str(8 * 1024 * 1024)))
+
+
+@dataclass
+class FetchResult:
+    """Результат загрузки HTML-страницы."""
+    url: str
+    html: str
+    truncated: bool = False
+    not_modified: bool = False
+    etag: str | None = None
+    last_modified: str | None = None
+
+
+_client: httpx.AsyncClient | None = None
+_validators: "OrderedDict[str, FetchResult]" = OrderedDict()
+_validators_bytes = 0
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Возвращает общий HTTP-клиент с пулом соединений."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT},
+            timeout=URL_FETCH_TIMEOUT,
+            follow_redirects=False,
+            limits=httpx.Limits(
+                max_connections=URL_MAX_CONNECTIONS,
+                max_keepalive_connections=URL_MAX_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+async def close_http_client() -> None:
+    """Закрывает общий HTTP-клиент."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+
+
+def _remember(url: str, result: FetchResult) -> None:
+    global _validators_bytes
+    if not (result.etag or result.last_modified) or result.truncated:
+        return
+    # Тело страницы нужно только для ответа 304; страница больше всего бюджета не хранится
+    if len(result.html) > URL_VALIDATOR_CACHE_BYTES:
+        return
+    previous = _validators.pop(url, None)
+    if previous is not None:
+        _validators_bytes -= len(previous.html)
+    _validators[url] = result
+    _validators_bytes += len(result.html)
+    while len(_validators) > URL_VALIDATOR_CACHE_SIZE or _validators_bytes > URL_VALIDATOR_CACHE_BYTES:
+        _, evicted = _validators.popitem(last=False)
+        _validators_bytes -= len(evicted.html)
+
+
+async def fetch_html(url: str, max_bytes: int = URL_MAX_BYTES) -> FetchResult | None:
+    """
+    Загружает HTML-страницу потоково, не читая больше ``max_bytes`` байт.
+    Следует редиректам (не более ``URL_MAX_REDIRECTS``), прерывает загрузку
+    для не-HTML ответов и использует ETag/Last-Modified для повторных запросов.
+    Возвращает ``None``, если страницу получить не удалось.
+    """
+    client = get_http_client()
+    current_url = url
+
+    try:
+        for _ in range(URL_MAX_REDIRECTS + 1):
+            headers = {}
+            cached = _validators.get(current_url)
+            if cached:
+                if cached.etag:
+                    headers["If-None-Match"] = cached.etag
+                if cached.last_modified:
+                    headers["If-Modified-Since"] = cached.last_modified
+
+            async with client.stream("GET", current_url, headers=headers) as response:
+                if response.is_redirect:
+                    location = response.headers.get("location")
+                    if not location:
+                        logger.error(f"Редирект без Location для {current_url}")
+                        return None
+                    current_url = urljoin(str(response.url), location)
+                    continue
+
+                if response.status_code == 304 and cached:
+                    logger.info(f"Страница не изменилась: {current_url}")
+                    _validators.move_to_end(current_url)
+                    return FetchResult(
+                        url=cached.url, html=cached.html, not_modified=True,
+                        etag=cached.etag, last_modified=cached.last_modified,
+                    )
+
+                response.raise_for_status()  # Проверка на HTTP ошибки
+
+                content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+                if content_type and content_type not in HTML_CONTENT_TYPES:
+                    logger.warning(f"Пропускаю {current_url}: тип содержимого {content_type} не HTML.")
+                    return None
+
+                chunks = []
+                received = 0
+                truncated = False
+                async for chunk in response.aiter_bytes():
+                    chunks.append(chunk)
+                    received += len(chunk)
+                    if received >= max_bytes:
+                        truncated = True
+                        break
+
+                body = b"".join(chunks)[:max_bytes]
+                result = FetchResult(
+                    url=str(response.url),
+                    html=body.decode(response.charset_encoding or "utf-8", errors="replace"),
+                    truncated=truncated,
+                    etag=response.headers.get("etag"),
+                    last_modified=response.headers.get("last-modified"),
+                )
+                if truncated:
+                    logger.info(f"Страница {current_url} обрезана до {max_bytes} байт.")
+                _remember(current_url, result)
+                return result
+
+        logger.error(f"Слишком много редиректов для {url}")
+        return None
+    except (httpx.HTTPError, LookupError) as e:
+        logger.error(f"Ошибка при загрузке URL {url}: {e}")
+        return None
@@ -1,8 +1,19 @@
 import os
+import re
+import time
+import asyncio
 import logging
-import requests
-import openai
-from bs4 import BeautifulSoup
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+from urllib.parse import urljoin
+
+from fair_scheduler import openai_limiter
+from html_extractor import extract_async
+from metrics import inc, observe, timer
+from openai_client import get_openai_client
+from text_budget import count_tokens, dedupe_text, split_chunks, truncate_to_tokens, warm_up_tokenizer
+from url_cache import content_hash, url_cache
+from url_fetcher import fetch_html
 
 # Настройка логирования
 logging.basicConfig(
@@ -10,127 +21,340 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Настройка клиента OpenAI
-if os.getenv("OPENAI_API_KEY"):
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-else:
-    logger.warning("OPENAI_API_KEY не найден. Модуль обработки URL не будет работать.")
-    openai.api_key = None
+# 1 — получать ответ OpenAI потоком и сообщать о полях по мере их появления.
+OPENAI_STREAMING = os.getenv("OPENAI_STREAMING", "1") == "1"
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+# Сколько токенов текста страницы отправлять одним запросом. Длинные страницы
+# делятся на куски по OPENAI_CHUNK_TOKENS, которые кратко пересказываются
+# параллельно, и итоговый ответ строится по этим пересказам.
+OPENAI_INPUT_TOKENS = int(os.getenv("OPENAI_INPUT_TOKENS", "6000"))
+OPENAI_CHUNK_TOKENS = int(os.getenv("OPENAI_CHUNK_TOKENS", "3000"))
+OPENAI_MAX_CHUNKS = int(os.getenv("OPENAI_MAX_CHUNKS", "8"))
+OPENAI_MAP_PARALLELISM = int(os.getenv("OPENAI_MAP_PARALLELISM", "4"))
+# Длина пересказа одного куска.
+CHUNK_SUMMARY_MAX_TOKENS = 300
 
-def get_url_content(url: str) -> dict | None:
-    """
-    Получает содержимое веб-страницы по URL.
-    Возвращает словарь с заголовком и основным текстом.
+
+
+async def warm_up_analysis_tokenizer() -> None:
+    """Загружает токенизатор модели анализа ссылок в отдельном потоке."""
+    await asyncio.to_thread(warm_up_tokenizer, OPENAI_MODEL)
+
+
+def _openai_cost(tokens: int) -> float:
+    """Вес запроса в честной очереди OpenAI: тысячи токенов входа, не меньше единицы."""
+    return max(1.0, tokens / 1000)
+
+
+FIELD_PATTERN = re.compile(r"^\s*(Title|Tags|Summary)\s*:\s*", re.IGNORECASE)
+
+# Колбэк получает словарь с уже известными полями ответа (title, tags, summary).
+AnalysisCallback = Callable[[dict], Awaitable[None]]
+
+
+@dataclass
+class TokenUsage:
+    """Суммарный расход токенов OpenAI на одну ссылку."""
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    def add(self, usage) -> None:
+        self.calls += 1
+        if usage is not None:
+            self.prompt_tokens += usage.prompt_tokens or 0
+            self.completion_tokens += usage.completion_tokens or 0
+            inc("openai_tokens_total", usage.prompt_tokens or 0, kind="prompt")
+            inc("openai_tokens_total", usage.completion_tokens or 0, kind="completion")
+
+
+def parse_tags(tags_str: str) -> list:
+    """Разбирает строку тегов через запятую."""
+    return [tag.strip() for tag in tags_str.strip().strip("[]").split(',') if tag.strip()]
+
+
+class AnalysisStreamParser:
+    """Инкрементальный разбор ответа вида ``Title: ... / Tags: ... / Summary: ...``.
+
+    Поле считается окончательным, когда его строка завершена переводом
+    строки. Саммари идет последним и может занимать несколько строк, поэтому
+    оно окончательно только после ``close()``.
     """
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()  # Проверка на HTTP ошибки
 
-        soup = BeautifulSoup(response.text, 'html.parser')
+    def __init__(self):
+        self._buffer = ""
+        self._current: str | None = None
+        self.fields: dict = {}
+        self.final: set = set()
+
+    def feed(self, delta: str) -> None:
+        """Добавляет очередной фрагмент ответа."""
+        self._buffer += delta
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            self._consume(line, self.fields)
+            if self._current and self._current != "summary":
+                self.final.add(self._current)
 
-        original_title = soup.title.string if soup.title else "Без заголовка"
+    def close(self) -> None:
+        """Разбирает остаток ответа после окончания потока."""
+        self._consume(self._buffer, self.fields)
+        self._buffer = ""
+        self.final.update(self.fields)
 
-        # Простой способ извлечь текст: взять все параграфы
-        paragraphs = soup.find_all('p')
-        text = "\n".join([p.get_text() for p in paragraphs])
+    def _consume(self, line: str, fields: dict) -> None:
+        match = FIELD_PATTERN.match(line)
+        if match:
+            self._current = match.group(1).lower()
+            fields[self._current] = line[match.end():].strip()
+        elif self._current == "summary" and line.strip():
+            fields["summary"] = f"{fields['summary']}\n{line.strip()}".strip()
 
-        if not text:
-            # Если параграфов нет, попробуем извлечь основной контент
-            main_content = soup.find('main') or soup.find('article') or soup.find('body')
-            if main_content:
-                text = main_content.get_text(separator='\n', strip=True)
+    @property
+    def title_and_tags_ready(self) -> bool:
+        return {"title", "tags"} <= self.final
 
-        return {"title": original_title, "text": text}
-    except requests.RequestException as e:
-        logger.error(f"Ошибка при загрузке URL {url}: {e}")
+    def snapshot(self) -> dict:
+        """Возвращает поля с учетом недописанной строки (для показа пользователю)."""
+        fields = dict(self.fields)
+        current = self._current
+        self._consume(self._buffer, fields)
+        self._current = current
+        return self.result(fields)
+
+    def result(self, fields: dict | None = None) -> dict:
+        fields = self.fields if fields is None else fields
+        parsed = {key: value for key, value in fields.items() if key != "tags"}
+        if "tags" in fields:
+            parsed["tags"] = parse_tags(fields["tags"])
+        return parsed
+
+
+async def get_url_content(url: str) -> dict | None:
+    """
+    Получает содержимое веб-страницы по URL.
+    Возвращает словарь с заголовком и основным текстом.
+    """
+    with timer("stage_seconds", stage="fetch"):
+        page = await fetch_html(url)
+    if not page:
         return None
 
-async def get_summary_and_tags_from_openai(text: str, original_title: str) -> dict | None:
+    try:
+        with timer("stage_seconds", stage="extract"):
+            extracted = await extract_async(page.html)
+    except Exception as e:
+        logger.error(f"Ошибка при разборе страницы {url}: {e}")
+        return None
+
+    canonical = extracted.get('canonical')
+    return {
+        "title": extracted.get('title') or "Без заголовка",
+        "text": extracted.get('text') or "",
+        "url": page.url,
+        "canonical": urljoin(page.url, canonical) if canonical else None,
+    }
+
+async def get_summary_and_tags_from_openai(text: str, original_title: str,
+                                           on_progress: AnalysisCallback | None = None,
+                                           on_ready: AnalysisCallback | None = None) -> dict | None:
     """
     Генерирует заголовок, саммари и теги для текста с помощью OpenAI.
+    В потоковом режиме ``on_progress`` получает частично разобранный ответ,
+    а ``on_ready`` вызывается, как только заголовок и теги окончательны.
     """
-    if not openai.api_key:
+    client = get_openai_client()
+    if not client:
         return None
 
-    # Обрезаем текст, чтобы избежать превышения лимита токенов
-    max_chars = 15000
-    truncated_text = text[:max_chars]
+    usage = TokenUsage()
+    text = dedupe_text(text)
+    text_tokens = count_tokens(text, OPENAI_MODEL)
+    source = "the text from a web page"
+    try:
+        if text_tokens > OPENAI_INPUT_TOKENS:
+            text = await _summarize_chunks(client, text, original_title, usage)
+            source = "notes on consecutive parts of a long web page"
+        text = truncate_to_tokens(text, OPENAI_INPUT_TOKENS, OPENAI_MODEL)
+    except Exception as e:
+        logger.error(f"Ошибка при пересказе частей страницы в OpenAI: {e}")
+        return None
 
-    system_prompt = "You are an expert content analyst. Your task is to process the text from a web page and provide a concise title, a short summary, and relevant tags."
+    system_prompt = "You are an expert content analyst. Your task is to process the text from a web page and provide a concise title, relevant tags, and a short summary."
+    # Саммари идет последним: заголовок и теги окончательны раньше, и запись
+    # в Notion можно начать, пока саммари еще генерируется.
     user_prompt = f"""
-    Here is the text from a web page. The original title was "{original_title}".
+    Here is {source}. The original title was "{original_title}".
 
     Text:
     ---
-    {truncated_text}
+    {text}
     ---
 
     Please analyze the text and provide the following in the specified format:
     1.  A new, concise, and engaging title for this content.
-    2.  A summary of the content in 2-4 sentences.
-    3.  A list of 3-5 relevant keywords or tags, separated by commas.
+    2.  A list of 3-5 relevant keywords or tags, separated by commas.
+    3.  A summary of the content in 2-4 sentences.
 
     Please format your response exactly as follows:
     Title: [Your generated title here]
-    Summary: [Your generated summary here]
     Tags: [tag1, tag2, tag3]
+    Summary: [Your generated summary here]
     """
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
 
+    parser = AnalysisStreamParser()
     try:
-        response = await openai.chat.completions.acreate(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.5,
-        )
-
-        content = response.choices[0].message.content
-
-        # Парсим структурированный ответ
-        parsed_data = {}
-        for line in content.split('\n'):
-            if line.startswith("Title:"):
-                parsed_data['title'] = line.replace("Title:", "").strip()
-            elif line.startswith("Summary:"):
-                parsed_data['summary'] = line.replace("Summary:", "").strip()
-            elif line.startswith("Tags:"):
-                tags_str = line.replace("Tags:", "").strip()
-                parsed_data['tags'] = [tag.strip() for tag in tags_str.split(',')]
+        async with openai_limiter.slot(cost=_openai_cost(min(text_tokens, OPENAI_INPUT_TOKENS))):
+            with timer("stage_seconds", stage="openai"):
+                if OPENAI_STREAMING:
+                    await _stream_analysis(client, messages, parser, usage, on_progress, on_ready)
+                else:
+                    response = await client.chat.completions.create(
+                        model=OPENAI_MODEL,
+                        messages=messages,
+                        temperature=0.5,
+                    )
+                    usage.add(response.usage)
+                    parser.feed(response.choices[0].message.content)
+        parser.close()
 
+        parsed_data = parser.result()
         if 'title' not in parsed_data or 'summary' not in parsed_data:
              raise ValueError("Не удалось распарсить ответ от OpenAI")
+        parsed_data.setdefault('tags', [])
 
         return parsed_data
     except Exception as e:
         logger.error(f"Ошибка при работе с OpenAI API: {e}")
         return None
+    finally:
+        logger.info(
+            f"Токены OpenAI ({OPENAI_MODEL}) для «{original_title}»: текст {text_tokens}, "
+            f"запросов {usage.calls}, prompt {usage.prompt_tokens}, completion {usage.completion_tokens}"
+        )
 
 
-async def process_url(url: str) -> dict | None:
+async def _summarize_chunks(client, text: str, original_title: str, usage: TokenUsage) -> str:
+    """Этап map: параллельно пересказывает куски длинного текста.
+
+    Возвращает пересказы кусков по порядку. Куски сверх ``OPENAI_MAX_CHUNKS``
+    отбрасываются, неудачные пересказы пропускаются.
+    """
+    chunks = split_chunks(text, OPENAI_CHUNK_TOKENS, OPENAI_MODEL)
+    if len(chunks) > OPENAI_MAX_CHUNKS:
+        logger.warning(f"Страница «{original_title}» слишком длинная: анализируются {OPENAI_MAX_CHUNKS} из {len(chunks)} частей.")
+        chunks = chunks[:OPENAI_MAX_CHUNKS]
+    semaphore = asyncio.Semaphore(OPENAI_MAP_PARALLELISM)
+
+    async def summarize(index: int, chunk: str) -> str | None:
+        prompt = (
+            f'This is part {index + 1} of {len(chunks)} of a web page titled "{original_title}".\n'
+            "Summarize this part in 3-5 sentences, keeping key facts, names and terms.\n\n"
+            f"---\n{chunk}\n---"
+        )
+        async with semaphore:
+            try:
+                async with openai_limiter.slot(cost=_openai_cost(OPENAI_CHUNK_TOKENS)), \
+                        timer("stage_seconds", stage="openai_map"):
+                    response = await client.chat.completions.create(
+                        model=OPENAI_MODEL,
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=0.3,
+                        max_tokens=CHUNK_SUMMARY_MAX_TOKENS,
+                    )
+            except Exception as e:
+                logger.warning(f"Не удалось пересказать часть {index + 1}/{len(chunks)}: {e}")
+                return None
+        usage.add(response.usage)
+        return response.choices[0].message.content
+
+    notes = await asyncio.gather(*(summarize(i, chunk) for i, chunk in enumerate(chunks)))
+    notes = [f"Part {i + 1}: {note.strip()}" for i, note in enumerate(notes) if note]
+    if not notes:
+        raise RuntimeError("ни одна часть страницы не пересказана")
+    return "\n\n".join(notes)
+
+
+async def _stream_analysis(client, messages: list, parser: AnalysisStreamParser, usage: TokenUsage,
+                           on_progress: AnalysisCallback | None, on_ready: AnalysisCallback | None) -> None:
+    """Читает ответ OpenAI потоком, сообщая о ходе разбора через колбэки.
+
+    ``on_progress`` вызывается на каждом фрагменте (ограничивать частоту —
+    забота вызывающего), ``on_ready`` — один раз, когда заголовок и теги
+    окончательны.
+    """
+    started = time.perf_counter()
+    stream = await client.chat.completions.create(
+        model=OPENAI_MODEL,
+        messages=messages,
+        temperature=0.5,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    ready_sent = False
+    first_token = True
+    async for chunk in stream:
+        if chunk.usage is not None:
+            # Последний фрагмент потока несет расход токенов и не содержит текста
+            usage.add(chunk.usage)
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if not delta:
+            continue
+        if first_token:
+            first_token = False
+            observe("openai_first_token_seconds", time.perf_counter() - started)
+        parser.feed(delta)
+        if on_ready and not ready_sent and parser.title_and_tags_ready:
+            ready_sent = True
+            await on_ready(parser.result())
+        if on_progress:
+            await on_progress(parser.snapshot())
+
+
+async def process_url(url: str, on_progress: AnalysisCallback | None = None,
+                      on_ready: AnalysisCallback | None = None) -> dict | None:
     """
     Полный процесс обработки URL: скачивание, анализ, генерация данных.
+    Повторные ссылки и одинаковое содержимое берутся из постоянного кэша.
+    Колбэки передаются в ``get_summary_and_tags_from_openai``; при попадании
+    в кэш они не вызываются.
     """
     logger.info(f"Начинаю обработку URL: {url}")
+    started = time.perf_counter()
+
+    cached = await url_cache.get_by_url(url)
+    if cached:
+        logger.info(f"URL найден в кэше: {cached.get('title')}")
+        return {**cached, "url": url}
 
-    content = get_url_content(url)
+    content = await get_url_content(url)
     if not content or not content.get('text'):
         logger.warning("Не удалось извлечь контент со страницы.")
         return {"title": content.get('title') if content else url, "summary": "Не удалось извлечь основной текст.", "tags": [], "url": url}
 
+    urls = [url, content.get('url'), content.get('canonical')]
+    digest = content_hash(content['text'])
+    cached = await url_cache.get_by_hash(digest, urls)
+    if cached:
+        logger.info(f"Содержимое уже анализировалось: {cached.get('title')}")
+        return {**cached, "url": url}
+
     logger.info("Контент извлечен, отправляю в OpenAI для анализа...")
 
-    processed_data = await get_summary_and_tags_from_openai(content['text'], content['title'])
+    processed_data = await get_summary_and_tags_from_openai(
+        content['text'], content['title'], on_progress=on_progress, on_ready=on_ready
+    )
 
     if not processed_data:
         logger.warning("Не удалось получить анализ от OpenAI. Использую исходный заголовок.")
         return {"title": content['title'], "summary": "Анализ не удался.", "tags": [], "url": url}
 
+    await url_cache.put(urls, digest, processed_data)
     processed_data['url'] = url
-    logger.info(f"URL успешно обработан: {processed_data['title']}")
+    logger.info(f"URL успешно обработан за {time.perf_counter() - started:.1f} с: {processed_data['title']}")
 
     return processed_data